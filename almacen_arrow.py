@@ -0,0 +1,244 @@
+"""
+Almacén versionado de datasets en Arrow IPC para compartirlos entre procesos de Streamlit.
+refrescador.py publica cada versión (Data Maestra y Calidad limpias + pre-agregados) en su
+propio directorio y cambia el puntero ACTUAL de forma atómica; cada proceso de la app abre
+los archivos con memory-map, así las columnas numéricas y de fecha se leen sin copia desde
+el page cache del sistema, compartido por todos los procesos.
+
+Estructura:
+    <dir>/ACTUAL                      -> id de la versión vigente
+    <dir>/<version>/manifiesto.json   -> col_map, filas, columnas convertidas, metadatos
+    <dir>/<version>/<tabla>.arrow     -> una tabla por archivo (IPC sin compresión)
+    <dir>/<version>/<tabla>/<AAAA-MM>.arrow -> tablas particionadas por mes (Data Maestra y
+                                         Calidad); el manifiesto guarda el mapa de zonas de
+                                         cada partición (rango de fechas, filas, valores de
+                                         las columnas de filtro) para leer solo las que sirven
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+ARCHIVO_ACTUAL = "ACTUAL"
+ARCHIVO_MANIFIESTO = "manifiesto.json"
+VERSIONES_CONSERVADAS = 3
+PARTICION_SIN_FECHA = "sin-fecha"
+
+def directorio_configurado():
+    """Directorio del almacén (ALMACEN_ARROW_DIR); None si el almacén no está en uso."""
+    return os.environ.get("ALMACEN_ARROW_DIR") or None
+
+def version_actual(directorio=None):
+    """
+    Versión vigente según el puntero ACTUAL (lectura de un archivo pequeño, apta para cada rerun).
+
+    Returns:
+        str | None: Id de versión, o None si no hay almacén configurado o aún no se publicó nada
+    """
+    directorio = directorio or directorio_configurado()
+    if not directorio or not ARROW_AVAILABLE:
+        return None
+    try:
+        with open(os.path.join(directorio, ARCHIVO_ACTUAL), encoding='utf-8') as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return version if version and os.path.isdir(os.path.join(directorio, version)) else None
+
+def _tabla_arrow(df):
+    """
+    DataFrame -> pa.Table. Las columnas object con tipos mezclados (típico de get_all_records)
+    se guardan como texto; se devuelven sus nombres para dejarlo registrado en el manifiesto.
+    """
+    columnas, convertidas = {}, []
+    for col in df.columns:
+        serie = df[col]
+        try:
+            columnas[str(col)] = pa.array(serie, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columnas[str(col)] = pa.array(serie.map(lambda v: None if pd.isna(v) else str(v)), type=pa.string())
+            convertidas.append(str(col))
+    return pa.table(columnas), convertidas
+
+def _escribir(tabla, ruta):
+    # Sin compresión: es lo que permite leer los buffers directo del memory-map
+    with pa.OSFile(ruta, 'wb') as sink:
+        with pa.ipc.new_file(sink, tabla.schema) as writer:
+            writer.write_table(tabla)
+
+def _particiones_mensuales(df, tabla, col_fecha, cols_zona, destino, nombre):
+    """
+    Escribe una partición por mes de col_fecha (fechas nulas en PARTICION_SIN_FECHA) y
+    devuelve su mapa de zonas. Las particiones salen de la tabla ya convertida, así todas
+    comparten el mismo esquema.
+    """
+    fechas = pd.to_datetime(df[col_fecha], errors='coerce').reset_index(drop=True)
+    meses = (fechas.dt.year * 100 + fechas.dt.month).to_numpy()
+    grupos = pd.Series(np.arange(len(df))).groupby(meses, dropna=False, sort=True).indices
+    os.makedirs(os.path.join(destino, nombre))
+    zonas = []
+    for mes, filas in grupos.items():
+        clave = PARTICION_SIN_FECHA if pd.isna(mes) else f"{int(mes) // 100:04d}-{int(mes) % 100:02d}"
+        archivo = f"{nombre}/{clave}.arrow"
+        _escribir(tabla.take(filas), os.path.join(destino, archivo))
+        rango = fechas.iloc[filas]
+        zonas.append({'archivo': archivo, 'filas': len(filas),
+                      'desde': None if pd.isna(mes) else rango.min().date().isoformat(),
+                      'hasta': None if pd.isna(mes) else rango.max().date().isoformat(),
+                      'valores': {col: sorted(df[col].iloc[filas].dropna().astype(str).unique().tolist())
+                                  for col in cols_zona if col in df.columns}})
+    return zonas
+
+def publicar(tablas, metadatos=None, directorio=None, conservar=VERSIONES_CONSERVADAS, particiones=None):
+    """
+    Publica una versión nueva y la deja vigente de forma atómica.
+
+    Los archivos se escriben en un directorio temporal que luego se renombra; el puntero
+    ACTUAL se reemplaza con os.replace, así un lector nunca ve una versión a medio escribir.
+
+    Args:
+        tablas (dict): {nombre: DataFrame}
+        metadatos (dict, optional): Datos extra para el manifiesto (ej. col_map, mensajes de debug)
+        directorio (str, optional): Directorio del almacén; por defecto ALMACEN_ARROW_DIR
+        conservar (int): Versiones anteriores que se mantienen en disco
+        particiones (dict, optional): {nombre: (columna de fecha, [columnas del mapa de zonas])}
+            para las tablas que se guardan particionadas por mes
+
+    Returns:
+        str: Id de la versión publicada
+    """
+    directorio = directorio or directorio_configurado()
+    if not directorio:
+        raise ValueError("Sin directorio de almacén (usar --dir o ALMACEN_ARROW_DIR)")
+    os.makedirs(directorio, exist_ok=True)
+
+    version = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    temporal = os.path.join(directorio, f".tmp-{version}")
+    os.makedirs(temporal)
+    manifiesto = dict(metadatos or {}, version=version, publicado=datetime.now().isoformat(timespec='seconds'), tablas={})
+    for nombre, df in tablas.items():
+        tabla, convertidas = _tabla_arrow(df)
+        manifiesto['tablas'][nombre] = {'filas': tabla.num_rows, 'columnas': tabla.column_names,
+                                        'convertidas_a_texto': convertidas}
+        col_fecha, cols_zona = (particiones or {}).get(nombre, (None, ()))
+        if col_fecha and col_fecha in df.columns:
+            manifiesto['tablas'][nombre].update(columna_fecha=col_fecha, particiones=_particiones_mensuales(
+                df, tabla, col_fecha, list(cols_zona), temporal, nombre))
+        else:
+            _escribir(tabla, os.path.join(temporal, f"{nombre}.arrow"))
+    with open(os.path.join(temporal, ARCHIVO_MANIFIESTO), 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2, default=str)
+
+    os.rename(temporal, os.path.join(directorio, version))
+    puntero_tmp = os.path.join(directorio, f".{ARCHIVO_ACTUAL}.{os.getpid()}.tmp")
+    with open(puntero_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(puntero_tmp, os.path.join(directorio, ARCHIVO_ACTUAL))
+
+    limpiar_versiones(directorio, conservar)
+    return version
+
+def limpiar_versiones(directorio, conservar=VERSIONES_CONSERVADAS):
+    """
+    Borra las versiones más antiguas, dejando la vigente y `conservar` en total.
+    En Linux/macOS los procesos que aún tengan mapeada una versión borrada la siguen leyendo
+    hasta soltarla; por eso se conservan varias y no solo la última.
+    """
+    vigente = version_actual(directorio)
+    versiones = sorted(d for d in os.listdir(directorio)
+                       if os.path.isdir(os.path.join(directorio, d)) and not d.startswith('.'))
+    for version in versiones[:-conservar] if conservar else versiones:
+        if version != vigente:
+            shutil.rmtree(os.path.join(directorio, version), ignore_errors=True)
+    # Restos de publicaciones interrumpidas
+    for resto in os.listdir(directorio):
+        ruta = os.path.join(directorio, resto)
+        if resto.startswith('.tmp-') and time.time() - os.path.getmtime(ruta) > 3600:
+            shutil.rmtree(ruta, ignore_errors=True)
+
+def leer_manifiesto(version, directorio=None):
+    """Manifiesto de una versión publicada."""
+    directorio = directorio or directorio_configurado()
+    with open(os.path.join(directorio, version, ARCHIVO_MANIFIESTO), encoding='utf-8') as f:
+        return json.load(f)
+
+def particiones_en_rango(info_tabla, desde=None, hasta=None, filtros=None):
+    """
+    Poda por mapa de zonas: particiones de una tabla cuyo rango de fechas toca [desde, hasta]
+    y que contienen los valores pedidos en `filtros`. Con desde o hasta se omite la partición
+    sin fecha (sus filas no pasan ningún filtro de periodo).
+
+    Args:
+        info_tabla (dict): Entrada de la tabla en el manifiesto (manifiesto['tablas'][nombre])
+        desde, hasta (date, optional): Extremos del periodo (None: sin límite)
+        filtros (dict, optional): {columna del mapa de zonas: valor}
+
+    Returns:
+        tuple: Archivos de las particiones, en orden de mes
+    """
+    elegidas = []
+    for zona in info_tabla.get('particiones', []):
+        if zona['desde'] is None:
+            if desde is not None or hasta is not None:
+                continue
+        elif ((desde is not None and zona['hasta'] < desde.isoformat())
+              or (hasta is not None and zona['desde'] > hasta.isoformat())):
+            continue
+        if any(col in zona['valores'] and str(valor) not in zona['valores'][col]
+               for col, valor in (filtros or {}).items()):
+            continue
+        elegidas.append(zona['archivo'])
+    return tuple(elegidas)
+
+def valores_zonas(info_tabla, columna):
+    """Valores distintos de una columna del mapa de zonas en toda la tabla (sin leer datos)."""
+    return sorted({v for zona in info_tabla.get('particiones', []) for v in zona['valores'].get(columna, [])})
+
+def _leer(ruta):
+    with pa.memory_map(ruta, 'r') as fuente:
+        return pa.ipc.open_file(fuente).read_all()
+
+def abrir_tabla(version, nombre, directorio=None, particiones=None, columnas=None):
+    """
+    Abre una tabla publicada con memory-map y la devuelve como DataFrame.
+
+    Con split_blocks=True cada columna numérica o de fecha sin nulos queda como vista de solo
+    lectura sobre el archivo mapeado (sin copia, compartida vía page cache entre procesos);
+    las columnas de texto sí se materializan como objetos Python en cada proceso. De una
+    tabla particionada se leen solo `particiones` (todas si es None) y, al unir varias, las
+    columnas se copian: la memoria crece con el periodo pedido y no con la temporada.
+
+    Args:
+        particiones (iterable, optional): Archivos elegidos con particiones_en_rango
+        columnas (list, optional): Solo estas columnas (las demás no se materializan)
+
+    Returns:
+        pd.DataFrame: Tabla (None si la versión no la incluye)
+    """
+    directorio = directorio or directorio_configurado()
+    ruta = os.path.join(directorio, version, f"{nombre}.arrow")
+    if os.path.exists(ruta):
+        tabla = _leer(ruta)
+    elif os.path.isdir(os.path.join(directorio, version, nombre)):
+        todas = [zona['archivo'] for zona in leer_manifiesto(version, directorio)['tablas'][nombre]['particiones']]
+        elegidas = todas if particiones is None else list(particiones)
+        # Sin particiones elegidas: tabla vacía con el esquema de la primera
+        tabla = (pa.concat_tables([_leer(os.path.join(directorio, version, a)) for a in elegidas]) if elegidas
+                 else _leer(os.path.join(directorio, version, todas[0])).slice(0, 0))
+    else:
+        return None
+    if columnas is not None:
+        tabla = tabla.select([c for c in columnas if c in tabla.column_names])
+    return tabla.to_pandas(split_blocks=True)
@@ -0,0 +1,318 @@
+"""
+API local de consultas (HTTP/JSON, solo lectura) sobre la versión vigente del almacén Arrow:
+los mismos agregados que muestra el dashboard, para que otros equipos no los rehagan desde
+Google Sheets. Cada agregado se calcula una vez por versión y filtros (caché en memoria del
+proceso) y se sirve paginado; el ETag es la versión de datos más la consulta, así una
+petición condicional (If-None-Match) responde 304 sin leer datos ni calcular nada.
+
+Recursos (GET, parámetros opcionales):
+    /                       versión vigente y recursos disponibles
+    /lotes                  Tab 1: producción, operarios y cumplimiento por lote
+    /dias                   Tab 1: serie diaria (rendimiento, operarios, producción, metas, clima)
+    /financiero             Tab 2: gasto, producción, operarios y costo unitario por lote
+    /cruce                  Tab 3: cruce producción x calidad con Score (semana=, ratio=)
+    /metrics                métricas de la API en formato Prometheus
+    Filtros: desde=AAAA-MM-DD, hasta=AAAA-MM-DD, labor=, variedad= (el cruce usa solo la labor
+    de cosecha, como la Tab 3); paginación: pagina= (desde 1), por_pagina= (máx. 5000)
+
+Uso:
+    python api_consultas.py --dir almacen_arrow --puerto 8600
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+
+import almacen_arrow
+from metricas import REGISTRO, API_PETICIONES, API_DURACION
+from procesamiento_datos import (agregar_columnas_derivadas, construir_mascara, proyectar_filtrado,
+                                 agregar_columnas_calculadas, columnas_agregacion_tab1, asegurar_numericas,
+                                 calcular_tendencia_diaria, calcular_resumen_lotes, calcular_financiero_lotes,
+                                 recortar_produccion_cruce, calcular_cruce_temporada, cruce_de_semana)
+
+# Copy-on-write, como en pru.py: las columnas que se agregan al filtrado no tocan la tabla leída
+pd.set_option("mode.copy_on_write", True)
+
+PUERTO_DEFECTO = 8600
+HOST_DEFECTO = "127.0.0.1"                # Solo local; exponer hacia fuera con API_HOST
+POR_PAGINA_DEFECTO = 500
+POR_PAGINA_MAX = 5000
+RATIO_CALIDAD_DEFECTO = 0.3               # Valor inicial del slider de la Tab 3
+AGREGADOS_EN_CACHE = 64
+
+RECURSOS = {
+    'lotes': "Tab 1: producción, operarios y cumplimiento medio por lote",
+    'dias': "Tab 1: serie diaria con temperatura máxima de Ica",
+    'financiero': "Tab 2: gasto, producción, operarios y costo unitario por lote",
+    'cruce': "Tab 3: cruce producción x calidad por asistente, lote y fecha, con Score",
+}
+FILTROS = {'lotes': ('desde', 'hasta', 'labor', 'variedad'),
+           'dias': ('desde', 'hasta', 'labor', 'variedad'),
+           'financiero': ('desde', 'hasta', 'labor', 'variedad'),
+           'cruce': ('desde', 'hasta', 'variedad', 'semana', 'ratio')}
+
+# Un cálculo a la vez: dos consumidores con la misma consulta no la calculan dos veces
+_calculo_lock = threading.Lock()
+
+class ErrorConsulta(ValueError):
+    """Parámetro inválido (responde 400)."""
+
+# ==============================================================================
+# PARÁMETROS
+# ==============================================================================
+
+def _fecha(valor, nombre):
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise ErrorConsulta(f"{nombre} debe ser una fecha AAAA-MM-DD") from None
+
+def _entero(valor, nombre, minimo, maximo):
+    try:
+        numero = int(valor)
+    except ValueError:
+        raise ErrorConsulta(f"{nombre} debe ser un entero") from None
+    if not minimo <= numero <= maximo:
+        raise ErrorConsulta(f"{nombre} debe estar entre {minimo} y {maximo}")
+    return numero
+
+def leer_consulta(recurso, query):
+    """
+    Filtros normalizados (los no indicados con su valor por defecto) y paginación de una consulta.
+
+    Returns:
+        tuple: (filtros como tupla ordenada de pares, pagina, por_pagina)
+    """
+    params = dict(parse_qsl(query, keep_blank_values=False))
+    desconocidos = set(params) - set(FILTROS[recurso]) - {'pagina', 'por_pagina'}
+    if desconocidos:
+        raise ErrorConsulta(f"Parámetros no soportados en /{recurso}: {', '.join(sorted(desconocidos))}")
+    filtros = {'desde': _fecha(params['desde'], 'desde') if 'desde' in params else None,
+               'hasta': _fecha(params['hasta'], 'hasta') if 'hasta' in params else None,
+               'labor': params.get('labor', '(TODAS)'), 'variedad': params.get('variedad', '(TODAS)')}
+    if recurso == 'cruce':
+        del filtros['labor']
+        try:
+            filtros['ratio'] = float(params.get('ratio', RATIO_CALIDAD_DEFECTO))
+        except ValueError:
+            raise ErrorConsulta("ratio debe ser un número entre 0 y 1") from None
+        if not 0 <= filtros['ratio'] <= 1:
+            raise ErrorConsulta("ratio debe ser un número entre 0 y 1")
+        filtros['semana'] = params.get('semana')
+    pagina = _entero(params.get('pagina', '1'), 'pagina', 1, sys.maxsize)
+    por_pagina = _entero(params.get('por_pagina', str(POR_PAGINA_DEFECTO)), 'por_pagina', 1, POR_PAGINA_MAX)
+    return tuple(sorted(filtros.items())), pagina, por_pagina
+
+def etag(version, recurso, filtros, pagina, por_pagina):
+    """ETag de una respuesta: cambia solo si cambia la versión de datos o la consulta."""
+    consulta = repr((recurso, filtros, pagina, por_pagina)).encode('utf-8')
+    return f'"{version}-{hashlib.sha1(consulta).hexdigest()[:16]}"'
+
+def _coincide(if_none_match, valor):
+    if not if_none_match:
+        return False
+    etiquetas = [e.strip() for e in if_none_match.split(',')]
+    return '*' in etiquetas or valor in etiquetas or f"W/{valor}" in etiquetas
+
+# ==============================================================================
+# AGREGADOS (una vez por versión y filtros)
+# ==============================================================================
+
+@functools.lru_cache(maxsize=2)
+def _filtrado(directorio, version, desde, hasta, labor, variedad):
+    """Data Maestra del periodo con los filtros del sidebar; solo se leen los meses que tocan."""
+    manifiesto = almacen_arrow.leer_manifiesto(version, directorio)
+    col_map = manifiesto['col_map']
+    zonas = manifiesto['tablas'].get('maestra', {})
+    filtros = {c: v for c, v in ((col_map.get('Labor'), labor), (col_map.get('Variedad'), variedad))
+               if c and v != '(TODAS)'}
+    particiones = almacen_arrow.particiones_en_rango(zonas, desde, hasta, filtros) if zonas.get('particiones') else None
+    df = almacen_arrow.abrir_tabla(version, 'maestra', directorio, particiones)
+    agregar_columnas_derivadas(df, col_map)
+    periodo = [desde or date.min, hasta or date.max]
+    df_f = proyectar_filtrado(df, col_map, construir_mascara(df, col_map, periodo, labor, variedad))
+    if not df_f.empty:
+        agregar_columnas_calculadas(df_f, col_map)
+    return df_f, col_map
+
+@functools.lru_cache(maxsize=2)
+def _calidad(directorio, version):
+    return almacen_arrow.abrir_tabla(version, 'calidad', directorio)
+
+@functools.lru_cache(maxsize=4)
+def _cruce_temporada(directorio, version, desde, hasta, variedad):
+    """Cruce de todas las semanas del periodo y variedad (como cargar_cruce_temporada de la app)."""
+    col_map = almacen_arrow.leer_manifiesto(version, directorio)['col_map']
+    df_prod = almacen_arrow.abrir_tabla(version, 'produccion_cruce', directorio)
+    df_prod = recortar_produccion_cruce(df_prod, col_map, [desde or date.min, hasta or date.max], variedad)
+    return calcular_cruce_temporada(df_prod, _calidad(directorio, version))
+
+def _sin_claves(tabla):
+    # Los códigos enteros (Lote_Key, Dni_Key, ...) son internos de la versión
+    return tabla.drop(columns=[c for c in tabla.columns if str(c).endswith('_Key')])
+
+@functools.lru_cache(maxsize=AGREGADOS_EN_CACHE)
+def agregado(directorio, version, recurso, filtros):
+    """
+    Tabla completa (sin paginar) de un recurso para una versión y filtros.
+
+    Returns:
+        pd.DataFrame: Agregado, con las mismas funciones y columnas que el dashboard
+    """
+    f = dict(filtros)
+    if recurso == 'cruce':
+        cruce = _cruce_temporada(directorio, version, f['desde'], f['hasta'], f['variedad'])
+        calidad = _calidad(directorio, version)
+        semanas = [s for s in sorted(cruce['semanas']) if f['semana'] is None or str(s) == f['semana']]
+        partes = [cruce_de_semana(cruce, calidad, s, f['ratio'])[0].assign(Semana_Cruce=s) for s in semanas]
+        partes = [p for p in partes if not p.empty]
+        return _sin_claves(pd.concat(partes, ignore_index=True)) if partes else pd.DataFrame()
+
+    df_f, col_map = _filtrado(directorio, version, f['desde'], f['hasta'], f['labor'], f['variedad'])
+    if df_f.empty:
+        return pd.DataFrame()
+    c_lote, c_rend_dia, c_dni = col_map.get('Lote'), col_map.get('Rendimiento_Diario'), col_map.get('Dni')
+    if recurso == 'lotes':
+        return calcular_resumen_lotes(df_f, c_lote, c_rend_dia, c_dni)
+    if recurso == 'financiero':
+        return calcular_financiero_lotes(df_f, c_lote, c_rend_dia, c_dni)
+    # dias: misma serie que el gráfico principal de la Tab 1, con el clima publicado
+    c_fecha = col_map.get('Fecha')
+    agg_cols = columnas_agregacion_tab1(df_f, col_map)
+    asegurar_numericas(df_f, [origen for origen, _ in agg_cols.values()])
+    df_trend = calcular_tendencia_diaria(df_f, c_fecha, agg_cols)
+    clima = almacen_arrow.abrir_tabla(version, 'clima', directorio)
+    if clima is not None and not clima.empty:
+        df_trend = pd.merge(df_trend, clima, left_on=c_fecha, right_on='Fecha', how='left')
+        if c_fecha != 'Fecha':
+            df_trend = df_trend.drop(columns='Fecha')
+    return df_trend.reset_index(drop=True)
+
+def pagina_json(tabla, version, recurso, filtros, pagina, por_pagina):
+    """Cuerpo JSON de una página: metadatos de la consulta y sus filas como registros."""
+    total = len(tabla)
+    inicio = (pagina - 1) * por_pagina
+    meta = {'recurso': recurso, 'version': version,
+            'filtros': {k: (v.isoformat() if isinstance(v, date) else v) for k, v in filtros},
+            'total': total, 'pagina': pagina, 'por_pagina': por_pagina,
+            'paginas': math.ceil(total / por_pagina)}
+    filas = tabla.iloc[inicio:inicio + por_pagina]
+    registros = filas.to_json(orient='records', date_format='iso', force_ascii=False) if len(filas) else '[]'
+    return (json.dumps(meta, ensure_ascii=False)[:-1] + ', "datos": ' + registros + '}').encode('utf-8')
+
+# ==============================================================================
+# SERVIDOR HTTP
+# ==============================================================================
+
+class _ManejadorConsultas(BaseHTTPRequestHandler):
+    directorio = None
+
+    def _responder(self, estado, cuerpo=b'', tipo="application/json; charset=utf-8", cabeceras=()):
+        self.send_response(estado)
+        for nombre, valor in cabeceras:
+            self.send_header(nombre, valor)
+        if estado != 304:
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        if estado != 304:
+            self.wfile.write(cuerpo)
+
+    def _error(self, estado, mensaje):
+        self._responder(estado, json.dumps({'error': mensaje}, ensure_ascii=False).encode('utf-8'))
+
+    def do_GET(self):
+        partes = urlsplit(self.path)
+        recurso = partes.path.strip('/')
+        if recurso == 'metrics':
+            self._responder(200, REGISTRO.exponer().encode('utf-8'), "text/plain; version=0.0.4; charset=utf-8")
+            return
+        etiqueta = recurso if recurso in RECURSOS or not recurso else 'desconocido'
+        with API_DURACION.medir(recurso=etiqueta or 'indice'):
+            estado = self._atender(recurso, partes.query)
+        API_PETICIONES.inc(recurso=etiqueta or 'indice', estado=str(estado))
+
+    def _atender(self, recurso, query):
+        if recurso and recurso not in RECURSOS:
+            self._error(404, f"Recurso desconocido: /{recurso}")
+            return 404
+        version = almacen_arrow.version_actual(self.directorio)
+        if not version:
+            self._error(503, "No hay una versión publicada en el almacén (ver refrescador.py)")
+            return 503
+        if not recurso:
+            cuerpo = json.dumps({'version': version, 'recursos': RECURSOS}, ensure_ascii=False).encode('utf-8')
+            self._responder(200, cuerpo, cabeceras=[("ETag", f'"{version}"'), ("Cache-Control", "no-cache")])
+            return 200
+        try:
+            filtros, pagina, por_pagina = leer_consulta(recurso, query)
+        except ErrorConsulta as e:
+            self._error(400, str(e))
+            return 400
+
+        valor_etag = etag(version, recurso, filtros, pagina, por_pagina)
+        cabeceras = [("ETag", valor_etag), ("Cache-Control", "no-cache"), ("X-Version-Datos", version)]
+        if _coincide(self.headers.get("If-None-Match"), valor_etag):
+            self._responder(304, cabeceras=cabeceras)
+            return 304
+        with _calculo_lock:
+            tabla = agregado(self.directorio, version, recurso, filtros)
+        self._responder(200, pagina_json(tabla, version, recurso, filtros, pagina, por_pagina), cabeceras=cabeceras)
+        return 200
+
+    def log_message(self, *args):
+        pass
+
+def crear_servidor(directorio=None, puerto=None, host=None):
+    """
+    Servidor de la API (sin iniciar; serve_forever lo atiende en el hilo que lo llame).
+
+    Args:
+        directorio (str, optional): Almacén Arrow; por defecto ALMACEN_ARROW_DIR
+        puerto (int, optional): Puerto; por defecto API_PUERTO o 8600
+        host (str, optional): Interfaz; por defecto API_HOST o 127.0.0.1
+
+    Returns:
+        ThreadingHTTPServer: Servidor enlazado al puerto
+    """
+    manejador = type('ManejadorConsultas', (_ManejadorConsultas,),
+                     {'directorio': directorio or almacen_arrow.directorio_configurado()})
+    if puerto is None:
+        puerto = int(os.environ.get("API_PUERTO", PUERTO_DEFECTO))
+    if host is None:
+        host = os.environ.get("API_HOST", HOST_DEFECTO)
+    return ThreadingHTTPServer((host, puerto), manejador)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API local de consultas sobre el almacén Arrow.")
+    parser.add_argument('--dir', default=almacen_arrow.directorio_configurado() or 'almacen_arrow',
+                        help="Directorio del almacén (el mismo ALMACEN_ARROW_DIR de las apps)")
+    parser.add_argument('--puerto', type=int, default=None, help=f"Puerto (por defecto API_PUERTO o {PUERTO_DEFECTO})")
+    parser.add_argument('--host', default=None, help=f"Interfaz (por defecto API_HOST o {HOST_DEFECTO})")
+    args = parser.parse_args(argv)
+
+    if not almacen_arrow.ARROW_AVAILABLE:
+        print("pyarrow no está instalado.")
+        return 1
+    servidor = crear_servidor(args.dir, args.puerto, args.host)
+    print(f"API de consultas en http://{servidor.server_address[0]}:{servidor.server_address[1]}/ "
+          f"(almacén {args.dir})", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,353 @@
+"""
+Benchmark del pipeline completo del dashboard sobre datos sintéticos (10k a 10M filas).
+Mide tiempo y pico de memoria de cada etapa, guarda una línea base en JSON y permite
+compararla contra una corrida nueva para detectar regresiones.
+
+Uso:
+    python benchmark_pipeline.py --filas 10000 100000 --guardar benchmark_baseline.json
+    python benchmark_pipeline.py --filas 10000 100000 --comparar benchmark_baseline.json
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+import numpy as np
+
+import agregacion_paralela
+import datos_sinteticos
+import procesamiento_datos as proc
+
+# Igual que pru.py: el pipeline por rerun cuenta con copy-on-write (vistas sin copia)
+pd.set_option("mode.copy_on_write", True)
+
+TAMANOS_DEFECTO = [10_000, 100_000, 1_000_000, 10_000_000]
+ARCHIVO_BASELINE = "benchmark_baseline.json"
+# Hilos del motor de agregación en la etapa agrupacion_paralela (--hilos). Fijo y no
+# os.cpu_count(): la aceleración reportada se compara entre máquinas con la misma configuración
+HILOS_PARALELO = 4
+
+# Diferencias por debajo de estos mínimos se consideran ruido aunque superen la tolerancia
+MIN_DIF_SEGUNDOS = 0.005
+MIN_DIF_MB = 1.0
+
+# ==============================================================================
+# ETAPAS DEL PIPELINE
+# Cada etapa: (nombre, preparar(ctx) -> args [no medido], ejecutar(*args) -> resultado [medido],
+#              guardar(ctx, resultado) [no medido])
+# ==============================================================================
+
+def _sin_cache(func):
+    """Devuelve la función original de un st.cache_data para medir el cálculo real."""
+    return getattr(func, '__wrapped__', func)
+
+def _filas(obj):
+    """
+    Número de filas de un DataFrame, de la primera tabla de una tupla o de las semanas del
+    cruce de temporada (dict con 'semanas'); 0 si no es tabla.
+    """
+    if isinstance(obj, tuple):
+        obj = obj[0]
+    if isinstance(obj, dict) and isinstance(obj.get('semanas'), dict):
+        return sum(len(m) for m in obj['semanas'].values())
+    return len(obj) if hasattr(obj, 'shape') else 0
+
+def _etapa_limpieza_maestra():
+    def preparar(ctx): return (ctx['maestra_cruda'].copy(),)
+    def guardar(ctx, res): ctx['df'], ctx['col_map'] = res
+    return 'limpieza_maestra', preparar, proc.limpiar_data_maestra, guardar
+
+def _etapa_columnas_derivadas():
+    def preparar(ctx): return ctx['df'].copy(), ctx['col_map']
+    def guardar(ctx, res): ctx['df'] = res
+    return 'columnas_derivadas', preparar, proc.agregar_columnas_derivadas, guardar
+
+def _etapa_limpieza_calidad():
+    def preparar(ctx): return (ctx['calidad_cruda'].copy(),)
+    def guardar(ctx, res): ctx['df_calidad'] = res[0]
+    return 'limpieza_calidad', preparar, proc.limpiar_calidad, guardar
+
+def _etapa_filtro_sidebar():
+    def preparar(ctx):
+        df = ctx['df']; c_fecha = ctx['col_map']['Fecha']
+        date_range = [df[c_fecha].min().date(), df[c_fecha].max().date()]
+        return df, ctx['col_map'], date_range
+    def ejecutar(df, col_map, date_range):
+        mask = proc.construir_mascara(df, col_map, date_range, '(TODAS)', '(TODAS)')
+        df_f = proc.proyectar_filtrado(df, col_map, mask)
+        return proc.agregar_columnas_calculadas(df_f, col_map)
+    def guardar(ctx, res): ctx['df_f'] = res
+    return 'filtro_sidebar', preparar, ejecutar, guardar
+
+def _etapa_agregacion_tab1():
+    def preparar(ctx): return ctx['df_f'].copy(), ctx['col_map']
+    def ejecutar(df_f, col_map):
+        c_fecha = col_map['Fecha']; c_lote = col_map['Lote']
+        agg_cols = proc.columnas_agregacion_tab1(df_f, col_map)
+        proc.asegurar_numericas(df_f, [origen for origen, _ in agg_cols.values()])
+        df_trend = proc.calcular_tendencia_diaria(df_f, c_fecha, agg_cols)
+        df_lotes = proc.calcular_resumen_lotes(df_f, c_lote, col_map['Rendimiento_Diario'], col_map['Dni'])
+        df_pareto = proc.calcular_pareto(df_lotes)
+        df_ev = proc.calcular_evolucion_clasificacion(df_f, c_fecha)
+        df_patron = proc.calcular_patron_semanal(df_f, c_fecha)
+        return df_lotes, df_trend, df_pareto, df_ev, df_patron
+    def guardar(ctx, res):
+        ctx['df_lotes'], ctx['df_trend'], ctx['df_pareto'], ctx['df_ev'], ctx['df_patron'] = res
+    return 'agregacion_tab1', preparar, ejecutar, guardar
+
+def _etapa_agregacion_tab2():
+    def preparar(ctx): return ctx['df_f'], ctx['col_map']
+    def ejecutar(df_fin, col_map):
+        df_fin_lote = proc.calcular_financiero_lotes(df_fin, col_map['Lote'], col_map['Rendimiento_Diario'], col_map['Dni'])
+        proc.calcular_costo_clasificacion(df_fin)
+        proc.calcular_tendencia_financiera(df_fin, col_map['Fecha'], col_map['Rendimiento_Diario'])
+        return df_fin_lote
+    def guardar(ctx, res): ctx['df_fin_lote'] = res
+    return 'agregacion_tab2', preparar, ejecutar, guardar
+
+def _agrupaciones(df_f, col_map, hilos):
+    """Los groupby más pesados por rerun (resumen por lote y dataset IA), con el motor en `hilos`."""
+    agregar = lambda por, agregados: agregacion_paralela.agrupar(df_f, por, agregados, hilos=hilos, filas_min=0)
+    c_lote = col_map['Lote']
+    lotes = agregar('Lote_Key', {c_lote: (c_lote, 'first'), 'Produccion_Total': (col_map['Rendimiento_Diario'], 'sum'),
+                                 'Operarios_Unicos': ('Dni_Key', 'nunique'), 'Cumplimiento_Meta': ('Cumplimiento', 'mean')})
+    ia = agregar([col_map['Fecha'], c_lote, col_map['Labor']], {
+        'Rendimiento': (col_map['Rendimiento_Hora'], 'mean'), 'Operarios': ('Dni_Key', 'nunique')})
+    return lotes, ia
+
+def _etapa_agrupacion_serial():
+    def preparar(ctx): return ctx['df_f'], ctx['col_map'], 1
+    def guardar(ctx, res): pass
+    return 'agrupacion_serial', preparar, _agrupaciones, guardar
+
+def _etapa_agrupacion_paralela():
+    def preparar(ctx): return ctx['df_f'], ctx['col_map'], HILOS_PARALELO
+    def guardar(ctx, res): pass
+    return 'agrupacion_paralela', preparar, _agrupaciones, guardar
+
+def _etapa_preparar_cruce():
+    def preparar(ctx):
+        df = ctx['df']; c_fecha = ctx['col_map']['Fecha']
+        return df, ctx['col_map'], [df[c_fecha].min().date(), df[c_fecha].max().date()]
+    def ejecutar(df, col_map, date_range):
+        df_f_cruce, _, _ = proc.filtrar_produccion_cruce(df, col_map, date_range, '(TODAS)')
+        return _sin_cache(proc.preparar_produccion_cruce)(
+            df_f_cruce, col_map['Fecha'], col_map['Lote'], col_map['Rendimiento_Hora'], col_map['Meta_Min'])
+    def guardar(ctx, res): ctx['df_p_cruce'] = res
+    return 'preparar_produccion_cruce', preparar, ejecutar, guardar
+
+def _etapa_merged():
+    def preparar(ctx):
+        semana = sorted(ctx['df_calidad']['Semana_Cruce'].dropna().unique())[-1]
+        return ctx['df_p_cruce'], ctx['df_calidad'], semana, 0.3
+    def guardar(ctx, res): ctx['merged'] = res[0]
+    return 'calcular_merged_data', preparar, proc.calcular_merged_data, guardar
+
+def _etapa_cruce_temporada():
+    def preparar(ctx): return ctx['df_p_cruce'], ctx['df_calidad']
+    def guardar(ctx, res): ctx['cruce_temporada'] = res
+    return 'calcular_cruce_temporada', preparar, proc.calcular_cruce_temporada, guardar
+
+def _etapa_pivots():
+    def preparar(ctx): return (ctx['merged'],)
+    def ejecutar(merged):
+        pivot_score = proc.calcular_pivot_score(merged, 'Asistente', '(TODOS)', 0.3)
+        pivot_gen, fechas = _sin_cache(proc.calcular_pivot_metricas)(merged, 'Asistente', '(TODOS)')
+        return pivot_score, pivot_gen, fechas
+    def guardar(ctx, res): ctx['pivot_score'], ctx['pivot_gen'], ctx['fechas_pivot'] = res
+    return 'pivots_score_metricas', preparar, ejecutar, guardar
+
+def _etapa_formato():
+    def preparar(ctx): return ctx['pivot_score'], ctx['pivot_gen'], ctx['fechas_pivot'], ctx['merged']
+    def ejecutar(pivot_score, pivot_gen, fechas, merged):
+        tabla_score = proc.formatear_pivot_score(pivot_score)
+        vista = proc.construir_vista_metricas(pivot_gen, fechas, merged, 'Asistente')
+        asistente = sorted(merged['Asistente'].unique())[0]
+        detalle = proc.construir_tabla_detalle(merged[merged['Asistente'] == asistente], 'Asistente')
+        # El Styler es lo que recibe st.dataframe; to_html fuerza el cálculo de formato y estilos
+        tabla_score.style.format("{:.1%}", na_rep="").to_html()
+        detalle.style.format({'Jabas': '{:,.0f}', 'Eficiencia': '{:.1%}', 'Calidad_Tabla': '{:.1%}', 'Score': '{:.2f}'}).to_html()
+        return vista
+    def guardar(ctx, res): pass
+    return 'formato_tablas', preparar, ejecutar, guardar
+
+def _etapa_pdf():
+    def preparar(ctx):
+        col_map = ctx['col_map']; c_lote = col_map['Lote']
+        df_fin_lote = ctx['df_fin_lote'].rename(columns={c_lote: 'Lote_ID', 'Pago_Dia_Calc': 'Pago_Estimado_Total', col_map['Rendimiento_Diario']: 'Produccion_Total'})
+        txt = [f"Producción Total: {ctx['df_lotes']['Produccion_Total'].sum():,.0f} unidades."]
+        return (ctx['df_lotes'], txt, ctx['df_pareto'], None, ctx['df_lotes'], ctx['df_ev'], '(TODAS)',
+                "Distribución uniforme.", ctx['df_patron'], ctx['df_trend'], col_map, df_fin_lote)
+    def guardar(ctx, res): ctx['pdf_bytes'] = len(res)
+    return 'crear_pdf_completo', preparar, proc.crear_pdf_completo, guardar
+
+ETAPAS = [
+    _etapa_limpieza_maestra, _etapa_columnas_derivadas, _etapa_limpieza_calidad, _etapa_filtro_sidebar,
+    _etapa_agregacion_tab1, _etapa_agregacion_tab2, _etapa_agrupacion_serial, _etapa_agrupacion_paralela,
+    _etapa_preparar_cruce,
+    _etapa_merged, _etapa_cruce_temporada, _etapa_pivots, _etapa_formato, _etapa_pdf,
+]
+
+# ==============================================================================
+# MEDICIÓN
+# ==============================================================================
+
+def medir_etapa(ctx, preparar, ejecutar, repeticiones, medir_memoria=True):
+    """
+    Ejecuta una etapa varias veces y devuelve la mediana de tiempo y el pico de memoria.
+
+    Returns:
+        tuple: (resultado, dict con tiempo_s, tiempo_min_s, memoria_pico_mb, filas_entrada, filas_salida)
+    """
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        args = preparar(ctx)
+        t0 = time.perf_counter()
+        resultado = ejecutar(*args)
+        tiempos.append(time.perf_counter() - t0)
+
+    memoria_mb = None
+    if medir_memoria:
+        # Corrida aparte: tracemalloc agrega overhead y no debe contaminar los tiempos
+        args = preparar(ctx)
+        tracemalloc.start()
+        try:
+            ejecutar(*args)
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        memoria_mb = round(pico / 1024 ** 2, 2)
+
+    args = preparar(ctx)
+    return resultado, {
+        'tiempo_s': round(statistics.median(tiempos), 5),
+        'tiempo_min_s': round(min(tiempos), 5),
+        'memoria_pico_mb': memoria_mb,
+        'filas_entrada': _filas(args[0]),
+        'filas_salida': _filas(resultado),
+    }
+
+def ejecutar_benchmark(n_filas, repeticiones=3, medir_memoria=True, semilla=42, log=print):
+    """
+    Genera datos sintéticos de n_filas y mide todas las etapas del pipeline en orden.
+
+    Returns:
+        dict: etapa -> métricas
+    """
+    t0 = time.perf_counter()
+    maestra, calidad = datos_sinteticos.generar_dataset(n_filas, semilla=semilla)
+    log(f"  datos generados: maestra={len(maestra):,} calidad={len(calidad):,} ({time.perf_counter() - t0:.1f}s)")
+
+    ctx = {'maestra_cruda': maestra, 'calidad_cruda': calidad}
+    resultados = {}
+    for fabrica in ETAPAS:
+        nombre, preparar, ejecutar, guardar = fabrica()
+        resultado, metricas = medir_etapa(ctx, preparar, ejecutar, repeticiones, medir_memoria)
+        guardar(ctx, resultado)
+        resultados[nombre] = metricas
+        mem = f"{metricas['memoria_pico_mb']:>9.1f} MB" if metricas['memoria_pico_mb'] is not None else "        -"
+        log(f"  {nombre:<28} {metricas['tiempo_s']:>9.4f} s {mem}  filas {metricas['filas_entrada']:>10,} -> {metricas['filas_salida']:,}")
+    serial, paralela = resultados['agrupacion_serial']['tiempo_s'], resultados['agrupacion_paralela']['tiempo_s']
+    if paralela and HILOS_PARALELO > 1:
+        log(f"  aceleración agrupación: {serial / paralela:.2f}x con {HILOS_PARALELO} hilos")
+    return resultados
+
+# ==============================================================================
+# LÍNEA BASE Y COMPARACIÓN
+# ==============================================================================
+
+def metadatos_entorno():
+    """Versiones y máquina, para no comparar líneas base de entornos distintos sin saberlo."""
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'maquina': platform.node(),
+        'procesador': platform.processor() or platform.machine(),
+        'nucleos': os.cpu_count(),
+        'hilos_agregacion': HILOS_PARALELO,
+    }
+
+def comparar_resultados(base, actual, tolerancia=0.20):
+    """
+    Compara dos corridas y devuelve las regresiones de tiempo o memoria.
+
+    Args:
+        base (dict): 'resultados' de la línea base
+        actual (dict): 'resultados' de la corrida actual
+        tolerancia (float): Aumento relativo permitido (0.20 = 20%)
+
+    Returns:
+        list: Filas (filas, etapa, métrica, base, actual, cambio_relativo, es_regresion)
+    """
+    filas = []
+    for n_filas, etapas in actual.items():
+        for etapa, m in etapas.items():
+            m_base = base.get(n_filas, {}).get(etapa)
+            if not m_base:
+                continue
+            for metrica, min_dif in (('tiempo_s', MIN_DIF_SEGUNDOS), ('memoria_pico_mb', MIN_DIF_MB)):
+                v_base, v_act = m_base.get(metrica), m.get(metrica)
+                if v_base is None or v_act is None:
+                    continue
+                cambio = (v_act - v_base) / v_base if v_base else 0.0
+                regresion = cambio > tolerancia and (v_act - v_base) > min_dif
+                filas.append((n_filas, etapa, metrica, v_base, v_act, cambio, regresion))
+    return filas
+
+def main(argv=None):
+    global HILOS_PARALELO
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline del dashboard con datos sintéticos.")
+    parser.add_argument('--filas', type=int, nargs='+', default=TAMANOS_DEFECTO, help="Tamaños de Data Maestra a medir")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Repeticiones por etapa (se reporta la mediana)")
+    parser.add_argument('--sin-memoria', action='store_true', help="No medir memoria (tracemalloc)")
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--hilos', type=int, default=HILOS_PARALELO,
+                        help="Hilos del motor de agregación en la etapa agrupacion_paralela")
+    parser.add_argument('--guardar', metavar='ARCHIVO', nargs='?', const=ARCHIVO_BASELINE, help="Guardar resultados como línea base")
+    parser.add_argument('--comparar', metavar='ARCHIVO', nargs='?', const=ARCHIVO_BASELINE, help="Comparar contra una línea base y marcar regresiones")
+    parser.add_argument('--tolerancia', type=float, default=0.20, help="Aumento relativo tolerado antes de marcar regresión")
+    args = parser.parse_args(argv)
+
+    HILOS_PARALELO = args.hilos
+    resultados = {}
+    for n in args.filas:
+        print(f"== {n:,} filas ==")
+        resultados[str(n)] = ejecutar_benchmark(n, args.repeticiones, not args.sin_memoria, args.semilla)
+
+    salida = {'meta': metadatos_entorno(), 'resultados': resultados}
+
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as f:
+            json.dump(salida, f, indent=2, ensure_ascii=False)
+        print(f"Línea base guardada en {args.guardar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        if base.get('meta', {}).get('maquina') != salida['meta']['maquina']:
+            print(f"⚠️ Línea base de otra máquina ({base.get('meta', {}).get('maquina')}); los tiempos pueden no ser comparables.")
+        filas = comparar_resultados(base.get('resultados', {}), resultados, args.tolerancia)
+        regresiones = [f for f in filas if f[-1]]
+        print(f"\n{'filas':>10} {'etapa':<28} {'métrica':<16} {'base':>10} {'actual':>10} {'cambio':>8}")
+        for n_filas, etapa, metrica, v_base, v_act, cambio, regresion in filas:
+            marca = "  ❌ REGRESIÓN" if regresion else ""
+            print(f"{n_filas:>10} {etapa:<28} {metrica:<16} {v_base:>10.4f} {v_act:>10.4f} {cambio:>+7.1%}{marca}")
+        if regresiones:
+            print(f"\n{len(regresiones)} regresiones por encima de {args.tolerancia:.0%}")
+            return 1
+        print("\nSin regresiones")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
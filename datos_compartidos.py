@@ -0,0 +1,52 @@
+"""
+Datasets compartidos entre sesiones: una sola copia por proceso, de solo lectura.
+cargar_datos / cargar_datos_calidad se cachean con st.cache_resource (sin pickle) y cada
+sesión recibe una vista sin copia; con copy-on-write de pandas, cualquier escritura de una
+sesión crea su propia copia y nunca toca los arreglos compartidos.
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.core.arrays.masked import BaseMaskedArray
+
+def _arreglos(df):
+    """
+    Arreglos numpy que respaldan los bloques del DataFrame: numéricos, datetime/timedelta,
+    códigos de las Categorical y datos y máscara de los enteros con nulos (Int32 de los
+    códigos de persona). Los bloques object (texto) no se incluyen: en pandas 2.1 comparar
+    un arreglo object de solo lectura con un escalar (Series == valor) lanza ValueError
+    ("buffer source array is read-only"), y con copy-on-write ninguna sesión los escribe.
+    """
+    for arr in df._mgr.arrays:
+        # DatetimeArray/TimedeltaArray/Categorical guardan su ndarray en _ndarray;
+        # IntegerArray/FloatingArray/BooleanArray en _data y _mask
+        partes = [arr._data, arr._mask] if isinstance(arr, BaseMaskedArray) else [getattr(arr, '_ndarray', arr)]
+        for base in partes:
+            if isinstance(base, np.ndarray) and base.dtype != object:
+                yield base
+
+def congelar(df):
+    """
+    Marca como de solo lectura los arreglos del DataFrame (in-place, ver _arreglos) y lo
+    devuelve. Un intento de escribir directo sobre los datos compartidos lanza ValueError
+    en lugar de corromper las demás sesiones.
+    """
+    for arr in _arreglos(df):
+        arr.flags.writeable = False
+    return df
+
+def es_inmutable(df):
+    """True si ningún arreglo congelable del DataFrame (ver _arreglos) es escribible."""
+    return not any(arr.flags.writeable for arr in _arreglos(df))
+
+def vista(df):
+    """
+    Vista por sesión del dataset compartido, sin copiar datos.
+
+    Requiere pandas con mode.copy_on_write activo (pru.py lo activa): así agregar o modificar
+    columnas en la vista solo afecta a la sesión que la tiene.
+    """
+    if not pd.get_option("mode.copy_on_write"):
+        raise RuntimeError("datos_compartidos.vista requiere pd.set_option('mode.copy_on_write', True)")
+    return df.copy(deep=False)
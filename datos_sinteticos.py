@@ -0,0 +1,146 @@
+"""
+Generador de datos sintéticos con la misma estructura que Data_Maestra_Limpia y Calidad.
+Usa los nombres de columna que detectan cargar_datos y cargar_datos_calidad, para poder
+probar y medir el pipeline completo sin credenciales ni red.
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import pandas as pd
+import numpy as np
+
+from procesamiento_datos import LABOR_CRUCE
+
+VARIEDADES = {
+    'TM': 'TIMPSON', 'AL': 'ALLISON', 'CC': 'COTTON CANDY', 'SS': 'SABLE SEEDLESS',
+    'CH': 'CANDY HEARTS', 'RG': 'RED GLOBE', 'SG': 'SWEET GLOBE', 'AC': 'AUTUMN CRISP'
+}
+
+LABORES = [LABOR_CRUCE, 'DESBROTE', 'RALEO DE BAYAS', 'DESHOJE', 'AMARRE DE CARGADORES']
+PESO_LABORES = [0.45, 0.15, 0.15, 0.15, 0.10]
+
+# Categoría -> tipos de defecto de la hoja de Calidad
+DEFECTOS = {
+    'CALIBRE': ['BAYA PEQUEÑA', 'RACIMO DESUNIFORME'],
+    'COLOR': ['BAYA VERDE', 'COLOR DISPAREJO'],
+    'DAÑO MECANICO': ['BAYA PARTIDA', 'BAYA APLASTADA', 'DESGRANE'],
+    'SANIDAD': ['PUDRICION', 'OIDIUM', 'BAYA DESHIDRATADA'],
+    'PRESENTACION': ['RACIMO MAL LIMPIADO', 'PEDICELO LARGO'],
+}
+
+NOMBRES = ['JUAN', 'MARIA', 'CARLOS', 'ROSA', 'LUIS', 'ANA', 'JOSE', 'CARMEN', 'PEDRO', 'LUCIA', 'MIGUEL', 'ELENA']
+APELLIDOS = ['QUISPE', 'FLORES', 'GARCIA', 'HUAMAN', 'RAMOS', 'TORRES', 'MENDOZA', 'CASTILLO', 'ROJAS', 'VARGAS', 'CHAVEZ', 'DIAZ']
+
+def _dias_temporada(n_filas):
+    """Días de temporada para un tamaño dado (entre 2 semanas y ~6 meses)."""
+    return int(min(180, max(14, n_filas // 200)))
+
+def generar_data_maestra(n_filas, semilla=42, fecha_inicio='2025-09-01', n_lotes=60):
+    """
+    Genera una Data Maestra cruda (antes de limpiar) con n_filas registros operario-día.
+
+    Args:
+        n_filas (int): Número de filas a generar
+        semilla (int): Semilla del generador aleatorio
+        fecha_inicio (str): Primer día de la temporada
+        n_lotes (int): Número de lotes del fundo
+
+    Returns:
+        pd.DataFrame: Data Maestra con las columnas que espera cargar_datos
+    """
+    rng = np.random.default_rng(semilla)
+    dias = _dias_temporada(n_filas)
+    n_operarios = int(max(50, n_filas // max(dias // 2, 1)))
+
+    fechas = pd.Timestamp(fecha_inicio) + pd.to_timedelta(rng.integers(0, dias, n_filas), unit='D')
+    lotes = rng.integers(1, n_lotes + 1, n_filas)
+    # Cada lote tiene una sola variedad
+    cod_variedad = np.array(list(VARIEDADES.values()))
+    variedad_lote = cod_variedad[rng.integers(0, len(cod_variedad), n_lotes + 1)]
+    labores = np.array(LABORES)[rng.choice(len(LABORES), n_filas, p=PESO_LABORES)]
+
+    dni = rng.integers(0, n_operarios, n_filas)
+    nombres = (np.array(NOMBRES)[dni % len(NOMBRES)].astype(object) + ' '
+               + np.array(APELLIDOS)[(dni // len(NOMBRES)) % len(APELLIDOS)].astype(object)
+               + ' ' + (dni // (len(NOMBRES) * len(APELLIDOS))).astype(str).astype(object))
+
+    horas = np.round(rng.normal(8.0, 0.8, n_filas).clip(4, 11), 2)
+    meta_min = np.round(rng.normal(12.0, 2.0, n_filas).clip(6, 20), 1)
+    rend_hr = np.round((meta_min * rng.normal(1.0, 0.18, n_filas)).clip(0, None), 2)
+    rendimiento = np.round(rend_hr * horas, 1)
+    cumplimiento = np.where(meta_min > 0, rend_hr / meta_min * 100, 0)
+    clasif = np.select([cumplimiento >= 100, cumplimiento >= 85], ['AR', 'MR'], default='BR')
+
+    return pd.DataFrame({
+        'Fecha': fechas,
+        'DNI': (40000000 + dni).astype(str),
+        'Nombre': nombres,
+        'Lote': lotes,
+        'Labor': labores,
+        'Variedad': variedad_lote[lotes],
+        'Turno': np.where(rng.random(n_filas) < 0.8, 'DIA', 'NOCHE'),
+        'Horas Totales': horas,
+        'Rendimiento': rendimiento,
+        'Rend/Hr Real': rend_hr,
+        'Meta Min': meta_min,
+        'Meta Max': np.round(meta_min * 1.25, 1),
+        'Clasificacion': clasif,
+        'Salario': np.round(62.0 + np.maximum(rendimiento - meta_min * horas, 0) * 0.35, 2),
+    })
+
+def generar_calidad(df_maestra, semilla=42, n_asistentes=12, defectos_por_inspeccion=2):
+    """
+    Genera una hoja de Calidad cruda alineada con los lotes y fechas de cosecha de df_maestra.
+
+    Args:
+        df_maestra (pd.DataFrame): Data Maestra cruda (de generar_data_maestra)
+        semilla (int): Semilla del generador aleatorio
+        n_asistentes (int): Número de asistentes de calidad
+        defectos_por_inspeccion (int): Filas de defecto por inspección (asistente-lote-fecha)
+
+    Returns:
+        pd.DataFrame: Calidad con las columnas que espera cargar_datos_calidad
+    """
+    rng = np.random.default_rng(semilla + 1)
+    cosecha = df_maestra[df_maestra['Labor'] == LABOR_CRUCE]
+    pares = cosecha[['Fecha', 'Lote', 'Variedad']].drop_duplicates(['Fecha', 'Lote']).reset_index(drop=True)
+
+    # Cada par lote-fecha lo inspeccionan 1-3 asistentes
+    n_insp = rng.integers(1, 4, len(pares))
+    insp = pares.loc[pares.index.repeat(n_insp)].reset_index(drop=True)
+    asistentes = np.array([f"{n[0]}. {a}" for n, a in zip(NOMBRES, APELLIDOS)][:n_asistentes])
+    insp['Asistente'] = asistentes[rng.integers(0, len(asistentes), len(insp))]
+
+    filas = insp.loc[insp.index.repeat(defectos_por_inspeccion)].reset_index(drop=True)
+    n = len(filas)
+    categorias = np.array(list(DEFECTOS.keys()))
+    cat = categorias[rng.integers(0, len(categorias), n)]
+    tipos = np.empty(n, dtype=object)
+    for c, lista in DEFECTOS.items():
+        idx = np.flatnonzero(cat == c)
+        tipos[idx] = np.array(lista, dtype=object)[rng.integers(0, len(lista), len(idx))]
+
+    variedad_a_codigo = {v: k for k, v in VARIEDADES.items()}
+    semana = filas['Fecha'].dt.isocalendar().week.astype(int)
+    sufijo = rng.integers(1, 3, n)
+
+    return pd.DataFrame({
+        'Fecha': filas['Fecha'].dt.strftime('%Y-%m-%d'),
+        'Semana': 'Semana ' + semana.astype(str),
+        'Lote - Cuartel': 'L' + filas['Lote'].astype(str) + ' (' + pd.Series(sufijo).astype(str) + ')',
+        'Asistente': filas['Asistente'],
+        'Variedad': filas['Variedad'].map(variedad_a_codigo),
+        'Categoria Defecto': cat,
+        'Tipo_Defecto': tipos,
+        'Desviacion_Total': np.round(rng.gamma(1.5, 0.02, n).clip(0, 0.6), 4),
+        'Cantidad_Jabas': rng.integers(5, 60, n),
+    })
+
+def generar_dataset(n_filas, semilla=42):
+    """
+    Genera el par (Data Maestra, Calidad) crudo para n_filas de producción.
+
+    Returns:
+        tuple: (df_maestra, df_calidad)
+    """
+    df_maestra = generar_data_maestra(n_filas, semilla=semilla)
+    return df_maestra, generar_calidad(df_maestra, semilla=semilla)
@@ -0,0 +1,229 @@
+"""
+Exportación a Excel de las tablas del Explorador Detallado (Tab 3): Eficiencia (Score),
+Desglose Rendimiento/Calidad e Historial de trabajos. El libro se escribe con openpyxl en
+modo write-only (cada fila va a disco al agregarse) y los colores son reglas de formato
+condicional de la hoja, con los mismos umbrales que la app, no estilos celda por celda.
+Con toda la temporada, cada semana se arma, se escribe y se descarta antes de la siguiente:
+la memoria es la de una semana, no la del libro.
+
+Estructura:
+    Eficiencia  un bloque por semana: título, encabezado (fechas dd-mm + PROMEDIO) y filas
+    Desglose    un bloque por semana: <dd-mm> Rend / <dd-mm> Cal por fecha + PROM Rend / PROM Cal
+    Historial   una sola tabla: Semana, asistente (o lote) y su historial con fila PROMEDIO
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import pandas as pd
+
+from perfilador import medir_etapa
+from procesamiento_datos import (calcular_pivot_score, calcular_pivot_metricas,
+                                 formatear_pivot_score)
+
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+    EXCEL_AVAILABLE = True
+except ImportError:
+    EXCEL_AVAILABLE = False
+
+# Mismos colores que style_score_dinamico y mismas metas que format_with_icon
+COLORES = {'rojo': 'FFCDD2', 'ambar': 'FFF9C4', 'verde': 'C8E6C9'}
+META_RENDIMIENTO = 1.0
+META_CALIDAD = 0.95
+FORMATOS_DETALLE = {'Jabas': '#,##0', 'Eficiencia': '0.0%', 'Calidad_Tabla': '0.0%', 'Score': '0.00'}
+
+def _sin_medir(func):
+    # Cálculo original: sin entrada en la caché de Streamlit ni etapa por semana en la traza
+    return getattr(func, '__wrapped__', func)
+
+def _regla(formula, color):
+    relleno = PatternFill(start_color=color, end_color=color, fill_type='solid')
+    return FormulaRule(formula=[formula], fill=relleno, font=Font(color='000000'), stopIfTrue=True)
+
+def reglas_score(hoja, rango, umbral_rojo, umbral_ambar):
+    """Rojo / ámbar / verde sobre un rango de Scores; las celdas vacías o de texto quedan sin color."""
+    celda = rango.split(':')[0]
+    for formula, color in ((f"AND(ISNUMBER({celda}),{celda}<{umbral_rojo})", COLORES['rojo']),
+                           (f"AND(ISNUMBER({celda}),{celda}<{umbral_ambar})", COLORES['ambar']),
+                           (f"ISNUMBER({celda})", COLORES['verde'])):
+        hoja.conditional_formatting.add(rango, _regla(formula, color))
+
+def reglas_meta(hoja, rango):
+    """
+    Rend / Cal alternados desde la columna B: verde si cumple su meta (✅ en la app), rojo si
+    está por debajo (🚩). La meta sale de la columna (par: rendimiento, impar: calidad), así
+    todo el bloque es un solo rango.
+    """
+    celda = rango.split(':')[0]
+    meta = f"IF(ISEVEN(COLUMN({celda})),{META_RENDIMIENTO},{META_CALIDAD})"
+    for formula, color in ((f"AND(ISNUMBER({celda}),{celda}>={meta})", COLORES['verde']),
+                           (f"ISNUMBER({celda})", COLORES['rojo'])):
+        hoja.conditional_formatting.add(rango, _regla(formula, color))
+
+def _valor(v):
+    # NaN/NaT como celda vacía; fechas y escalares numpy como tipos de Python
+    if pd.isna(v):
+        return None
+    return v.item() if hasattr(v, 'item') else v
+
+def _celdas(hoja, valores, formatos):
+    """Fila de celdas; las columnas con formato numérico van como WriteOnlyCell."""
+    fila = []
+    for v, formato in zip(valores, formatos):
+        v = _valor(v)
+        if formato and v is not None and not isinstance(v, str):
+            celda = WriteOnlyCell(hoja, value=v)
+            celda.number_format = formato
+            v = celda
+        fila.append(v)
+    return fila
+
+class _Hoja:
+    """Hoja write-only con su última fila escrita (las reglas necesitan los rangos)."""
+
+    def __init__(self, libro, titulo):
+        self.hoja = libro.create_sheet(titulo)
+        self.filas = 0
+
+    def agregar(self, fila):
+        self.hoja.append(fila)
+        self.filas += 1
+
+    def titulo(self, texto):
+        celda = WriteOnlyCell(self.hoja, value=texto)
+        celda.font = Font(bold=True)
+        self.agregar([celda])
+
+    def bloque(self, tabla, formato, nombre_indice):
+        """
+        Escribe una tabla con su índice como primera columna.
+
+        Returns:
+            str: Rango de los valores (sin índice ni encabezado), ej. 'B3:H15'
+        """
+        self.agregar([nombre_indice] + [str(c) for c in tabla.columns])
+        inicio = self.filas + 1
+        formatos = [None] + [formato] * tabla.shape[1]
+        for indice, valores in zip(tabla.index, tabla.itertuples(index=False, name=None)):
+            self.agregar(_celdas(self.hoja, (indice, *valores), formatos))
+        rango = f"B{inicio}:{get_column_letter(tabla.shape[1] + 1)}{self.filas}"
+        self.agregar([])
+        return rango
+
+def historial_semana(merged_filtrado, vista_tabla):
+    """
+    construir_tabla_detalle de todos los asistentes (o lotes) de la semana con un solo groupby,
+    en vez de uno por selección.
+
+    Returns:
+        list: [(asistente o lote, historial con su fila PROMEDIO)] en orden alfabético
+    """
+    index_col = 'Asistente' if vista_tabla == 'Asistente' else 'Lote_Cruce'
+    otra = 'Lote_Cruce' if vista_tabla == 'Asistente' else 'Asistente'
+    medidas = ['Jabas', 'Eficiencia', 'Calidad_Tabla', 'Score']
+    tabla = merged_filtrado.groupby([index_col, 'Fecha_Cruce', otra, 'Variedad']).agg(
+        Eficiencia=('Eficiencia', 'mean'), Calidad_Tabla=('Calidad_Tabla', 'mean'),
+        Score=('Score', 'mean'), Jabas=('Jabas', 'sum')).reset_index()
+    tabla['Fecha'] = tabla['Fecha_Cruce'].dt.strftime('%Y-%m-%d')
+    promedios = tabla.groupby(index_col)[medidas].mean()
+
+    cols_mostrar = ['Fecha', otra, 'Variedad'] + medidas
+    historial = []
+    for etiqueta, filas in tabla.groupby(index_col).indices.items():
+        prom_row = dict(promedios.loc[etiqueta], Fecha='PROMEDIO', Variedad='-', **{otra: '-'})
+        historial.append((etiqueta, pd.concat([tabla.iloc[filas][cols_mostrar], pd.DataFrame([prom_row])],
+                                              ignore_index=True)))
+    return historial
+
+def tablas_semana(merged, vista_tabla, filtro_lote, ratio_calidad):
+    """
+    Tablas del Explorador Detallado de una semana, con los mismos cálculos que la app.
+
+    Args:
+        merged (pd.DataFrame): Cruce de la semana con Score (cruce_de_semana)
+
+    Returns:
+        tuple: (pivot Score con PROMEDIO, Rend/Cal por fecha, historial) como números;
+               las dos primeras vacías si no hay datos con el filtro de lote
+    """
+    index_col = 'Asistente' if vista_tabla == 'Asistente' else 'Lote_Cruce'
+    merged_filtrado = merged[merged['Lote_Cruce'] == filtro_lote] if filtro_lote != '(TODOS)' else merged
+
+    pivot_score = _sin_medir(calcular_pivot_score)(merged, index_col, filtro_lote, ratio_calidad)
+    if not pivot_score.empty:
+        pivot_score = _sin_medir(formatear_pivot_score)(pivot_score)
+
+    # Desglose: mismo orden de columnas que construir_vista_metricas, con números en vez de iconos
+    pivot_gen, fechas = _sin_medir(calcular_pivot_metricas)(merged, index_col, filtro_lote)
+    desglose = pd.DataFrame()
+    if not pivot_gen.empty and fechas:
+        columnas = {}
+        for f in fechas:
+            f_str = f.strftime('%d-%m')
+            if f in pivot_gen['Eficiencia'].columns and f in pivot_gen['Calidad_Calc'].columns:
+                columnas[f"{f_str} Rend"] = pivot_gen['Eficiencia'][f]
+                columnas[f"{f_str} Cal"] = pivot_gen['Calidad_Calc'][f]
+        if columnas:
+            desglose = pd.DataFrame(columnas)
+            promedios = merged_filtrado.groupby(index_col)[['Eficiencia', 'Calidad_Calc']].mean()
+            desglose['PROM Rend'] = promedios['Eficiencia']
+            desglose['PROM Cal'] = promedios['Calidad_Calc']
+
+    return pivot_score, desglose, historial_semana(merged_filtrado, vista_tabla)
+
+@medir_etapa
+def exportar_tablas_cruce(semanas, ruta, vista_tabla, filtro_lote, ratio_calidad, umbral_rojo, umbral_ambar):
+    """
+    Escribe el libro Excel de las tablas del Tab 3 para una o varias semanas.
+
+    Args:
+        semanas: Iterable de (etiqueta de semana, merged con Score); conviene un generador
+                 para que solo una semana esté en memoria
+        ruta (str): Ruta del .xlsx de salida
+        vista_tabla (str): 'Asistente' o 'Lote' (desglose de las tablas)
+        filtro_lote (str): Lote o '(TODOS)'
+        ratio_calidad (float): Ponderación de calidad en el Score
+        umbral_rojo (float): Score menor que este umbral en rojo
+        umbral_ambar (float): Score menor que este umbral (y no rojo) en ámbar
+
+    Returns:
+        dict: semanas y filas escritas por hoja
+    """
+    if not EXCEL_AVAILABLE:
+        raise ValueError("La exportación a Excel requiere openpyxl")
+    nombre_indice = 'Asistente' if vista_tabla == 'Asistente' else 'Lote'
+    libro = Workbook(write_only=True)
+    score, desglose, historial = (_Hoja(libro, t) for t in ('Eficiencia', 'Desglose', 'Historial'))
+    encabezado_historial = None
+    resumen = {'semanas': []}
+
+    for semana, merged in semanas:
+        if merged.empty:
+            continue
+        pivot_score, vista_metricas, detalle = tablas_semana(merged, vista_tabla, filtro_lote, ratio_calidad)
+        if not pivot_score.empty:
+            score.titulo(f"Semana {semana} - Eficiencia (Score) por {vista_tabla} | "
+                         f"{ratio_calidad * 100:.0f}% Calidad + {(1 - ratio_calidad) * 100:.0f}% Rendimiento")
+            reglas_score(score.hoja, score.bloque(pivot_score, '0.0%', nombre_indice), umbral_rojo, umbral_ambar)
+        if not vista_metricas.empty:
+            desglose.titulo(f"Semana {semana} - Desglose Rendimiento / Calidad por {vista_tabla}")
+            reglas_meta(desglose.hoja, desglose.bloque(vista_metricas, '0.0%', nombre_indice))
+        for etiqueta, tabla in detalle:
+            if encabezado_historial is None:
+                encabezado_historial = ['Semana', nombre_indice] + list(tabla.columns)
+                formatos_historial = [FORMATOS_DETALLE.get(c) for c in encabezado_historial]
+                historial.agregar(encabezado_historial)
+            for valores in tabla.itertuples(index=False, name=None):
+                historial.agregar(_celdas(historial.hoja, (semana, etiqueta, *valores), formatos_historial))
+        resumen['semanas'].append(semana)
+
+    # Historial: una sola regla sobre toda la columna Score
+    if encabezado_historial is not None and historial.filas > 1:
+        letra = get_column_letter(encabezado_historial.index('Score') + 1)
+        reglas_score(historial.hoja, f"{letra}2:{letra}{historial.filas}", umbral_rojo, umbral_ambar)
+    resumen.update(filas_eficiencia=score.filas, filas_desglose=desglose.filas, filas_historial=historial.filas)
+    libro.save(ruta)
+    return resumen
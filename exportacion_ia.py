@@ -0,0 +1,95 @@
+"""
+Exportación del "Dataset Listo para IA": el recorte del feature store (features_ia, ver
+construir_features_ia) se escribe particionado por mes, en CSV comprimido o Parquet. Con
+almacén Arrow el recorte llega un mes por vez (cada partición se lee, se escribe y se
+descarta), así que escribir a disco no depende del largo del periodo. La descarga se sirve
+desde un ZIP en disco, pero st.download_button lo carga entero en memoria: sobre
+BYTES_MAX_DESCARGA_IA se ofrece solo la escritura directa con DATASET_IA_DIR.
+
+Estructura (particiones estilo Hive, legibles con pyarrow.dataset, Spark o pandas):
+    <destino>/mes=AAAA-MM/datos.csv.gz   (o datos.parquet)
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from perfilador import medir_etapa
+
+try:
+    import pyarrow  # noqa: F401  (motor de DataFrame.to_parquet)
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+FORMATOS = {'csv': 'datos.csv.gz', 'parquet': 'datos.parquet'}
+# ZIP más grande que se sirve por st.download_button (lo retiene en memoria del servidor)
+BYTES_MAX_DESCARGA_IA = 200 * 1024 * 1024
+
+def directorio_configurado():
+    """Directorio de datasets de entrenamiento (DATASET_IA_DIR); None si no está definido."""
+    return os.environ.get("DATASET_IA_DIR") or None
+
+def _escribir(df, ruta, formato):
+    if formato == 'parquet':
+        df.to_parquet(ruta, index=False)
+    else:
+        df.to_csv(ruta, index=False, compression='gzip')
+
+@medir_etapa
+def exportar_dataset_ia(features, destino, formato='csv', temp_media=None):
+    """
+    Escribe el dataset IA particionado por mes.
+
+    La temperatura del día sin dato se rellena como en generar_dataset_ia (último valor
+    anterior y, antes del primero, la media del recorte); las ventanas de clima quedan nulas
+    si no hubo ningún dato en la ventana.
+
+    Args:
+        features (pd.DataFrame | iterable): Recorte del feature store (recortar_features_ia),
+            ordenado por fecha, o bloques de ese recorte en orden de fecha con cada mes en un
+            solo bloque; cada bloque se escribe y se descarta antes de pedir el siguiente
+        destino (str): Directorio de salida (se crea si no existe)
+        formato (str): 'csv' (gzip) o 'parquet'
+        temp_media (float, optional): Media de la temperatura en todo el recorte, para los
+            días sin dato antes del primero (por defecto, la de cada bloque)
+
+    Returns:
+        dict: meses, filas y bytes escritos
+    """
+    if formato == 'parquet' and not PARQUET_AVAILABLE:
+        raise ValueError("Parquet requiere pyarrow")
+    bloques = [features] if isinstance(features, pd.DataFrame) else features
+
+    resumen = {'meses': [], 'filas': 0, 'bytes': 0}
+    temp_anterior = np.nan  # Último valor del bloque anterior, para seguir el relleno hacia adelante
+    for bloque in bloques:
+        if 'Feature_Temp_Max' in bloque.columns and len(bloque):
+            temp = bloque['Feature_Temp_Max']
+            media = temp.mean() if temp_media is None else temp_media
+            bloque = bloque.assign(Feature_Temp_Max=temp.ffill().fillna(temp_anterior).fillna(media))
+            temp_anterior = bloque['Feature_Temp_Max'].iloc[-1]
+        fechas = bloque['Fecha']
+        grupos = bloque.groupby((fechas.dt.year * 100 + fechas.dt.month).to_numpy()).indices
+        for clave, filas in grupos.items():
+            mes = f"{int(clave) // 100:04d}-{int(clave) % 100:02d}"
+            carpeta = os.path.join(destino, f"mes={mes}")
+            os.makedirs(carpeta, exist_ok=True)
+            ruta = os.path.join(carpeta, FORMATOS[formato])
+            _escribir(bloque.take(filas), ruta, formato)
+            resumen['meses'].append(mes)
+            resumen['filas'] += len(filas)
+            resumen['bytes'] += os.path.getsize(ruta)
+    return resumen
+
+def comprimir_directorio(origen, ruta_zip):
+    """ZIP de un dataset exportado, con las rutas relativas (mes=AAAA-MM/...); sin recomprimir."""
+    with zipfile.ZipFile(ruta_zip, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for raiz, _, archivos in os.walk(origen):
+            for archivo in sorted(archivos):
+                ruta = os.path.join(raiz, archivo)
+                zf.write(ruta, os.path.relpath(ruta, origen))
+    return ruta_zip
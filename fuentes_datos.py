@@ -0,0 +1,349 @@
+"""
+Capa de fuentes de datos intercambiable para Google Sheets y Open-Meteo.
+Backend 'google' (por defecto): gspread con credenciales y requests.get reales.
+Backend 'local': sirve hojas y clima grabados o sintéticos desde un directorio, con las mismas
+interfaces (Client/Spreadsheet/Worksheet de gspread y la respuesta de requests.get),
+más latencia y fallos inyectables para medir cargas, cachés y fallbacks sin red.
+
+Configuración (variables de entorno o configurar()):
+    FUENTE_DATOS=local          Backend ('google' o 'local')
+    FUENTE_DATOS_DIR=./datos    Directorio con <id>.json|.csv por hoja y clima.json
+    FUENTE_LATENCIA_MS=200      Latencia por llamada; admite rango '100-800'
+    FUENTE_PROB_FALLO=0.1       Probabilidad de fallo por llamada (0-1)
+    FUENTE_TIPO_FALLO=error     'error' (HTTP 500), 'cuota' (HTTP 429) o 'timeout'
+
+Uso (grabar respuestas reales o generar un directorio sintético):
+    python fuentes_datos.py grabar --dir datos_grabados
+    python fuentes_datos.py sintetico --dir datos_prueba --filas 50000
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+try:
+    import gspread
+    GSPREAD_AVAILABLE = True
+except ImportError:
+    GSPREAD_AVAILABLE = False
+
+ARCHIVO_CLIMA = "clima.json"
+
+# URLs con las que el backend local responde a load_data_maestra / load_calidad:
+# el ID (/d/<id>/) se resuelve a <id>.json o <id>.csv en el directorio de datos
+URLS_LOCALES = {
+    'data_maestra_url': "https://docs.google.com/spreadsheets/d/maestra/edit",
+    'calidad_url': "https://docs.google.com/spreadsheets/d/calidad/edit",
+}
+
+TIPOS_FALLO = ('error', 'cuota', 'timeout')
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+
+class ConfigFuente:
+    """Backend activo y parámetros de latencia/fallo (una instancia por proceso)."""
+
+    def __init__(self, backend='google', directorio='datos_locales', latencia_ms=(0, 0),
+                 prob_fallo=0.0, tipo_fallo='error', semilla=None):
+        if backend not in ('google', 'local'):
+            raise ValueError(f"Backend desconocido: {backend}")
+        if tipo_fallo not in TIPOS_FALLO:
+            raise ValueError(f"Tipo de fallo desconocido: {tipo_fallo} (usar {', '.join(TIPOS_FALLO)})")
+        self.backend = backend
+        self.directorio = directorio
+        self.latencia_ms = latencia_ms
+        self.prob_fallo = float(prob_fallo)
+        self.tipo_fallo = tipo_fallo
+        self._rng = random.Random(semilla)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(
+            backend=os.environ.get("FUENTE_DATOS", "google"),
+            directorio=os.environ.get("FUENTE_DATOS_DIR", "datos_locales"),
+            latencia_ms=_parsear_latencia(os.environ.get("FUENTE_LATENCIA_MS", "0")),
+            prob_fallo=os.environ.get("FUENTE_PROB_FALLO", "0"),
+            tipo_fallo=os.environ.get("FUENTE_TIPO_FALLO", "error"),
+        )
+
+    def sortear(self):
+        """Latencia (s) y si falla esta llamada; thread-safe para sesiones concurrentes."""
+        with self._lock:
+            latencia = self._rng.uniform(*self.latencia_ms) / 1000
+            falla = self.prob_fallo > 0 and self._rng.random() < self.prob_fallo
+        return latencia, falla
+
+def _parsear_latencia(texto):
+    """'200' -> (200, 200); '100-800' -> (100, 800)."""
+    partes = [float(p) for p in str(texto).split('-', 1)]
+    return (partes[0], partes[-1])
+
+CONFIG = ConfigFuente.desde_entorno()
+
+def configurar(backend='local', directorio=None, latencia_ms=0, prob_fallo=0.0, tipo_fallo='error', semilla=None):
+    """
+    Cambia el backend del proceso (prueba de carga, benchmarks, desarrollo sin red).
+
+    Args:
+        backend (str): 'google' o 'local'
+        directorio (str, optional): Directorio de datos del backend local
+        latencia_ms (int | tuple): Latencia fija o rango (min, max) en milisegundos
+        prob_fallo (float): Probabilidad de fallo por llamada
+        tipo_fallo (str): 'error', 'cuota' o 'timeout'
+        semilla (int, optional): Semilla para que latencias y fallos sean repetibles
+
+    Returns:
+        ConfigFuente: Configuración activa
+    """
+    global CONFIG
+    if not isinstance(latencia_ms, (tuple, list)):
+        latencia_ms = (latencia_ms, latencia_ms)
+    CONFIG = ConfigFuente(backend, directorio or CONFIG.directorio, tuple(latencia_ms),
+                          prob_fallo, tipo_fallo, semilla)
+    return CONFIG
+
+def usar_local():
+    """True si el backend activo es el local."""
+    return CONFIG.backend == 'local'
+
+# ==============================================================================
+# INYECCIÓN DE LATENCIA Y FALLOS
+# ==============================================================================
+
+def _respuesta_http(status, mensaje):
+    """requests.Response mínima con cuerpo de error estilo Google API."""
+    respuesta = requests.Response()
+    respuesta.status_code = status
+    respuesta._content = json.dumps({'error': {'code': status, 'message': mensaje}}).encode('utf-8')
+    respuesta.headers['Content-Type'] = 'application/json'
+    return respuesta
+
+def _error_sheets(tipo):
+    if tipo == 'timeout':
+        return requests.exceptions.ReadTimeout("Fallo inyectado: timeout leyendo Google Sheets")
+    status = 429 if tipo == 'cuota' else 500
+    mensaje = "Quota exceeded for quota metric 'Read requests' (inyectado)" if tipo == 'cuota' else "Internal error (inyectado)"
+    if GSPREAD_AVAILABLE:
+        return gspread.exceptions.APIError(_respuesta_http(status, mensaje))
+    return requests.exceptions.HTTPError(mensaje, response=_respuesta_http(status, mensaje))
+
+def _simular_llamada(timeout=None, error=_error_sheets):
+    """Aplica latencia y, si toca, lanza el fallo configurado (timeout respeta el límite del llamador)."""
+    latencia, falla = CONFIG.sortear()
+    if timeout is not None and latencia > timeout:
+        time.sleep(timeout)
+        raise requests.exceptions.ReadTimeout(f"Latencia simulada {latencia:.2f}s > timeout {timeout}s")
+    if latencia:
+        time.sleep(latencia)
+    if falla:
+        raise error(CONFIG.tipo_fallo)
+
+# ==============================================================================
+# BACKEND LOCAL: GOOGLE SHEETS
+# ==============================================================================
+
+def _no_encontrada(clase, mensaje):
+    if GSPREAD_AVAILABLE:
+        return getattr(gspread.exceptions, clase)(mensaje)
+    return LookupError(mensaje)
+
+class HojaLocal:
+    """Imita gspread.Worksheet sobre un archivo grabado (.json con registros) o .csv."""
+
+    def __init__(self, ruta, titulo):
+        self.ruta = ruta
+        self.title = titulo
+
+    def _leer(self):
+        if self.ruta.endswith('.json'):
+            with open(self.ruta, encoding='utf-8') as f:
+                return pd.DataFrame(json.load(f))
+        # keep_default_na=False: la API devuelve '' en celdas vacías, no NaN
+        return pd.read_csv(self.ruta, keep_default_na=False)
+
+    def get_all_records(self):
+        _simular_llamada()
+        return self._leer().to_dict('records')
+
+    def get_all_values(self):
+        _simular_llamada()
+        df = self._leer()
+        return [list(df.columns)] + df.astype(str).values.tolist()
+
+class LibroLocal:
+    """Imita gspread.Spreadsheet: <id>.json|csv es la primera pestaña, <id>.<pestaña>.json|csv las demás."""
+
+    def __init__(self, directorio, sheet_id):
+        self.directorio = directorio
+        self.id = sheet_id
+
+    def _ruta(self, sufijo):
+        for ext in ('.json', '.csv'):
+            ruta = os.path.join(self.directorio, f"{self.id}{sufijo}{ext}")
+            if os.path.exists(ruta):
+                return ruta
+        return None
+
+    def get_worksheet(self, index):
+        ruta = self._ruta('') if index == 0 else None
+        return HojaLocal(ruta, self.id) if ruta else None
+
+    def worksheet(self, nombre):
+        ruta = self._ruta(f".{nombre}")
+        if ruta is None:
+            raise _no_encontrada('WorksheetNotFound', nombre)
+        return HojaLocal(ruta, nombre)
+
+class ClienteSheetsLocal:
+    """Imita gspread.Client resolviendo cada ID de hoja a un archivo del directorio de datos."""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def open_by_key(self, sheet_id):
+        _simular_llamada()
+        libro = LibroLocal(self.directorio, sheet_id)
+        if libro._ruta('') is None:
+            raise _no_encontrada('SpreadsheetNotFound', sheet_id)
+        return libro
+
+def cliente_sheets():
+    """Cliente gspread-compatible del backend local."""
+    return ClienteSheetsLocal(CONFIG.directorio)
+
+def url_hoja(clave, secrets=None):
+    """
+    URL de una hoja configurada ('data_maestra_url' o 'calidad_url').
+    En el backend local no requiere secrets.toml; en Google lanza KeyError si falta.
+    """
+    if usar_local():
+        return URLS_LOCALES[clave]
+    return secrets["google_sheets"][clave]
+
+# ==============================================================================
+# BACKEND LOCAL: OPEN-METEO
+# ==============================================================================
+
+class RespuestaLocal:
+    """Subconjunto de requests.Response usado por obtener_clima_ica."""
+
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"HTTP {self.status_code}", response=self)
+
+def _error_clima(tipo):
+    if tipo == 'timeout':
+        return requests.exceptions.ReadTimeout("Fallo inyectado: timeout Open-Meteo")
+    return requests.exceptions.ConnectionError(f"Fallo inyectado ({tipo}): Open-Meteo no disponible")
+
+def _serie_clima(inicio, fin):
+    """Serie grabada en clima.json; si no existe, temperatura sintética determinística."""
+    ruta = os.path.join(CONFIG.directorio, ARCHIVO_CLIMA)
+    if os.path.exists(ruta):
+        with open(ruta, encoding='utf-8') as f:
+            serie = json.load(f)
+        return [(d, t) for d, t in zip(serie['time'], serie['temperature_2m_max']) if inicio <= d <= fin]
+    fechas = pd.date_range(inicio, fin, freq='D')
+    dia = fechas.dayofyear.to_numpy()
+    temps = np.round(27 + 4 * np.sin(dia / 9) + 2 * np.cos(dia / 3.7), 1)
+    return list(zip(fechas.strftime('%Y-%m-%d'), temps.tolist()))
+
+def http_get(url, params=None, timeout=None):
+    """
+    Reemplazo de requests.get para las APIs externas (hoy solo Open-Meteo).
+    En el backend local responde el archivo de Open-Meteo con la serie grabada o sintética.
+    """
+    if not usar_local():
+        return requests.get(url, params=params, timeout=timeout)
+    _simular_llamada(timeout, error=_error_clima)
+    dias = _serie_clima(params['start_date'], params['end_date'])
+    return RespuestaLocal({'daily': {'time': [d for d, _ in dias], 'temperature_2m_max': [t for _, t in dias]}})
+
+# ==============================================================================
+# PREPARACIÓN DE DIRECTORIOS (SINTÉTICO Y GRABADO)
+# ==============================================================================
+
+def preparar_sintetico(directorio, n_filas, semilla=42):
+    """Genera maestra.csv, calidad.csv y clima.json sintéticos si no existen en el directorio."""
+    import datos_sinteticos
+
+    os.makedirs(directorio, exist_ok=True)
+    rutas = [os.path.join(directorio, a) for a in ("maestra.csv", "calidad.csv", ARCHIVO_CLIMA)]
+    if all(os.path.exists(r) for r in rutas):
+        return
+
+    maestra, calidad = datos_sinteticos.generar_dataset(n_filas, semilla=semilla)
+    maestra.to_csv(rutas[0], index=False)
+    calidad.to_csv(rutas[1], index=False)
+
+    rng = np.random.default_rng(semilla)
+    fechas = pd.date_range(maestra['Fecha'].min(), maestra['Fecha'].max(), freq='D')
+    temps = np.round(27 + 4 * np.sin(np.arange(len(fechas)) / 9) + rng.normal(0, 1, len(fechas)), 1)
+    with open(rutas[2], 'w', encoding='utf-8') as f:
+        json.dump({'time': [d.strftime('%Y-%m-%d') for d in fechas], 'temperature_2m_max': temps.tolist()}, f)
+
+def grabar(directorio, dias_clima=365):
+    """
+    Graba las respuestas reales (hojas configuradas en secrets.toml y el último año de clima)
+    en el formato que sirve el backend local. Requiere credenciales y red.
+    """
+    import streamlit as st
+    from datetime import date, timedelta
+    import google_sheets_utils as gs_utils
+    from procesamiento_datos import URL_OPEN_METEO, PARAMS_OPEN_METEO
+
+    os.makedirs(directorio, exist_ok=True)
+    cliente = gs_utils.get_gspread_client()
+    for clave, url_local in URLS_LOCALES.items():
+        url = st.secrets["google_sheets"][clave]
+        registros = cliente.open_by_key(gs_utils.extract_sheet_id(url)).get_worksheet(0).get_all_records()
+        destino = os.path.join(directorio, f"{gs_utils.extract_sheet_id(url_local)}.json")
+        with open(destino, 'w', encoding='utf-8') as f:
+            json.dump(registros, f, ensure_ascii=False, default=str)
+        print(f"  {clave}: {len(registros):,} filas -> {destino}")
+
+    fin = date.today() - timedelta(days=2)  # El archivo histórico va con ~2 días de retraso
+    params = dict(PARAMS_OPEN_METEO, start_date=(fin - timedelta(days=dias_clima)).isoformat(), end_date=fin.isoformat())
+    data = requests.get(URL_OPEN_METEO, params=params, timeout=30).json()['daily']
+    with open(os.path.join(directorio, ARCHIVO_CLIMA), 'w', encoding='utf-8') as f:
+        json.dump({'time': data['time'], 'temperature_2m_max': data['temperature_2m_max']}, f)
+    print(f"  clima: {len(data['time'])} días -> {os.path.join(directorio, ARCHIVO_CLIMA)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepara un directorio para el backend local de fuentes de datos")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    p_grabar = sub.add_parser('grabar', help="Graba las hojas y el clima reales (requiere credenciales)")
+    p_grabar.add_argument('--dir', default='datos_locales')
+    p_grabar.add_argument('--dias-clima', type=int, default=365)
+    p_sint = sub.add_parser('sintetico', help="Genera hojas y clima sintéticos")
+    p_sint.add_argument('--dir', default='datos_locales')
+    p_sint.add_argument('--filas', type=int, default=50_000)
+    p_sint.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.comando == 'grabar':
+        grabar(args.dir, args.dias_clima)
+    else:
+        preparar_sintetico(args.dir, args.filas, args.semilla)
+        print(f"Datos sintéticos en {args.dir}")
+
+if __name__ == "__main__":
+    main()
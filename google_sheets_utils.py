@@ -9,14 +9,23 @@ import gspread
 from google.oauth2.service_account import Credentials
 import re
 
+import fuentes_datos
+from lectura_excel import leer_excel
+from perfilador import cache_data_medido
+from metricas import SHEETS_LLAMADAS, SHEETS_DURACION, SHEETS_FILAS, SHEETS_AUTENTICACIONES, FALLBACK_EXCEL
+
 @st.cache_resource
 def get_gspread_client():
     """
     Crea y cachea el cliente de gspread usando las credenciales de Streamlit secrets.
+    Con FUENTE_DATOS=local devuelve el cliente local de fuentes_datos (sin credenciales).
     
     Returns:
         gspread.Client: Cliente autenticado de gspread
     """
+    if fuentes_datos.usar_local():
+        return fuentes_datos.cliente_sheets()
+    
     try:
         # Cargar credenciales desde secrets
         credentials_dict = dict(st.secrets["gcp_service_account"])
@@ -32,8 +41,11 @@ def get_gspread_client():
             scopes=scopes
         )
         
-        return gspread.authorize(credentials)
+        client = gspread.authorize(credentials)
+        SHEETS_AUTENTICACIONES.inc(resultado="ok")
+        return client
     except Exception as e:
+        SHEETS_AUTENTICACIONES.inc(resultado="error")
         st.error(f"Error al autenticar con Google: {e}")
         return None
 
@@ -52,7 +64,12 @@ def extract_sheet_id(url):
         return match.group(1)
     return None
 
-@st.cache_data(ttl=600, show_spinner="Cargando datos desde Google Sheets...")
+def _es_error_cuota(error):
+    """True si la API respondió 429 (cuota de lecturas por minuto agotada)."""
+    respuesta = getattr(error, 'response', None)
+    return getattr(respuesta, 'status_code', None) == 429
+
+@cache_data_medido(ttl=600, show_spinner="Cargando datos desde Google Sheets...")
 def load_sheet_as_dataframe(_client, sheet_url, sheet_name=None):
     """
     Carga una hoja de Google Sheets como DataFrame de pandas.
@@ -76,30 +93,37 @@ def load_sheet_as_dataframe(_client, sheet_url, sheet_name=None):
             st.error(f"No se pudo extraer el ID de la URL: {sheet_url}")
             return pd.DataFrame()
         
-        # Abrir la hoja
-        spreadsheet = _client.open_by_key(sheet_id)
-        
-        # Seleccionar pestaña
-        if sheet_name:
-            worksheet = spreadsheet.worksheet(sheet_name)
-        else:
-            worksheet = spreadsheet.get_worksheet(0)  # Primera pestaña
-        
-        # Obtener todos los datos
-        data = worksheet.get_all_records()
+        # Lectura real contra la API (solo ocurre en un miss de caché)
+        with SHEETS_DURACION.medir():
+            # Abrir la hoja
+            spreadsheet = _client.open_by_key(sheet_id)
+            
+            # Seleccionar pestaña
+            if sheet_name:
+                worksheet = spreadsheet.worksheet(sheet_name)
+            else:
+                worksheet = spreadsheet.get_worksheet(0)  # Primera pestaña
+            
+            # Obtener todos los datos
+            data = worksheet.get_all_records()
         
         # Convertir a DataFrame
         df = pd.DataFrame(data)
+        SHEETS_LLAMADAS.inc(resultado="ok" if not df.empty else "vacia")
+        SHEETS_FILAS.set(len(df), hoja=sheet_name or sheet_id)
         
         return df
     
     except gspread.exceptions.SpreadsheetNotFound:
+        SHEETS_LLAMADAS.inc(resultado="no_encontrada")
         st.error(f"❌ No se encontró la hoja de cálculo. Verifica que el ID sea correcto y que la Service Account tenga acceso.")
         return pd.DataFrame()
     except gspread.exceptions.WorksheetNotFound:
+        SHEETS_LLAMADAS.inc(resultado="no_encontrada")
         st.error(f"❌ No se encontró la pestaña '{sheet_name}'. Verifica el nombre.")
         return pd.DataFrame()
     except Exception as e:
+        SHEETS_LLAMADAS.inc(resultado="cuota" if _es_error_cuota(e) else "error")
         st.error(f"Error al cargar datos: {e}")
         return pd.DataFrame()
 
@@ -117,7 +141,7 @@ def load_data_maestra():
         return pd.DataFrame()
     
     try:
-        url = st.secrets["google_sheets"]["data_maestra_url"]
+        url = fuentes_datos.url_hoja("data_maestra_url", st.secrets)
         df = load_sheet_as_dataframe(client, url)
         
         if df.empty:
@@ -142,7 +166,7 @@ def load_calidad():
         return pd.DataFrame()
     
     try:
-        url = st.secrets["google_sheets"]["calidad_url"]
+        url = fuentes_datos.url_hoja("calidad_url", st.secrets)
         df = load_sheet_as_dataframe(client, url)
         
         if df.empty:
@@ -175,7 +199,8 @@ def load_data_with_fallback(use_google_sheets=True):
     if df_maestra.empty:
         try:
             st.warning("⚠️ Intentando cargar desde archivo local...")
-            df_maestra = pd.read_excel("Data_Maestra_Limpia.xlsx")
+            FALLBACK_EXCEL.inc(hoja="data_maestra")
+            df_maestra = leer_excel("Data_Maestra_Limpia.xlsx")
             st.success("✅ Data Maestra cargada desde archivo local")
         except Exception as e:
             st.error(f"No se pudo cargar Data Maestra: {e}")
@@ -187,7 +212,8 @@ def load_data_with_fallback(use_google_sheets=True):
             import glob
             files = glob.glob("*calidad*.xlsx") + glob.glob("*calidad*.xls")
             if files:
-                df_calidad = pd.read_excel(files[0])
+                FALLBACK_EXCEL.inc(hoja="calidad")
+                df_calidad = leer_excel(files[0])
                 st.success(f"✅ Calidad cargada desde {files[0]}")
         except Exception as e:
             st.info(f"Calidad no disponible localmente: {e}")
@@ -0,0 +1,203 @@
+"""
+Preparación de datos para gráficos: reduce lo que se envía al navegador sin cambiar la forma
+de las curvas. Las series temporales largas se reducen con LTTB (Largest-Triangle-Three-Buckets),
+que conserva picos y caídas, a un número de puntos acorde al ancho del gráfico; los gráficos por
+lote muestran los N lotes principales y agrupan el resto en "Otros". mostrar_figura registra el
+tamaño servido de cada figura en el panel Debug Sistema y hace cumplir BYTES_MAX_FIGURA: baja
+los puntos de las trazas de línea/dispersión y, si aun así no entra, no envía el gráfico.
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+import streamlit as st
+
+from perfilador import medir_etapa, registrar_figura, traza_actual
+
+# Un gráfico a ancho completo ronda los 1000-1400 px: más puntos por serie no se distinguen
+PUNTOS_MAX_SERIE = 800
+# Gráficos por lote (media columna): más barras o etiquetas que esto se vuelven ilegibles
+LOTES_MAX_GRAFICO = 40
+ETIQUETA_OTROS = "Otros"
+COLOR_OTROS = '#9E9E9E'
+# Sobre este número de puntos las trazas de dispersión pasan a WebGL (Scattergl)
+PUNTOS_WEBGL = 1000
+# JSON servido por figura; por encima se reducen las trazas y, si no alcanza, se omite el gráfico
+BYTES_MAX_FIGURA = 500_000
+# Piso de puntos por traza al reducir una figura que excede el presupuesto
+PUNTOS_MIN_TRAZA = 100
+# Campos por punto que se recortan junto con x/y
+CAMPOS_POR_PUNTO = ('x', 'y', 'text', 'hovertext', 'customdata', 'ids')
+
+def lttb_indices(x, y, n_salida):
+    """
+    Índices de los puntos que conserva LTTB.
+
+    Divide la serie en n_salida - 2 tramos y de cada uno elige el punto que forma el
+    triángulo de mayor área con el punto elegido antes y el promedio del tramo siguiente;
+    el primero y el último siempre se conservan. Los y nulos nunca se eligen si el tramo
+    tiene algún valor.
+
+    Args:
+        x (np.ndarray): Eje x numérico y creciente
+        y (np.ndarray): Valores
+        n_salida (int): Puntos a conservar (>= 3)
+
+    Returns:
+        np.ndarray: Índices ordenados
+    """
+    n = len(x)
+    if n_salida >= n or n_salida < 3:
+        return np.arange(n)
+
+    y_prom = np.where(np.isnan(y), np.nanmean(y) if not np.isnan(y).all() else 0.0, y)
+    limites = np.linspace(1, n - 1, n_salida - 1).astype(np.int64)
+    elegidos = np.empty(n_salida, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    a = 0
+    for i in range(n_salida - 2):
+        ini, fin = limites[i], limites[i + 1]
+        # Promedio del tramo siguiente (el último tramo usa el punto final)
+        sig_ini, sig_fin = fin, limites[i + 2] if i + 2 < len(limites) else n
+        cx, cy = x[sig_ini:sig_fin].mean(), y_prom[sig_ini:sig_fin].mean()
+        area = np.abs((x[a] - cx) * (y[ini:fin] - y[a]) - (x[a] - x[ini:fin]) * (cy - y[a]))
+        area = np.where(np.isnan(area), -1.0, area)
+        a = ini + int(np.argmax(area))
+        elegidos[i + 1] = a
+    return elegidos
+
+def _eje_numerico(x):
+    """Eje x como float (las fechas en nanosegundos) para el cálculo de áreas."""
+    serie = pd.Series(x)
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.astype('int64').to_numpy(dtype=float)
+    return pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float)
+
+@medir_etapa
+def series_reducidas(df, col_x, cols_y, max_puntos=PUNTOS_MAX_SERIE):
+    """
+    Reduce cada serie de df (ordenado por col_x) a max_puntos con LTTB, por separado.
+
+    Returns:
+        dict: {col_y: {'x': ..., 'y': ...}} listo para go.Scatter(**serie) / go.Bar(**serie);
+        con pocas filas devuelve las columnas tal cual
+    """
+    x = df[col_x]
+    series = {}
+    for col in cols_y:
+        if col not in df.columns:
+            continue
+        if max_puntos is None or len(df) <= max_puntos:
+            series[col] = {'x': x, 'y': df[col]}
+            continue
+        idx = lttb_indices(_eje_numerico(x), pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float), max_puntos)
+        series[col] = {'x': x.iloc[idx], 'y': df[col].iloc[idx]}
+    return series
+
+def top_n_con_otros(df, col_etiqueta, col_orden, agregados, n=LOTES_MAX_GRAFICO):
+    """
+    Conserva las n filas con mayor col_orden (en su orden original) y agrupa el resto en
+    una fila ETIQUETA_OTROS al final.
+
+    Args:
+        df (pd.DataFrame): Una fila por etiqueta (ej. df_lotes)
+        col_etiqueta (str): Columna de la etiqueta (ej. lote)
+        col_orden (str): Columna que decide qué filas se muestran
+        agregados (dict): {columna: función} para la fila Otros (ej. {'Produccion_Total': 'sum'})
+        n (int): Filas que se muestran sin agrupar
+
+    Returns:
+        pd.DataFrame: df tal cual si tiene n filas o menos
+    """
+    if len(df) <= n:
+        return df
+    principales = df[col_orden].nlargest(n).index
+    resto = df.drop(index=principales)
+    otros = pd.DataFrame([resto.agg(agregados)])
+    otros[col_etiqueta] = f"{ETIQUETA_OTROS} ({len(resto)})"
+    return pd.concat([df.loc[df.index.isin(principales)], otros], ignore_index=True)
+
+def etiquetas_top_n(df, col_etiqueta, col_orden, n=LOTES_MAX_GRAFICO):
+    """Texto de cada punto: la etiqueta para las n filas con mayor col_orden, vacío para el resto."""
+    if len(df) <= n:
+        return df[col_etiqueta]
+    return df[col_etiqueta].where(df.index.isin(df[col_orden].nlargest(n).index), "")
+
+def clase_dispersion(n_puntos):
+    """go.Scattergl sobre PUNTOS_WEBGL puntos (dibuja en GPU), go.Scatter por debajo."""
+    return go.Scattergl if n_puntos > PUNTOS_WEBGL else go.Scatter
+
+def _puntos_figura(fig):
+    puntos = 0
+    for traza in fig.data:
+        for campo in ('x', 'y', 'labels', 'z'):
+            valores = getattr(traza, campo, None)
+            if valores is not None:
+                puntos += len(valores)
+                break
+    return puntos
+
+def _indices_traza(x, y, n_salida):
+    """LTTB si x es numérico y creciente; si no (ej. categorías), una muestra uniforme."""
+    eje = _eje_numerico(x)
+    if not np.isnan(eje).any() and (np.diff(eje) >= 0).all():
+        return lttb_indices(eje, pd.to_numeric(pd.Series(y), errors='coerce').to_numpy(dtype=float), n_salida)
+    return np.unique(np.linspace(0, len(x) - 1, n_salida).astype(np.int64))
+
+def _por_punto(valores, n):
+    """True si valores es un arreglo con un valor por punto (no un escalar ni un texto fijo)."""
+    return valores is not None and not isinstance(valores, str) and np.ndim(valores) == 1 and len(valores) == n
+
+def _reducir_figura(fig, factor):
+    """
+    Baja los puntos de cada traza de línea/dispersión de fig (en el lugar) a factor de los
+    actuales, con piso PUNTOS_MIN_TRAZA. Las barras, treemaps y heatmaps no se tocan: ya vienen
+    limitadas con top_n_con_otros y quitarles categorías cambiaría lo que muestran.
+
+    Returns:
+        bool: True si alguna traza se redujo
+    """
+    reducida = False
+    for traza in fig.data:
+        if traza.type not in ('scatter', 'scattergl') or traza.x is None or traza.y is None:
+            continue
+        n = len(traza.x)
+        objetivo = max(PUNTOS_MIN_TRAZA, int(n * factor))
+        if objetivo >= n or len(traza.y) != n:
+            continue
+        idx = _indices_traza(traza.x, traza.y, objetivo)
+        cambios = {}
+        for campo in CAMPOS_POR_PUNTO:
+            if _por_punto(getattr(traza, campo, None), n):
+                cambios[campo] = np.asarray(getattr(traza, campo))[idx]
+        marker = getattr(traza, 'marker', None)
+        for campo in ('size', 'color'):
+            if marker is not None and _por_punto(getattr(marker, campo, None), n):
+                cambios.setdefault('marker', {})[campo] = np.asarray(getattr(marker, campo))[idx]
+        traza.update(cambios)
+        reducida = True
+    return reducida
+
+def mostrar_figura(fig, nombre=None, presupuesto=BYTES_MAX_FIGURA, **kwargs):
+    """
+    st.plotly_chart(fig, use_container_width=True, **kwargs) dentro de presupuesto bytes de JSON
+    (el mismo pio.to_json que usa Streamlit): si lo excede, reduce las trazas de línea/dispersión
+    (hasta 3 pasadas) y, si aun así no entra, muestra un aviso en lugar del gráfico. Registra
+    trazas, puntos y tamaño final en la traza del rerun.
+    """
+    bytes_json = len(pio.to_json(fig, validate=False))
+    for _ in range(3):
+        if presupuesto is None or bytes_json <= presupuesto or not _reducir_figura(fig, 0.9 * presupuesto / bytes_json):
+            break
+        bytes_json = len(pio.to_json(fig, validate=False))
+    if traza_actual() is not None:
+        registrar_figura(nombre, trazas=len(fig.data), puntos=_puntos_figura(fig),
+                         bytes_json=bytes_json, presupuesto=presupuesto)
+    if presupuesto is not None and bytes_json > presupuesto:
+        st.warning(f"⚠️ Gráfico omitido: {bytes_json / 1024:,.0f} KB supera el límite de "
+                   f"{presupuesto / 1024:,.0f} KB. Acota el periodo o los filtros para verlo.")
+        return
+    kwargs.setdefault('use_container_width', True)
+    st.plotly_chart(fig, **kwargs)
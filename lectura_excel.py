@@ -0,0 +1,200 @@
+"""
+Lectura por tramos de los Excel de respaldo (Data_Maestra_Limpia.xlsx, *calidad*.xlsx) cuando
+Google Sheets no responde. En vez del DOM completo de openpyxl más un DataFrame de objetos
+(pd.read_excel), las filas se recorren en modo read_only (iter_rows) y cada tramo se tipa por
+columna y se convierte a columnas Arrow; la memoria máxima es la de un tramo más la tabla ya
+tipada. El resultado se guarda como snapshot Arrow junto al libro, con clave ruta + mtime +
+tamaño: el mismo libro se parsea una sola vez (las lecturas siguientes son un memory-map).
+
+Se replican las reglas de pd.read_excel: primera fila como encabezado ("Unnamed: i" y ".1"
+para vacíos y repetidos), filas vacías conservadas salvo las del final, números enteros como
+int, textos nulos por defecto ("NA", "#N/A", "") como nulos y columnas de texto numérico
+convertidas a número. Una columna con tipos mezclados (ej. números y texto) queda como
+texto, como en el almacén Arrow (pd.read_excel la deja como objetos de cada tipo).
+
+Estructura:
+    <directorio del libro>/.cache_excel/<libro>-<mtime_ns>-<tamaño>.arrow
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import os
+from datetime import date, datetime
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    from openpyxl import load_workbook
+    STREAMING_AVAILABLE = True
+except ImportError:
+    STREAMING_AVAILABLE = False
+
+DIRECTORIO_CACHE = ".cache_excel"
+FILAS_POR_TRAMO = 50_000
+# Textos que pd.read_excel toma como nulos (na_values por defecto) y errores de celda
+VALORES_NULOS = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                 "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+                 "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#NULL!"}
+
+def ruta_snapshot(ruta):
+    """Snapshot Arrow de un libro según su ruta, fecha de modificación y tamaño."""
+    info = os.stat(ruta)
+    carpeta, archivo = os.path.split(os.path.abspath(ruta))
+    return os.path.join(carpeta, DIRECTORIO_CACHE, f"{archivo}-{info.st_mtime_ns}-{info.st_size}.arrow")
+
+def _normalizar(valor):
+    # Mismas conversiones de celda que el lector openpyxl de pandas
+    if valor is None or (isinstance(valor, str) and valor in VALORES_NULOS):
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if isinstance(valor, date) and not isinstance(valor, datetime):
+        return datetime(valor.year, valor.month, valor.day)
+    return valor
+
+def _columna_tipada(valores):
+    """Arreglo Arrow de una columna de un tramo, con el tipo que le daría pd.read_excel."""
+    tipos = {type(v) for v in valores if v is not None}
+    if not tipos:
+        return pa.nulls(len(valores))
+    if tipos == {int}:
+        return pa.array(valores, type=pa.int64())
+    if tipos <= {int, float}:
+        return pa.array(valores, type=pa.float64())
+    if tipos == {bool}:
+        return pa.array(valores, type=pa.bool_())
+    if tipos <= {datetime, pd.Timestamp}:
+        return pa.array(valores, type=pa.timestamp('ns'))
+    if tipos == {str}:
+        return pa.array(valores, type=pa.string())
+    return pa.array([None if v is None else str(v) for v in valores], type=pa.string())
+
+def _unir_tramos(tramos):
+    """Une los tramos de una columna con un solo tipo: int+float -> float, mezcla -> texto."""
+    tipos = {t.type for t in tramos if not pa.types.is_null(t.type)}
+    if not tipos:
+        return pa.chunked_array([t.cast(pa.float64()) for t in tramos], type=pa.float64())
+    if len(tipos) == 1:
+        tipo = tipos.pop()
+    elif tipos == {pa.int64(), pa.float64()}:
+        tipo = pa.float64()
+    else:
+        return pa.chunked_array([_columna_tipada([None if v is None else str(v) for v in t.to_pylist()])
+                                 for t in tramos], type=pa.string())
+    return pa.chunked_array([t.cast(tipo) for t in tramos], type=tipo)
+
+def _encabezado(fila):
+    nombres, vistos = [], {}
+    for i, valor in enumerate(fila):
+        nombre = f"Unnamed: {i}" if valor is None or valor == "" else str(valor)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        vistos.setdefault(nombre, 0)
+        nombres.append(nombre)
+    return nombres
+
+def _ancho(fila):
+    """Celdas hasta la última con dato (pandas descarta las vacías del final)."""
+    ancho = len(fila)
+    while ancho and fila[ancho - 1] is None:
+        ancho -= 1
+    return ancho
+
+def _leer_por_tramos(ruta, filas_por_tramo):
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        primera = [_normalizar(v) for v in next(filas, [])]
+        encabezado = primera[:_ancho(primera)]
+        columnas = [[] for _ in encabezado]
+        # Filas vacías pendientes: se agregan solo si después viene una fila con datos
+        n_filas, tramo, vacias = 0, [], 0
+
+        def cerrar_tramo():
+            ancho = max([len(columnas)] + [_ancho(f) for f in tramo])
+            # Datos más anchos que el encabezado: columnas nuevas, nulas en los tramos anteriores
+            while len(columnas) < ancho:
+                columnas.append([pa.nulls(n_filas)] if n_filas else [])
+                encabezado.append(None)
+            for i, partes in enumerate(columnas):
+                partes.append(_columna_tipada([f[i] if i < len(f) else None for f in tramo]))
+
+        for fila in filas:
+            fila = [_normalizar(v) for v in fila]
+            if not _ancho(fila):
+                vacias += 1
+                continue
+            tramo.extend([[]] * vacias + [fila])
+            vacias = 0
+            if len(tramo) >= filas_por_tramo:
+                cerrar_tramo()
+                n_filas += len(tramo)
+                tramo = []
+        if tramo:
+            cerrar_tramo()
+            n_filas += len(tramo)
+    finally:
+        libro.close()
+
+    if not columnas:
+        return pd.DataFrame()
+    nombres = _encabezado(encabezado)
+    if not n_filas:
+        return pd.DataFrame(columns=nombres)
+    tabla = pa.table([_unir_tramos(partes) for partes in columnas], names=nombres)
+    df = tabla.to_pandas()
+    # Como pd.read_excel: una columna de texto que es toda numérica pasa a número, y una
+    # booleana con vacíos a 1.0/0.0
+    for nombre, columna in zip(nombres, tabla.columns):
+        if pa.types.is_boolean(columna.type) and columna.null_count:
+            df[nombre] = columna.cast(pa.float64()).to_pandas()
+        elif pa.types.is_string(columna.type):
+            try:
+                df[nombre] = pd.to_numeric(df[nombre])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+def _guardar_snapshot(df, destino):
+    carpeta = os.path.dirname(destino)
+    os.makedirs(carpeta, exist_ok=True)
+    prefijo = os.path.basename(destino).rsplit('-', 2)[0] + '-'
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(temporal, 'wb') as sink:
+        with pa.ipc.new_file(sink, tabla.schema) as writer:
+            writer.write_table(tabla)
+    os.replace(temporal, destino)
+    # Snapshots de versiones anteriores del mismo libro
+    for archivo in os.listdir(carpeta):
+        ruta = os.path.join(carpeta, archivo)
+        if archivo.startswith(prefijo) and archivo.endswith('.arrow') and ruta != destino:
+            os.remove(ruta)
+
+def leer_excel(ruta, filas_por_tramo=FILAS_POR_TRAMO):
+    """
+    Primera hoja de un libro .xlsx como DataFrame, desde su snapshot si el libro no cambió.
+
+    Sin pyarrow u openpyxl, o con formatos que openpyxl no lee (.xls), usa pd.read_excel.
+
+    Args:
+        ruta (str): Ruta del libro
+        filas_por_tramo (int): Filas que se tipan juntas (acota la memoria de la lectura)
+
+    Returns:
+        pd.DataFrame: Mismas columnas y tipos que pd.read_excel(ruta)
+    """
+    if not STREAMING_AVAILABLE or not ruta.lower().endswith(('.xlsx', '.xlsm')):
+        return pd.read_excel(ruta)
+    snapshot = ruta_snapshot(ruta)
+    if os.path.exists(snapshot):
+        with pa.memory_map(snapshot, 'r') as fuente:
+            return pa.ipc.open_file(fuente).read_all().to_pandas()
+    df = _leer_por_tramos(ruta, filas_por_tramo)
+    try:
+        _guardar_snapshot(df, snapshot)
+    except OSError:
+        # Directorio de solo lectura: se sigue sin snapshot (se parsea en cada carga)
+        pass
+    return df
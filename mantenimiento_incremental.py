@@ -0,0 +1,226 @@
+"""
+Mantenimiento incremental de las tablas derivadas que publica refrescador.py.
+Cada versión guarda una huella por partición de los datos limpios: (fecha, labor) en Data
+Maestra y fecha en Calidad. Al refrescar se comparan con las de la versión anterior y solo
+se recalculan las filas derivadas de las particiones que cambiaron (altas, bajas o
+modificaciones); el resto se toma tal cual de la versión anterior y se empalma. En el
+feature store IA un cambio en un día también mueve los retardos y ventanas de los días
+siguientes: se recalcula hasta ALCANCE_FEATURES_IA días después. El historial por operario
+se reordena entero en cada versión (es un ordenamiento, no un recálculo).
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import numpy as np
+import pandas as pd
+
+from procesamiento_datos import (preparar_produccion_cruce_completa, construir_cubo_defectos, LABOR_CRUCE,
+                                 COLUMNAS_DERIVADAS, CLAVES_PERSONA, base_features_ia, features_serie_ia,
+                                 features_clima_ia, unir_clima_ia, construir_features_ia, ALCANCE_FEATURES_IA,
+                                 COLUMNAS_CLIMA_IA, construir_historial_operarios)
+
+COLUMNAS_HUELLA = ['H_Bajo', 'H_Alto', 'Filas']
+
+def huellas_particiones(df, claves):
+    """
+    Huella de cada partición: suma de los hashes de sus filas (partidos en dos mitades de
+    32 bits para sumar sin desborde) y cantidad de filas. No depende del orden de las filas.
+    Las columnas derivadas no se hashean: salen de las demás.
+
+    Args:
+        df (pd.DataFrame): Datos limpios
+        claves (dict): {nombre de la clave: Series de df} (ej. {'Fecha': fechas normalizadas})
+
+    Returns:
+        pd.DataFrame: Una fila por partición (claves + H_Bajo, H_Alto, Filas)
+    """
+    origen = df[[c for c in df.columns if c not in COLUMNAS_DERIVADAS]]
+    h = pd.util.hash_pandas_object(origen, index=False).to_numpy()
+    partes = pd.DataFrame({'H_Bajo': (h & 0xFFFFFFFF).astype(np.int64), 'H_Alto': (h >> 32).astype(np.int64)})
+    grupos = [serie.rename(nombre).reset_index(drop=True) for nombre, serie in claves.items()]
+    return partes.groupby(grupos, dropna=False).agg(
+        H_Bajo=('H_Bajo', 'sum'), H_Alto=('H_Alto', 'sum'), Filas=('H_Bajo', 'size')).reset_index()
+
+def particiones_cambiadas(nuevas, anteriores):
+    """Claves de las particiones nuevas, borradas o con huella distinta entre dos versiones."""
+    claves = [c for c in nuevas.columns if c not in COLUMNAS_HUELLA]
+    cruce = nuevas.merge(anteriores, on=claves, how='outer', suffixes=('', '_ant'), indicator=True)
+    distinta = (cruce['_merge'] != 'both')
+    for col in COLUMNAS_HUELLA:
+        distinta |= cruce[col] != cruce[f'{col}_ant']
+    return cruce.loc[distinta, claves].reset_index(drop=True)
+
+def empalmar(anterior, recalculado, columna, valores):
+    """
+    Filas de la versión anterior fuera de `valores` (en `columna`) más las recalculadas, al
+    final. El orden de filas no cambia los resultados: quienes usan estas tablas agregan o
+    recortan por máscara. Las columnas category se vuelven a tipar con categorías ordenadas.
+    """
+    fuera = ~anterior[columna].isin(valores)
+    conservadas = anterior if fuera.all() else anterior[fuera.to_numpy()]
+    if conservadas.empty or recalculado.empty:
+        return (recalculado if conservadas.empty else conservadas).reset_index(drop=True)
+    # Columna a columna: el concat de DataFrames recorre fila a fila las columnas object todo-nulas
+    tabla = pd.DataFrame({col: pd.concat([conservadas[col], recalculado[col]], ignore_index=True)
+                          for col in anterior.columns})
+    for col in anterior.columns:
+        if isinstance(anterior[col].dtype, pd.CategoricalDtype) and not isinstance(tabla[col].dtype, pd.CategoricalDtype):
+            tabla[col] = tabla[col].astype('category')
+    return tabla
+
+def _recodificar_personas(tabla, df, col_map):
+    """
+    Los códigos de persona (Dni_Key, Operario_Key) son densos sobre todo Data Maestra: una
+    persona nueva corre los códigos de las demás. Se reasignan en la tabla empalmada con los
+    valores de la versión nueva (mismo resultado que codificar_personas sobre df).
+    """
+    for rol, clave in CLAVES_PERSONA.items():
+        col = col_map.get(rol)
+        if clave in tabla.columns and col in tabla.columns and col in df.columns:
+            _, valores = pd.factorize(df[col], sort=True)
+            codigos = valores.get_indexer(tabla[col])
+            tabla[clave] = pd.arrays.IntegerArray(codigos.astype(np.int32), codigos < 0)
+    return tabla
+
+def _claves_maestra(df, col_map):
+    fechas = df['Fecha_Dia'] if 'Fecha_Dia' in df.columns else df[col_map['Fecha']].dt.normalize()
+    claves = {'Fecha': fechas}
+    if col_map.get('Labor') and col_map['Labor'] in df.columns:
+        claves['Labor'] = df[col_map['Labor']]
+    return claves
+
+def _tramos_de_fechas(fechas, alcance):
+    """Tramos [primer día, último día + alcance] de las fechas cambiadas, unidos si se solapan."""
+    tramos = []
+    for fecha in sorted(fechas):
+        if tramos and fecha <= tramos[-1][1]:
+            tramos[-1][1] = fecha + alcance
+        else:
+            tramos.append([fecha, fecha + alcance])
+    return tramos
+
+def actualizar_features_ia(anterior, df, col_map, cambiadas):
+    """
+    Feature store IA de la versión nueva a partir del anterior: por cada labor con particiones
+    cambiadas se recalculan sus filas de cada día cambiado hasta ALCANCE_FEATURES_IA días
+    después, con la base de ese tramo y de los ALCANCE_FEATURES_IA días anteriores (lo que
+    miran las ventanas). Sin labor en el col_map, los tramos abarcan todos los lotes.
+
+    Returns:
+        tuple: (feature store sin las columnas de clima, filas recalculadas)
+    """
+    alcance = pd.Timedelta(days=ALCANCE_FEATURES_IA)
+    claves = _claves_maestra(df, col_map)
+    previo = anterior.drop(columns=COLUMNAS_CLIMA_IA, errors='ignore')
+    con_labor = 'Labor' in cambiadas.columns and 'Feature_Labor' in previo.columns
+    grupos = cambiadas.dropna().groupby('Labor')['Fecha'] if con_labor else [(None, cambiadas['Fecha'].dropna())]
+    # Solo las columnas de la base: cada tramo copia menos
+    dni = 'Dni_Key' if 'Dni_Key' in df.columns else col_map['Dni']
+    datos = df[list(dict.fromkeys(c for c in ('Fecha_Dia', col_map['Fecha'], col_map['Lote'], col_map.get('Labor'),
+                                               col_map['Rendimiento_Hora'], dni) if c and c in df.columns))]
+    fechas_df = claves['Fecha'].to_numpy()
+    codigos_labor, labores = pd.factorize(claves['Labor']) if con_labor else (None, None)
+    rehechas = np.zeros(len(previo), dtype=bool)
+    partes = []
+    for labor, fechas in grupos:
+        for desde, hasta in _tramos_de_fechas(fechas.unique(), alcance):
+            filas = (fechas_df >= desde - alcance) & (fechas_df <= hasta)
+            en_previo = previo['Fecha'].between(desde, hasta).to_numpy()
+            if labor is not None:
+                filas &= codigos_labor == labores.get_loc(labor)
+                en_previo = en_previo & (previo['Feature_Labor'] == labor).to_numpy()
+            tramo = features_serie_ia(base_features_ia(datos[filas], col_map))
+            partes.append(tramo[tramo['Fecha'].between(desde, hasta).to_numpy()])
+            rehechas |= en_previo
+    if not partes:
+        return previo, 0
+    conservadas = previo[~rehechas]
+    tabla = pd.DataFrame({col: pd.concat([conservadas[col]] + [p[col] for p in partes], ignore_index=True)
+                          for col in previo.columns})
+    return tabla, sum(len(p) for p in partes)
+
+def construir_derivadas(df, col_map, df_calidad, anterior=None, df_clima=None):
+    """
+    Tablas derivadas de una versión (produccion_cruce, cubo_defectos, el feature store IA y
+    el historial por operario: historial_operarios y resumen_operarios) y las huellas de sus
+    particiones; con `anterior` recalcula solo las fechas afectadas por un cambio.
+
+    Args:
+        df (pd.DataFrame): Data Maestra limpia (con columnas derivadas)
+        col_map (dict): Mapa de columnas de df
+        df_calidad (pd.DataFrame): Calidad limpia
+        anterior (dict, optional): Versión vigente: col_map, huellas_maestra, huellas_calidad,
+            produccion_cruce, cubo_defectos, features_ia y clima (None o incompleta: recálculo
+            completo)
+        df_clima (pd.DataFrame, optional): Temperatura diaria de la temporada (Fecha,
+            Temp_Max_Ica); vacío o None: se reutiliza el clima de la versión anterior
+
+    Returns:
+        tuple: (tablas, resumen) con tablas = derivadas + huellas_maestra/huellas_calidad, y
+        resumen = modo ('completo'/'incremental') y particiones y fechas recalculadas
+    """
+    tablas, resumen = {}, {'modo': 'completo'}
+    con_produccion = bool(col_map.get('Fecha') and col_map.get('Lote'))
+    con_calidad = not df_calidad.empty and 'Fecha_Cruce' in df_calidad.columns
+    con_features = con_produccion and bool(col_map.get('Rendimiento_Hora') and col_map.get('Dni'))
+
+    if con_produccion:
+        tablas['huellas_maestra'] = huellas_particiones(df, _claves_maestra(df, col_map))
+    if con_calidad:
+        tablas['huellas_calidad'] = huellas_particiones(df_calidad, {'Fecha': df_calidad['Fecha_Cruce']})
+
+    incremental = (anterior is not None and anterior.get('col_map') == col_map
+                   and all(anterior.get(n) is not None for n in tablas)
+                   and (not con_produccion or anterior.get('produccion_cruce') is not None)
+                   and (not con_calidad or anterior.get('cubo_defectos') is not None))
+
+    if con_produccion:
+        if incremental:
+            cambiadas_maestra = particiones_cambiadas(tablas['huellas_maestra'], anterior['huellas_maestra'])
+            resumen['particiones_maestra'] = f"{len(cambiadas_maestra)}/{len(tablas['huellas_maestra'])}"
+            cambiadas = cambiadas_maestra
+            # Solo la labor del cruce alimenta produccion_cruce
+            if 'Labor' in cambiadas.columns:
+                cambiadas = cambiadas[cambiadas['Labor'].astype(str).str.upper().str.strip() == LABOR_CRUCE.upper()]
+            fechas = cambiadas['Fecha'].dropna().unique()
+            claves = _claves_maestra(df, col_map)['Fecha']
+            recalculado = preparar_produccion_cruce_completa(df[claves.isin(fechas).to_numpy()], col_map)
+            tablas['produccion_cruce'] = _recodificar_personas(
+                empalmar(anterior['produccion_cruce'], recalculado, 'Fecha_Cruce', fechas), df, col_map)
+            resumen['fechas_produccion'] = len(fechas)
+        else:
+            tablas['produccion_cruce'] = preparar_produccion_cruce_completa(df, col_map)
+
+    if con_calidad:
+        if incremental:
+            cambiadas = particiones_cambiadas(tablas['huellas_calidad'], anterior['huellas_calidad'])
+            fechas = cambiadas['Fecha'].unique()
+            recalculado = construir_cubo_defectos(df_calidad[df_calidad['Fecha_Cruce'].isin(fechas).to_numpy()])
+            tablas['cubo_defectos'] = empalmar(anterior['cubo_defectos'], recalculado, 'Fecha_Cruce', fechas)
+            resumen['fechas_calidad'] = len(fechas)
+            resumen['particiones_calidad'] = f"{len(cambiadas)}/{len(tablas['huellas_calidad'])}"
+        else:
+            tablas['cubo_defectos'] = construir_cubo_defectos(df_calidad)
+
+    if df_clima is None or df_clima.empty:
+        df_clima = anterior.get('clima') if anterior is not None else None
+    if df_clima is not None and not df_clima.empty:
+        tablas['clima'] = df_clima[['Fecha', 'Temp_Max_Ica']].reset_index(drop=True)
+
+    if con_features:
+        # El clima es una fila por día: sus ventanas se recalculan enteras y se vuelven a unir
+        if incremental and anterior.get('features_ia') is not None:
+            features, filas = actualizar_features_ia(anterior['features_ia'], df, col_map, cambiadas_maestra)
+            tablas['features_ia'] = unir_clima_ia(features, features_clima_ia(df_clima))
+            resumen['filas_features_ia'] = f"{filas}/{len(features)}"
+        else:
+            tablas['features_ia'] = construir_features_ia(df, col_map, df_clima)
+
+    if con_produccion and col_map.get('Dni') and not df.empty:
+        tablas['historial_operarios'], tablas['resumen_operarios'] = construir_historial_operarios(df, col_map)
+
+    # Sin Semana_Cruce no hay cubo: no se publica
+    if 'cubo_defectos' in tablas and tablas['cubo_defectos'].empty:
+        del tablas['cubo_defectos']
+    if incremental:
+        resumen['modo'] = 'incremental'
+    return tablas, resumen
@@ -0,0 +1,319 @@
+"""
+Registro de métricas operativas (contadores, histogramas y medidores) en formato Prometheus.
+Siempre activo dentro del proceso de Streamlit: cubre cargas de datos, llamadas a la API de
+Google Sheets, fallback a Excel, cachés, construcción del cruce y generación de PDF.
+Se exporta por HTTP local (/metrics) y/o a un archivo de texto para el textfile collector.
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+# Configuración de exportación (variables de entorno)
+PUERTO_DEFECTO = 9464                     # METRICAS_PUERTO=0 desactiva el endpoint
+HOST_DEFECTO = "127.0.0.1"                # Solo local; exponer hacia fuera con METRICAS_HOST
+BUCKETS_DEFECTO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _formatear_valor(valor):
+    if valor == float('inf'):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas_texto(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores)) + (list(extra.items()) if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{n}="{_escapar(v)}"' for n, v in pares) + "}"
+
+class _Metrica:
+    """Base común: nombre, ayuda, nombres de etiqueta y valores por combinación de etiquetas."""
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas):
+        faltan = set(self.etiquetas) - set(etiquetas)
+        if faltan or len(etiquetas) != len(self.etiquetas):
+            raise ValueError(f"{self.nombre}: se esperaban etiquetas {self.etiquetas}, se recibió {tuple(etiquetas)}")
+        return tuple(str(etiquetas[e]) for e in self.etiquetas)
+
+    def valor(self, **etiquetas):
+        """Valor actual para una combinación de etiquetas (útil en pruebas y en el panel de debug)."""
+        with self._lock:
+            return self._valores.get(self._clave(etiquetas))
+
+    def muestras(self):
+        """Copia de {valores de etiqueta: valor} para todas las combinaciones registradas."""
+        with self._lock:
+            return {k: (dict(v) if isinstance(v, dict) else v) for k, v in self._valores.items()}
+
+    def _lineas(self):
+        raise NotImplementedError
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            lineas.extend(self._lineas())
+        return "\n".join(lineas)
+
+class Contador(_Metrica):
+    """Valor que solo aumenta (ej. llamadas a la API, fallbacks)."""
+    tipo = "counter"
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def _lineas(self):
+        return [f"{self.nombre}{_etiquetas_texto(self.etiquetas, k)} {_formatear_valor(v)}"
+                for k, v in sorted(self._valores.items())]
+
+class Medidor(_Metrica):
+    """Valor que sube y baja (ej. tamaño de un frame en caché, filas del último cruce)."""
+    tipo = "gauge"
+
+    def set(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = valor
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def _lineas(self):
+        return [f"{self.nombre}{_etiquetas_texto(self.etiquetas, k)} {_formatear_valor(v)}"
+                for k, v in sorted(self._valores.items())]
+
+class Histograma(_Metrica):
+    """Distribución de duraciones en buckets acumulados, más suma y conteo."""
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_DEFECTO):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            estado = self._valores.get(clave)
+            if estado is None:
+                estado = self._valores[clave] = {'conteos': [0] * len(self.buckets), 'suma': 0.0, 'n': 0}
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    estado['conteos'][i] += 1
+                    break
+            estado['suma'] += valor
+            estado['n'] += 1
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Observa la duración (segundos) del bloque, incluso si termina con excepción."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **etiquetas)
+
+    def valor(self, **etiquetas):
+        with self._lock:
+            estado = self._valores.get(self._clave(etiquetas))
+            return None if estado is None else {'suma': estado['suma'], 'n': estado['n']}
+
+    def _lineas(self):
+        lineas = []
+        for clave, estado in sorted(self._valores.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, estado['conteos']):
+                acumulado += conteo
+                le = {'le': _formatear_valor(limite)}
+                lineas.append(f"{self.nombre}_bucket{_etiquetas_texto(self.etiquetas, clave, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas_texto(self.etiquetas, clave)} {_formatear_valor(estado['suma'])}")
+            lineas.append(f"{self.nombre}_count{_etiquetas_texto(self.etiquetas, clave)} {estado['n']}")
+        return lineas
+
+class Registro:
+    """Conjunto de métricas del proceso; registrar dos veces el mismo nombre devuelve la existente."""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, clase, nombre, ayuda, etiquetas, **kwargs):
+        with self._lock:
+            existente = self._metricas.get(nombre)
+            if existente is not None:
+                if not isinstance(existente, clase):
+                    raise ValueError(f"La métrica {nombre} ya existe como {existente.tipo}")
+                return existente
+            metrica = self._metricas[nombre] = clase(nombre, ayuda, etiquetas, **kwargs)
+            return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador, nombre, ayuda, etiquetas)
+
+    def medidor(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Medidor, nombre, ayuda, etiquetas)
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_DEFECTO):
+        return self._registrar(Histograma, nombre, ayuda, etiquetas, buckets=buckets)
+
+    def exponer(self):
+        """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        return "\n".join(m.exponer() for m in metricas) + "\n"
+
+REGISTRO = Registro()
+
+# ==============================================================================
+# MÉTRICAS DEL DASHBOARD
+# ==============================================================================
+
+CACHE_LLAMADAS = REGISTRO.contador(
+    "pedregal_cache_llamadas_total", "Llamadas a funciones st.cache_data por resultado (hit/miss)",
+    ("funcion", "resultado"))
+CACHE_MISS_DURACION = REGISTRO.histograma(
+    "pedregal_cache_miss_duracion_segundos", "Duración del cálculo en un miss de caché (incluye refrescos de carga)",
+    ("funcion",))
+CACHE_FRAME_BYTES = REGISTRO.medidor(
+    "pedregal_cache_frame_bytes", "Memoria del último resultado guardado en caché por función",
+    ("funcion",))
+CACHE_ULTIMO_MISS = REGISTRO.medidor(
+    "pedregal_cache_ultimo_miss_timestamp_segundos", "Hora Unix del último recálculo por función",
+    ("funcion",))
+
+SHEETS_LLAMADAS = REGISTRO.contador(
+    "pedregal_sheets_api_llamadas_total", "Lecturas reales a la API de Google Sheets por resultado (ok/vacia/error/cuota/no_encontrada)",
+    ("resultado",))
+SHEETS_DURACION = REGISTRO.histograma(
+    "pedregal_sheets_api_duracion_segundos", "Duración de una lectura completa de hoja en Google Sheets")
+SHEETS_FILAS = REGISTRO.medidor(
+    "pedregal_sheets_filas", "Filas de la última lectura de cada hoja de Google Sheets",
+    ("hoja",))
+SHEETS_AUTENTICACIONES = REGISTRO.contador(
+    "pedregal_sheets_autenticaciones_total", "Creaciones del cliente gspread por resultado",
+    ("resultado",))
+
+FALLBACK_EXCEL = REGISTRO.contador(
+    "pedregal_fallback_excel_total", "Cargas que usaron el archivo Excel local en lugar de Google Sheets",
+    ("hoja",))
+CARGA_FILAS = REGISTRO.medidor(
+    "pedregal_carga_filas", "Filas de la última carga limpia por fuente",
+    ("fuente",))
+
+CRUCE_DURACION = REGISTRO.histograma(
+    "pedregal_cruce_duracion_segundos", "Duración de la construcción del cruce Producción x Calidad")
+CRUCE_FILAS = REGISTRO.medidor(
+    "pedregal_cruce_filas", "Filas del último cruce construido")
+
+PDF_DURACION = REGISTRO.histograma(
+    "pedregal_pdf_duracion_segundos", "Duración de la generación del reporte PDF")
+PDF_GENERADOS = REGISTRO.contador(
+    "pedregal_pdf_generados_total", "Reportes PDF generados por resultado (ok/error)",
+    ("resultado",))
+PDF_BYTES = REGISTRO.medidor(
+    "pedregal_pdf_bytes", "Tamaño del último reporte PDF generado")
+
+RERUN_DURACION = REGISTRO.histograma(
+    "pedregal_rerun_duracion_segundos", "Duración completa de un rerun del script")
+
+API_PETICIONES = REGISTRO.contador(
+    "pedregal_api_peticiones_total", "Peticiones a la API de consultas por recurso y estado HTTP (200/304/400/404/503)",
+    ("recurso", "estado"))
+API_DURACION = REGISTRO.histograma(
+    "pedregal_api_duracion_segundos", "Duración de una respuesta de la API de consultas (incluye el cálculo en un miss)",
+    ("recurso",))
+
+def bytes_resultado(obj):
+    """Memoria (bytes, deep) de un DataFrame/Series o de los frames dentro de una tupla."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        uso = obj.memory_usage(deep=True)
+        return int(uso.sum()) if isinstance(uso, pd.Series) else int(uso)
+    if isinstance(obj, tuple):
+        return sum(bytes_resultado(elem) for elem in obj)
+    return 0
+
+# ==============================================================================
+# EXPORTACIÓN
+# ==============================================================================
+
+_servidor = None
+_servidor_lock = threading.Lock()
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        cuerpo = REGISTRO.exponer().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+def iniciar_servidor(puerto=None, host=None):
+    """
+    Inicia (una sola vez por proceso) el endpoint HTTP /metrics en un hilo demonio.
+
+    Args:
+        puerto (int, optional): Puerto; por defecto METRICAS_PUERTO o 9464. 0 lo desactiva.
+        host (str, optional): Interfaz; por defecto METRICAS_HOST o 127.0.0.1
+
+    Returns:
+        ThreadingHTTPServer | None: Servidor activo, o None si está desactivado o el puerto está ocupado
+    """
+    global _servidor
+    if puerto is None:
+        puerto = int(os.environ.get("METRICAS_PUERTO", PUERTO_DEFECTO))
+    if host is None:
+        host = os.environ.get("METRICAS_HOST", HOST_DEFECTO)
+    if not puerto:
+        return None
+    with _servidor_lock:
+        if _servidor is None:
+            try:
+                _servidor = ThreadingHTTPServer((host, puerto), _ManejadorMetricas)
+            except OSError:
+                # Otro proceso ya expone métricas en ese puerto; la app sigue sin endpoint
+                return None
+            threading.Thread(target=_servidor.serve_forever, name="metricas-http", daemon=True).start()
+        return _servidor
+
+def escribir_archivo(ruta=None):
+    """
+    Escribe las métricas en un archivo .prom de forma atómica (para el textfile collector).
+
+    Args:
+        ruta (str, optional): Destino; por defecto METRICAS_ARCHIVO. Sin ruta no hace nada.
+
+    Returns:
+        str | None: Ruta escrita
+    """
+    ruta = ruta or os.environ.get("METRICAS_ARCHIVO")
+    if not ruta:
+        return None
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(REGISTRO.exponer())
+    os.replace(temporal, ruta)
+    return ruta
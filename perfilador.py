@@ -0,0 +1,253 @@
+"""
+Perfilador ligero por rerun para el panel "Debug Sistema".
+Mide etapas con nombre (duración y filas de entrada/salida) y registra hit/miss de cada
+función st.cache_data, para saber si un rerun lento se debe a Sheets, read_excel, la máscara,
+un groupby, Plotly, el Styler o el clima.
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+from metricas import (CACHE_LLAMADAS, CACHE_MISS_DURACION, CACHE_FRAME_BYTES, CACHE_ULTIMO_MISS,
+                      RERUN_DURACION, bytes_resultado)
+
+# Cada sesión de Streamlit ejecuta el script en su propio hilo: la traza activa es por hilo
+_estado = threading.local()
+
+COLORES_CACHE = {'hit': '#43A047', 'miss': '#E53935', None: '#1976D2'}
+
+def iniciar_traza():
+    """
+    Inicia una traza nueva para el rerun actual (llamar al inicio del script).
+
+    Returns:
+        dict: Traza vacía con marca de inicio y lista de etapas
+    """
+    traza = {
+        'inicio': datetime.now().isoformat(timespec='seconds'),
+        '_t0': time.perf_counter(),
+        'etapas': [],
+    }
+    _estado.traza = traza
+    _estado.pila = []
+    return traza
+
+def _marcas_cache():
+    """Pila (por hilo) de llamadas cacheadas en curso; True en la posición de la que fue miss."""
+    if not hasattr(_estado, 'marcas_cache'):
+        _estado.marcas_cache = []
+    return _estado.marcas_cache
+
+def traza_actual():
+    """Traza activa del hilo actual (None fuera de un rerun instrumentado)."""
+    return getattr(_estado, 'traza', None)
+
+def contar_filas(obj):
+    """
+    Filas de un resultado: len() de DataFrame/Series, suma de una máscara booleana,
+    o el primer elemento tabular de una tupla. None si no aplica.
+    """
+    if isinstance(obj, pd.Series) and obj.dtype == bool:
+        return int(obj.sum())
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, tuple):
+        for elem in obj:
+            if isinstance(elem, (pd.DataFrame, pd.Series)):
+                return len(elem)
+    return None
+
+@contextmanager
+def etapa(nombre, filas_entrada=None):
+    """
+    Mide una etapa con nombre dentro de la traza activa.
+    Fuera de un rerun instrumentado (benchmark, scripts) no registra nada.
+
+    Args:
+        nombre (str): Nombre de la etapa (ej. 'read_excel:Data_Maestra')
+        filas_entrada (int, optional): Filas que recibe la etapa
+
+    Yields:
+        dict: Registro de la etapa; el llamador puede asignar 'filas_salida'
+    """
+    traza = traza_actual()
+    registro = {'nombre': nombre, 'filas_entrada': filas_entrada, 'filas_salida': None, 'cache': None}
+    if traza is None:
+        yield registro
+        return
+
+    pila = _estado.pila
+    registro['nivel'] = len(pila)
+    inicio = time.perf_counter()
+    registro['inicio_ms'] = (inicio - traza['_t0']) * 1000
+    # Se agrega al empezar para que el orden de la cascada sea el de inicio
+    traza['etapas'].append(registro)
+    pila.append(registro)
+    try:
+        yield registro
+    except Exception as e:
+        registro['error'] = str(e)
+        raise
+    finally:
+        registro['duracion_ms'] = (time.perf_counter() - inicio) * 1000
+        pila.pop()
+
+def medir_etapa(func):
+    """
+    Decorador: registra cada llamada como etapa con el nombre de la función,
+    tomando las filas de entrada del primer argumento y las de salida del resultado.
+    """
+    @functools.wraps(func)
+    def envoltura(*args, **kwargs):
+        with etapa(func.__name__, contar_filas(args[0]) if args else None) as registro:
+            resultado = func(*args, **kwargs)
+            registro['filas_salida'] = contar_filas(resultado)
+        return resultado
+    return envoltura
+
+def cache_data_medido(**opciones):
+    """
+    Equivalente a st.cache_data(**opciones) que además registra la llamada como etapa,
+    marcada 'hit' si la respuesta vino de caché o 'miss' si se ejecutó la función,
+    y alimenta las métricas de caché (conteo hit/miss, duración y tamaño en un miss).
+
+    La clave de caché de Streamlit no cambia: functools.wraps conserva el nombre, la firma
+    y el código fuente de la función original. Se mantienen .clear() y __wrapped__.
+    """
+    return _cache_medido(st.cache_data, opciones)
+
+def cache_resource_medido(**opciones):
+    """
+    Igual que cache_data_medido pero sobre st.cache_resource: el resultado no se serializa
+    y todas las sesiones reciben el mismo objeto (ver datos_compartidos).
+    """
+    return _cache_medido(st.cache_resource, opciones)
+
+def _cache_medido(cache_st, opciones):
+    def decorador(func):
+        nombre = func.__name__
+
+        @functools.wraps(func)
+        def ejecutar(*args, **kwargs):
+            # Solo corre en un miss, dentro de la llamada abierta por 'llamar'
+            marcas = _marcas_cache()
+            if marcas:
+                marcas[-1] = True
+            inicio = time.perf_counter()
+            resultado = func(*args, **kwargs)
+            CACHE_MISS_DURACION.observe(time.perf_counter() - inicio, funcion=nombre)
+            CACHE_FRAME_BYTES.set(bytes_resultado(resultado), funcion=nombre)
+            CACHE_ULTIMO_MISS.set(time.time(), funcion=nombre)
+            return resultado
+
+        cacheada = cache_st(**opciones)(ejecutar)
+
+        @functools.wraps(func)
+        def llamar(*args, **kwargs):
+            marcas = _marcas_cache()
+            marcas.append(False)
+            try:
+                with etapa(nombre, contar_filas(args[0]) if args else None) as registro:
+                    resultado = cacheada(*args, **kwargs)
+                    registro['filas_salida'] = contar_filas(resultado)
+                    registro['cache'] = 'miss' if marcas[-1] else 'hit'
+            finally:
+                fue_miss = marcas.pop()
+            CACHE_LLAMADAS.inc(funcion=nombre, resultado='miss' if fue_miss else 'hit')
+            return resultado
+
+        llamar.clear = cacheada.clear
+        return llamar
+    return decorador
+
+def registrar_figura(nombre=None, trazas=0, puntos=0, bytes_json=0, presupuesto=None):
+    """
+    Registra el tamaño de una figura servida en el rerun (ver graficos.mostrar_figura).
+    Sin nombre se usa el de la etapa en curso (ej. 'plotly:pareto').
+    """
+    traza = traza_actual()
+    if traza is None:
+        return
+    if nombre is None:
+        nombre = _estado.pila[-1]['nombre'] if _estado.pila else 'figura'
+    traza.setdefault('figuras', []).append({
+        'figura': nombre, 'trazas': trazas, 'puntos': puntos, 'kb': round(bytes_json / 1024, 1),
+        'excede': presupuesto is not None and bytes_json > presupuesto,
+    })
+
+def finalizar_traza():
+    """
+    Cierra la traza activa con la duración total del rerun.
+
+    Returns:
+        dict: Traza finalizada (None si no hay traza activa)
+    """
+    traza = traza_actual()
+    if traza is not None:
+        traza['total_ms'] = (time.perf_counter() - traza['_t0']) * 1000
+        RERUN_DURACION.observe(traza['total_ms'] / 1000)
+    return traza
+
+def tabla_traza(traza):
+    """DataFrame con una fila por etapa, en orden de inicio."""
+    columnas = ['nombre', 'nivel', 'inicio_ms', 'duracion_ms', 'filas_entrada', 'filas_salida', 'cache']
+    df = pd.DataFrame(traza['etapas'], columns=columnas)
+    df[['filas_entrada', 'filas_salida']] = df[['filas_entrada', 'filas_salida']].astype('Int64')
+    return df.round({'inicio_ms': 1, 'duracion_ms': 1})
+
+def traza_json(traza):
+    """Traza serializada a JSON (bytes) para análisis fuera de la app."""
+    datos = {k: v for k, v in traza.items() if not k.startswith('_')}
+    return json.dumps(datos, ensure_ascii=False, indent=2, default=str).encode('utf-8')
+
+def figura_cascada(traza):
+    """
+    Cascada (Gantt horizontal) de las etapas del rerun: cada barra empieza en su inicio
+    relativo y dura lo medido; las etapas anidadas se sangran bajo su etapa padre.
+    """
+    df = tabla_traza(traza)
+    etiquetas = [f"{i:02d} {'· ' * int(n)}{nom}" for i, (n, nom) in enumerate(zip(df['nivel'], df['nombre']))]
+    colores = [COLORES_CACHE.get(c, COLORES_CACHE[None]) for c in df['cache']]
+    textos = [f"{d:.0f} ms" + (f" ({c})" if c else "") for d, c in zip(df['duracion_ms'], df['cache'])]
+
+    fig = go.Figure(go.Bar(
+        y=etiquetas, x=df['duracion_ms'], base=df['inicio_ms'], orientation='h',
+        marker_color=colores, text=textos, textposition='auto',
+        customdata=df[['filas_entrada', 'filas_salida']].astype(object).where(lambda d: d.notna(), '-'),
+        hovertemplate="%{y}<br>%{x:.1f} ms<br>Filas: %{customdata[0]} → %{customdata[1]}<extra></extra>",
+    ))
+    fig.update_yaxes(autorange='reversed')
+    fig.update_layout(template="plotly_white", height=max(250, 22 * len(df) + 60),
+                      margin=dict(l=10, r=10, t=30, b=10), xaxis_title="ms desde el inicio del rerun",
+                      title=f"Rerun: {traza.get('total_ms', 0):,.0f} ms")
+    return fig
+
+def mostrar_traza(contenedor):
+    """
+    Cierra la traza del rerun y la dibuja en el contenedor (placeholder del panel de debug):
+    cascada, tabla por etapa y descarga del JSON.
+    """
+    traza = finalizar_traza()
+    if traza is None or not traza['etapas']:
+        return
+    with contenedor.container():
+        st.write(f"**⏱️ Tiempos del rerun** ({traza['total_ms']:,.0f} ms)")
+        st.plotly_chart(figura_cascada(traza), use_container_width=True)
+        st.dataframe(tabla_traza(traza), use_container_width=True, hide_index=True)
+        if traza.get('figuras'):
+            figuras = pd.DataFrame(traza['figuras'])
+            st.write(f"**📦 Figuras servidas** ({figuras['kb'].sum():,.1f} KB en {len(figuras)} gráficos"
+                     + (f", ⚠️ {int(figuras['excede'].sum())} sobre el presupuesto" if figuras['excede'].any() else "") + ")")
+            st.dataframe(figuras, use_container_width=True, hide_index=True)
+        st.download_button("📥 Descargar traza (JSON)", traza_json(traza),
+                           f"traza_{traza['inicio'].replace(':', '')}.json", "application/json",
+                           key='descarga_traza')
@@ -0,0 +1,1498 @@
+"""
+Módulo de procesamiento de datos del dashboard (limpieza, filtros, agregaciones,
+cruce de calidad, formato de tablas y reporte PDF).
+Separado de pru.py para poder reutilizar y medir cada etapa fuera de la app.
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+from fpdf import FPDF
+import tempfile
+import os
+from datetime import datetime, date
+import unicodedata
+import re
+import zlib
+
+from perfilador import cache_data_medido, medir_etapa
+from agregacion_paralela import agrupar
+from fuentes_datos import http_get
+
+# Labor con data de calidad (base del cruce de la Tab 3)
+LABOR_CRUCE = "COSECHA Y LIMPIEZA DE RACIMOS"
+
+DIAS_MAP = {0: 'Lunes', 1: 'Martes', 2: 'Miércoles', 3: 'Jueves', 4: 'Viernes', 5: 'Sábado', 6: 'Domingo'}
+DIAS_ORDEN = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+# Columnas que no dependen de los filtros: se calculan una vez al cargar (agregar_columnas_derivadas)
+COLUMNAS_DERIVADAS = ['Eficiencia', 'Cumplimiento', 'Clasificacion_Calc', 'Pago_Dia_Calc', 'Fecha_Dia', 'Lote_Key',
+                      'Dni_Key', 'Operario_Key']
+# Códigos enteros densos de personas: rol en col_map -> columna de código
+CLAVES_PERSONA = {'Dni': 'Dni_Key', 'Operario': 'Operario_Key'}
+
+# ==============================================================================
+# LIMPIEZA DE DATA MAESTRA
+# ==============================================================================
+
+def detectar_columnas_maestra(df):
+    """
+    Mapeo inteligente de columnas de Data Maestra.
+
+    Args:
+        df (pd.DataFrame): Data Maestra tal como llega de Sheets o Excel
+
+    Returns:
+        dict: Nombre lógico -> nombre real de la columna (o None)
+    """
+    return {
+        'Fecha': next((c for c in df.columns if 'fecha' in c.lower()), None),
+        'Dni': next((c for c in df.columns if 'dni' in c.lower()), None),
+        'Rendimiento_Diario': next((c for c in df.columns if c.strip() == 'Rendimiento'), None),
+        'Rendimiento_Hora': next((c for c in df.columns if 'rend/hr real' in c.lower()), None),
+        'Horas': next((c for c in df.columns if 'horas' in c.lower() and 'totales' in c.lower()), None),
+        'Labor': next((c for c in df.columns if 'pep' in c.lower() or 'labor' in c.lower()), None),
+        'Operario': next((c for c in df.columns if 'nombre' in c.lower() or 'operario' in c.lower()), None),
+        'Lote': next((c for c in df.columns if 'lote' in c.lower()), None),
+        'Meta_Min': next((c for c in df.columns if 'min' in c.lower() and 'meta' in c.lower()), None),
+        'Meta_Max': next((c for c in df.columns if 'max' in c.lower() and 'meta' in c.lower()), None),
+        'Clasificacion': next((c for c in df.columns if 'clasifi' in c.lower()), None),
+        'Turno2': next((c for c in df.columns if 'turno' in c.lower()), None),
+        # NUEVAS COLUMNAS
+        'Salario': next((c for c in df.columns if any(x in c.lower() for x in ['salario', 'importe', 'monto', 'pago']) and 'tipo' not in c.lower()), None),
+        'Variedad': next((c for c in df.columns if 'variedad' in c.lower()), None)
+    }
+
+@medir_etapa
+def limpiar_data_maestra(df):
+    """
+    Detecta columnas y normaliza tipos de Data Maestra (modifica df en el lugar).
+
+    Args:
+        df (pd.DataFrame): Data Maestra cruda
+
+    Returns:
+        tuple: (df, col_map)
+    """
+    col_map = detectar_columnas_maestra(df)
+
+    c_fecha = col_map['Fecha']
+    if c_fecha:
+        df[c_fecha] = pd.to_datetime(df[c_fecha])
+
+    if col_map['Lote']:
+        df[col_map['Lote']] = df[col_map['Lote']].astype(str).str.split('.').str[0].str.zfill(3)
+
+    if col_map['Labor']:
+        df[col_map['Labor']] = df[col_map['Labor']].astype(str).str.strip().str.upper()
+
+    if col_map['Variedad']:
+        df[col_map['Variedad']] = df[col_map['Variedad']].astype(str).str.strip().str.upper()
+
+    # Limpieza de Salario (asegurar numérico)
+    if col_map['Salario']:
+        df[col_map['Salario']] = pd.to_numeric(df[col_map['Salario']], errors='coerce').fillna(0)
+
+    return df, col_map
+
+# ==============================================================================
+# FUNCIONES DE NORMALIZACIÓN PARA TAB 3 (CRUCE CALIDAD)
+# ==============================================================================
+
+def normalize_text_cruce(text):
+    """Elimina acentos y convierte a minúsculas para búsquedas flexibles."""
+    if not isinstance(text, str): return str(text)
+    n = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode('utf-8')
+    return n.lower()
+
+def clean_lote_cruce(val):
+    """
+    Normaliza el formato del lote: '001' -> '1', 'L35 (1)' -> '35', 'Fundo.35' -> '35'
+    Alineado con lógica de negocio original de El Pedregal.
+    """
+    if pd.isna(val) or val == "": return "Desconocido"
+    s = str(val).upper().strip()
+    if '.' in s: # Caso "Fundo.Lote"
+        parts = s.split('.')
+        if len(parts) > 1: s = parts[1].strip()
+    if '(' in s: # Caso "L40 (1)"
+        s = s.split('(')[0].strip()
+    s = s.replace('L', '') # Quitar la L
+    s = s.strip()
+    # Intentar convertir a número para quitar ceros a la izquierda (035 -> 35)
+    try:
+        match = re.search(r'(\d+)', s)
+        if match: return str(int(match.group(1)))
+    except:
+        pass
+    return s
+
+# Claves enteras de lote: el número de lote canónico (clean_lote_cruce) es la clave, así producción
+# y calidad coinciden sin tabla compartida y las claves son las mismas en todos los procesos/versiones.
+LOTE_DESCONOCIDO = "Desconocido"
+CLAVE_LOTE_DESCONOCIDO = -1
+
+def clave_lote(etiqueta):
+    """
+    Clave entera (int32) de un lote canónico: su número; -1 para 'Desconocido'; para las
+    etiquetas no numéricas, un negativo estable derivado de crc32.
+    """
+    if etiqueta.isdigit() and int(etiqueta) < 2**31:
+        return int(etiqueta)
+    if etiqueta == LOTE_DESCONOCIDO:
+        return CLAVE_LOTE_DESCONOCIDO
+    return -2 - (zlib.crc32(etiqueta.encode('utf-8')) & 0x3FFFFFFF)
+
+def codificar_lotes(lotes):
+    """
+    Lleva cada escritura cruda de lote a su etiqueta canónica y clave entera, evaluando
+    clean_lote_cruce una sola vez por valor distinto (no por fila).
+
+    Returns:
+        tuple: (claves np.ndarray int32, etiquetas np.ndarray de texto), alineadas con lotes
+    """
+    codigos, unicos = pd.factorize(lotes)
+    # El código -1 (nulos) toma el último elemento: 'Desconocido'
+    etiquetas = np.array([clean_lote_cruce(v) for v in unicos] + [LOTE_DESCONOCIDO], dtype=object)
+    claves = np.array([clave_lote(e) for e in etiquetas], dtype=np.int32)
+    return claves[codigos], etiquetas[codigos]
+
+def claves_de_etiquetas(etiquetas):
+    """Claves enteras a partir de etiquetas ya canónicas (ej. Lote_Cruce de una versión publicada)."""
+    codigos, unicos = pd.factorize(etiquetas)
+    claves = np.array([clave_lote(str(e)) for e in unicos] + [CLAVE_LOTE_DESCONOCIDO], dtype=np.int32)
+    return claves[codigos]
+
+def dimension_lotes(df, col_map, df_calidad=None):
+    """
+    Dimensión de lotes: una fila por clave (Lote_Key) con la etiqueta canónica del cruce
+    (Lote_Cruce), la escritura de producción (Lote) y en qué hoja aparece. Sirve para ver
+    qué lotes no pueden cruzar (solo en producción o solo en calidad).
+    """
+    c_lote = col_map.get('Lote')
+    prod = pd.DataFrame({'Lote_Key': pd.Series(dtype=np.int32), 'Lote': pd.Series(dtype=object)})
+    if c_lote and 'Lote_Key' in df.columns:
+        prod = pd.DataFrame({'Lote_Key': df['Lote_Key'], 'Lote': df[c_lote]}).drop_duplicates('Lote_Key')
+    prod['Lote_Cruce'] = codificar_lotes(prod['Lote'])[1]
+
+    qual = pd.DataFrame({'Lote_Key': pd.Series(dtype=np.int32), 'Lote_Cruce': pd.Series(dtype=object)})
+    if df_calidad is not None and 'Lote_Key' in df_calidad.columns:
+        qual = df_calidad[['Lote_Key', 'Lote_Cruce']].drop_duplicates('Lote_Key')
+
+    dim = pd.merge(prod, qual, on='Lote_Key', how='outer', suffixes=('', '_calidad'), indicator=True)
+    dim['Lote_Cruce'] = dim['Lote_Cruce'].fillna(dim['Lote_Cruce_calidad'])
+    dim['Lote'] = dim['Lote'].fillna(dim['Lote_Cruce'])
+    dim['En_Produccion'] = dim['_merge'] != 'right_only'
+    dim['En_Calidad'] = dim['_merge'] != 'left_only'
+    return dim.set_index('Lote_Key').sort_index()[['Lote_Cruce', 'Lote', 'En_Produccion', 'En_Calidad']]
+
+def codificar_personas(valores):
+    """
+    Códigos enteros densos (0..n-1) de DNI, operarios o asistentes, asignados en el orden
+    alfabético de los valores: agrupar por el código da el mismo orden que agrupar por el
+    texto. Los nulos quedan como <NA> (nunique los ignora igual que antes).
+
+    Returns:
+        pd.arrays.IntegerArray: Códigos Int32 alineados con valores
+    """
+    codigos, _ = pd.factorize(valores, sort=True)
+    return pd.arrays.IntegerArray(codigos.astype(np.int32), codigos < 0)
+
+def clave_persona(df, col_map, rol):
+    """Columna por la que contar/agrupar un rol ('Dni', 'Operario'): su código si existe, si no el texto."""
+    clave = CLAVES_PERSONA.get(rol)
+    return clave if clave in df.columns else col_map.get(rol)
+
+def dimension_personas(df, col_map, df_calidad=None):
+    """
+    Búsqueda inversa código -> valor de cada rol codificado (Dni, Operario, Asistente).
+
+    Returns:
+        dict: {rol: pd.Series indexada por código}
+    """
+    pares = [(df, col_map.get(rol), clave) for rol, clave in CLAVES_PERSONA.items()]
+    if df_calidad is not None:
+        pares.append((df_calidad, 'Asistente_Cruce', 'Asistente_Key'))
+    roles = list(CLAVES_PERSONA) + ['Asistente']
+    dimension = {}
+    for rol, (origen, columna, clave) in zip(roles, pares):
+        if columna and columna in origen.columns and clave in origen.columns:
+            unicos = origen[[clave, columna]].dropna().drop_duplicates(clave)
+            dimension[rol] = unicos.set_index(clave)[columna].sort_index()
+    return dimension
+
+def codigo_a_variedad(val):
+    """Convierte código de variedad a nombre completo (inverso del original)."""
+    mapa_inverso = {
+        'TM': 'TIMPSON', 'AL': 'ALLISON', 'CC': 'COTTON CANDY',
+        'SS': 'SABLE SEEDLESS', 'CH': 'CANDY HEARTS', 'RG': 'RED GLOBE',
+        'S54': 'SUGRA54', 'SG': 'SWEET GLOBE', 'IV': 'IVORY', 'AC': 'AUTUMN CRISP'
+    }
+    val_upper = str(val).upper().strip()
+    return mapa_inverso.get(val_upper, val)
+
+def find_col_cruce(df, candidates):
+    """Busca una columna en el DataFrame coincidiendo con una lista de candidatos."""
+    df_cols_norm = {normalize_text_cruce(c): c for c in df.columns}
+    for cand in candidates:
+        cand_norm = normalize_text_cruce(cand)
+        if cand_norm in df_cols_norm:
+            return df_cols_norm[cand_norm]
+    return None
+
+def format_with_icon(val, is_efficiency=False, is_quality=False):
+    """Formatea el valor numérico con iconos de alerta/éxito."""
+    if pd.isna(val): return "-"
+    icon = ""
+    if is_efficiency:
+        icon = "✅" if val >= 1.0 else "🚩"
+    elif is_quality:
+        icon = "✅" if val >= 0.95 else "🚩"
+    return f"{icon} {val:.1%}"
+
+@medir_etapa
+def limpiar_calidad(df_qual):
+    """
+    Procesamiento y normalización de la hoja de Calidad (aplica a Sheets y Local).
+    Agrega las columnas *_Cruce que usa el módulo de cruce.
+
+    Args:
+        df_qual (pd.DataFrame): Calidad cruda (con nombres de columna ya sin espacios)
+
+    Returns:
+        tuple: (df_qual, debug_msg)
+    """
+    debug_msg = []
+    if df_qual.empty:
+        return df_qual, debug_msg
+
+    try:
+        # Mapeo de columnas con candidatos flexibles y específicos (vistos en procesamiento_calidad.py y cruce.py)
+        c_fecha = find_col_cruce(df_qual, ['Fecha', 'Date', 'FECHA'])
+        c_lote = find_col_cruce(df_qual, ['Lote - Cuartel', 'LoteSer', 'Lote_Clean', 'Lote', 'Ubicacion'])
+        c_asist = find_col_cruce(df_qual, ['Asistente: Nombres Abreviatura', 'Asistente_C', 'Asistente_Clean', 'Asistente', 'Nombre'])
+        c_semana = find_col_cruce(df_qual, ['Semana', 'EtiquetaSemana', 'Semana_Cruce', 'SEMANA'])
+        c_desv = find_col_cruce(df_qual, ['Desviacion_Total_Grupo', 'Desv_Tot', 'Desviacion_Total', 'Desviacion'])
+        c_tasa = find_col_cruce(df_qual, ['%Calidad', 'Tasa_Valor', '% Calidad', 'Tasa Valor'])
+        c_variedad = find_col_cruce(df_qual, ['Variedad', 'Variedad_Cod', 'Variedad_Unified'])
+        c_defecto = find_col_cruce(df_qual, ['Tipo_Defecto', 'Tipo_Defe', 'Categoria Defecto', 'Defecto', 'Tipo Defecto'])
+        c_jabas = find_col_cruce(df_qual, ['Cantidad_J', 'Cantidad_Jabas', 'Conteo_Jabas', 'Jabas'])
+
+        # UNIFORMIZACIÓN DE FECHAS
+        if c_fecha:
+            # Intentar varios formatos, priorizando el que use '-' o '/'
+            df_qual['Fecha_Cruce'] = pd.to_datetime(df_qual[c_fecha], errors='coerce')
+            # Normalizar a solo fecha (medianoche)
+            df_qual['Fecha_Cruce'] = df_qual['Fecha_Cruce'].dt.normalize()
+
+        # SEMANA: Priorizar columna del sheet, si no existe calcular
+        if c_semana:
+            # Limpiar si viene como "Semana 40" -> 40
+            def clean_sem(val):
+                if pd.isna(val): return None
+                s = str(val).lower()
+                match = re.search(r'(\d+)', s)
+                return int(match.group(1)) if match else None
+            df_qual['Semana_Cruce'] = df_qual[c_semana].apply(clean_sem)
+
+        # Semana DEBE venir del sheet de calidad, no se calcula
+        # if 'Semana_Cruce' not in df_qual.columns or df_qual['Semana_Cruce'].isnull().all():
+        #     if 'Fecha_Cruce' in df_qual.columns:
+        #         df_qual['Semana_Cruce'] = df_qual['Fecha_Cruce'].dt.isocalendar().week
+
+        # Lotes limpios (etiqueta canónica) y su clave entera, la misma que en producción
+        if c_lote:
+            df_qual['Lote_Key'], df_qual['Lote_Cruce'] = codificar_lotes(df_qual[c_lote])
+        else:
+            df_qual['Lote_Cruce'] = LOTE_DESCONOCIDO
+            df_qual['Lote_Key'] = np.int32(CLAVE_LOTE_DESCONOCIDO)
+
+        # Asistente
+        df_qual['Asistente_Cruce'] = df_qual[c_asist].astype(str).str.strip() if c_asist else "Sin Asignar"
+        df_qual['Asistente_Key'] = codificar_personas(df_qual['Asistente_Cruce'])
+
+        # Desviación / Calidad
+        if c_desv:
+            df_qual['Desv_Cruce'] = pd.to_numeric(df_qual[c_desv], errors='coerce').fillna(0)
+        elif c_tasa:
+            v_tasa = pd.to_numeric(df_qual[c_tasa], errors='coerce').fillna(0)
+            # Si es %Calidad (ej 0.98), desv = 1 - 0.98
+            if v_tasa.mean() > 0.5: df_qual['Desv_Cruce'] = 1.0 - v_tasa
+            else: df_qual['Desv_Cruce'] = v_tasa
+        else:
+            df_qual['Desv_Cruce'] = 0
+
+        # Variedad y Defecto
+        df_qual['Variedad_Cruce'] = df_qual[c_variedad].apply(codigo_a_variedad) if c_variedad else "ND"
+        df_qual['Defecto_Cruce'] = df_qual[c_defecto] if c_defecto else "Sin Detalle"
+
+        # Jabas
+        df_qual['Jabas_Cruce'] = pd.to_numeric(df_qual[c_jabas], errors='coerce').fillna(0).astype(int) if c_jabas else 0
+
+    except Exception as e:
+        debug_msg.append(f"Error procesando Calidad: {e}")
+
+    return df_qual, debug_msg
+
+# ==============================================================================
+# FILTROS GLOBALES Y COLUMNAS CALCULADAS
+# ==============================================================================
+
+@medir_etapa
+def construir_mascara(df, col_map, date_range, sel_labor, sel_variedad):
+    """
+    Construye la máscara de los filtros globales del sidebar (periodo, labor, variedad).
+
+    Returns:
+        pd.Series: Máscara booleana alineada con df
+    """
+    c_fecha = col_map.get('Fecha')
+    c_labor = col_map.get('Labor')
+    c_variedad = col_map.get('Variedad')
+
+    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+        mask = (df[c_fecha].dt.date >= date_range[0]) & (df[c_fecha].dt.date <= date_range[1])
+    elif isinstance(date_range, list) and len(date_range) == 1:
+        mask = (df[c_fecha].dt.date == date_range[0])
+    else:
+        # Fallback: todos los datos
+        mask = pd.Series([True] * len(df), index=df.index)
+
+    # Aplicar filtros adicionales de forma segura
+    if sel_labor != '(TODAS)' and c_labor and c_labor in df.columns:
+        mask = mask & (df[c_labor] == sel_labor)
+
+    if sel_variedad != '(TODAS)' and c_variedad and c_variedad in df.columns:
+        mask = mask & (df[c_variedad].astype(str) == sel_variedad)
+
+    return mask
+
+def columnas_proyeccion(df, col_map):
+    """Columnas de df que usa el pipeline por rerun (col_map + derivadas), en el orden de df."""
+    usadas = {c for c in col_map.values() if c} | set(COLUMNAS_DERIVADAS)
+    return [c for c in df.columns if c in usadas]
+
+@medir_etapa
+def proyectar_filtrado(df, col_map, mask):
+    """
+    Filas de la máscara con solo las columnas del col_map, en una única copia (un solo take).
+    Es la proyección que comparten las tres pestañas: con copy-on-write (activo en pru.py),
+    las columnas que se agreguen después no tocan el dataset compartido ni las otras vistas.
+    """
+    filas = np.flatnonzero(np.asarray(mask, dtype=bool))
+    return df.iloc[filas, df.columns.get_indexer(columnas_proyeccion(df, col_map))]
+
+@medir_etapa
+def agregar_columnas_derivadas(df, col_map):
+    """
+    Columnas que no dependen de los filtros del sidebar, calculadas una vez por versión de
+    datos sobre el dataset completo (en el lugar): Eficiencia, Cumplimiento, Clasificacion_Calc,
+    Pago_Dia_Calc, Fecha_Dia (clave de la dimensión de fechas), Lote_Key (clave entera del lote,
+    compartida con calidad) y Dni_Key/Operario_Key (códigos de persona). Las que ya existan no
+    se recalculan, así que se puede llamar sobre una versión publicada.
+    """
+    if df.empty:
+        return df
+
+    c_r = col_map.get('Rendimiento_Hora'); c_m = col_map.get('Meta_Min')
+    if 'Eficiencia' not in df.columns and c_r and c_m and c_r in df.columns and c_m in df.columns:
+        rend_vals = pd.to_numeric(df[c_r], errors='coerce').fillna(0)
+        meta_vals = pd.to_numeric(df[c_m], errors='coerce').fillna(0)
+        df['Eficiencia'] = (rend_vals / meta_vals.replace(0, np.nan)).fillna(0)
+        if 'Cumplimiento' not in df.columns:
+            df['Cumplimiento'] = df['Eficiencia'] * 100
+
+    c_fecha = col_map.get('Fecha')
+    if 'Fecha_Dia' not in df.columns and c_fecha and c_fecha in df.columns:
+        df['Fecha_Dia'] = df[c_fecha].dt.normalize()
+
+    c_lote = col_map.get('Lote')
+    if 'Lote_Key' not in df.columns and c_lote and c_lote in df.columns:
+        df['Lote_Key'] = codificar_lotes(df[c_lote])[0]
+
+    for rol, clave in CLAVES_PERSONA.items():
+        columna = col_map.get(rol)
+        if clave not in df.columns and columna and columna in df.columns:
+            df[clave] = codificar_personas(df[columna])
+
+    return agregar_columnas_calculadas(df, col_map)
+
+@medir_etapa
+def agregar_columnas_calculadas(df_f, col_map):
+    """
+    Agrega Cumplimiento, Clasificacion_Calc y Pago_Dia_Calc (en el lugar), salvo las que
+    ya vengan precalculadas desde la carga (agregar_columnas_derivadas).
+    """
+    if df_f.empty:
+        return df_f
+
+    # Calcular Cumplimiento (Solución Robusta)
+    if 'Cumplimiento' not in df_f.columns:
+        # Validar que las columnas necesarias existan
+        c_r = col_map.get('Rendimiento_Hora')
+        c_m = col_map.get('Meta_Min')
+
+        if c_r and c_m and c_r in df_f.columns and c_m in df_f.columns:
+            rend_vals = pd.to_numeric(df_f[c_r], errors='coerce').fillna(0)
+            meta_vals = pd.to_numeric(df_f[c_m], errors='coerce').fillna(0)
+            df_f['Cumplimiento'] = (rend_vals / meta_vals.replace(0, np.nan)) * 100
+            df_f['Cumplimiento'] = df_f['Cumplimiento'].fillna(0)
+        else:
+            df_f['Cumplimiento'] = 0.0
+
+    if 'Clasificacion_Calc' not in df_f.columns:
+        conditions = [(df_f['Cumplimiento'] >= 100), (df_f['Cumplimiento'] >= 85), (df_f['Cumplimiento'] < 85)]
+        df_f['Clasificacion_Calc'] = np.select(conditions, ['AR', 'MR', 'BR'], default='BR')
+
+    # LÓGICA FINANCIERA (DIRECTA)
+    # Si no hay columna Salario detectada, usar 62 por defecto
+    if 'Pago_Dia_Calc' not in df_f.columns:
+        c_salario = col_map.get('Salario')
+        if c_salario:
+            df_f['Pago_Dia_Calc'] = df_f[c_salario]
+        else:
+            df_f['Pago_Dia_Calc'] = 62.0 # Fallback Jornal Base
+
+    return df_f
+
+def dimension_fechas(fechas):
+    """
+    Dimensión de fechas compacta: una fila por día distinto (índice Fecha_Dia) con día de la
+    semana (número, nombre en español e inglés), semana y año ISO, día del año y mes.
+    Las agregaciones por día agrupan por la clave y toman los atributos de aquí.
+    """
+    dias = pd.DatetimeIndex(pd.unique(pd.Series(fechas).dropna().dt.normalize()), name='Fecha_Dia').sort_values()
+    iso = dias.isocalendar()
+    return pd.DataFrame({
+        'Dia_Num': dias.dayofweek,
+        'Dia_Nom': dias.dayofweek.map(DIAS_MAP),
+        'Dia_Semana': dias.day_name(),
+        'Semana_ISO': iso['week'].to_numpy(),
+        'Anio_ISO': iso['year'].to_numpy(),
+        'Dia_Anio': dias.dayofyear,
+        'Mes': dias.month,
+    }, index=dias)
+
+# ==============================================================================
+# AGREGACIONES TAB 1 (PRODUCTIVO) Y TAB 2 (FINANCIERO)
+# ==============================================================================
+
+def columnas_agregacion_tab1(df_f, col_map):
+    """
+    Construye agg_cols de forma segura (solo si las columnas existen), como agregaciones con
+    nombre {columna_salida: (columna_origen, función)}: los operarios únicos se cuentan sobre
+    el código entero Dni_Key cuando está.
+    """
+    agg_cols = {}
+    c_rend_hr = col_map.get('Rendimiento_Hora'); c_dni = col_map.get('Dni')
+    c_rend_dia = col_map.get('Rendimiento_Diario')
+    c_meta_min = col_map.get('Meta_Min'); c_meta_max = col_map.get('Meta_Max')
+    if c_rend_hr and c_rend_hr in df_f.columns: agg_cols[c_rend_hr] = (c_rend_hr, 'mean')
+    if c_dni and c_dni in df_f.columns: agg_cols[c_dni] = (clave_persona(df_f, col_map, 'Dni'), 'nunique')
+    if c_rend_dia and c_rend_dia in df_f.columns: agg_cols[c_rend_dia] = (c_rend_dia, 'sum')
+    if c_meta_min and c_meta_min in df_f.columns: agg_cols[c_meta_min] = (c_meta_min, 'mean')
+    if c_meta_max and c_meta_max in df_f.columns: agg_cols[c_meta_max] = (c_meta_max, 'mean')
+    return agg_cols
+
+def asegurar_numericas(df_f, cols):
+    """
+    Asegura que las columnas a agregar sean numéricas (en el lugar).
+    Esto previene TypeError cuando hay valores no numéricos mezclados.
+    Las que ya son numéricas no se reescriben (evita copiar bloques compartidos).
+    """
+    for col in cols:
+        if col in df_f.columns and not pd.api.types.is_numeric_dtype(df_f[col]):
+            df_f[col] = pd.to_numeric(df_f[col], errors='coerce')
+    return df_f
+
+@medir_etapa
+def calcular_tendencia_diaria(df_f, c_fecha, agg_cols):
+    """Serie diaria del gráfico principal de la Tab 1 (sin clima)."""
+    return agrupar(df_f, c_fecha, agg_cols).reset_index().sort_values(c_fecha)
+
+def _agregar_por_lote(df, c_lote, **agregados):
+    """
+    groupby(c_lote).agg(**agregados).reset_index() agrupando por un código entero del lote
+    de producción (pd.factorize ordenado: mismo orden de salida que agrupar por texto) y con
+    la etiqueta tomada del grupo. No usa Lote_Key: esa clave es el lote canónico del cruce
+    de calidad y junta escrituras distintas ('12A', '012', 'L12') en un mismo lote. Con
+    muchas filas se reparte por tramos de lotes (agregacion_paralela).
+    """
+    codigos, _ = pd.factorize(df[c_lote], sort=True)
+    # Como groupby, los lotes nulos (código -1) no forman grupo
+    base = df.assign(Lote_Codigo=codigos)[codigos >= 0]
+    res = agrupar(base, 'Lote_Codigo', {c_lote: (c_lote, 'first'), **agregados})
+    return res.reset_index(drop=True)
+
+@medir_etapa
+def calcular_resumen_lotes(df_f, c_lote, c_rend_dia, c_dni):
+    """Producción, dotación y cumplimiento medio por lote."""
+    return _agregar_por_lote(df_f, c_lote, Produccion_Total=(c_rend_dia, 'sum'), Operarios_Unicos=('Dni_Key' if 'Dni_Key' in df_f.columns else c_dni, 'nunique'), Cumplimiento_Meta=('Cumplimiento', 'mean'))
+
+@medir_etapa
+def calcular_pareto(df_lotes):
+    """Pareto de producción por lote con porcentaje acumulado."""
+    df_pareto = df_lotes.sort_values('Produccion_Total', ascending=False)
+    df_pareto['Acum'] = df_pareto['Produccion_Total'].cumsum()
+    df_pareto['Porcentaje_Acum'] = 100 * df_pareto['Acum'] / df_pareto['Produccion_Total'].sum()
+    return df_pareto
+
+@medir_etapa
+def calcular_evolucion_clasificacion(df_f, c_fecha):
+    """Porcentaje diario de personal AR/MR/BR."""
+    df_ev = df_f.groupby([c_fecha, 'Clasificacion_Calc']).size().reset_index(name='Conteo')
+    df_totals = df_f.groupby(c_fecha).size().reset_index(name='Total')
+    df_ev = pd.merge(df_ev, df_totals, on=c_fecha)
+    df_ev['Pct'] = (df_ev['Conteo'] / df_ev['Total']) * 100
+    return df_ev
+
+@medir_etapa
+def calcular_patron_semanal(df_f, c_fecha):
+    """
+    Patrón AR/MR/BR por día de la semana: cuenta por día (clave Fecha_Dia precalculada) y
+    solo después lleva esos pocos grupos a su nombre de día con la dimensión de fechas.
+    """
+    dias = df_f['Fecha_Dia'] if 'Fecha_Dia' in df_f.columns else df_f[c_fecha].dt.normalize().rename('Fecha_Dia')
+    por_dia = df_f.groupby([dias, df_f['Clasificacion_Calc']]).size().reset_index(name='Cant')
+    por_dia['Dia_Nom'] = por_dia['Fecha_Dia'].map(dimension_fechas(por_dia['Fecha_Dia'])['Dia_Nom'])
+    df_patron = por_dia.groupby(['Dia_Nom', 'Clasificacion_Calc'])['Cant'].sum().reset_index()
+    df_patron_total = df_patron.groupby('Dia_Nom')['Cant'].sum().reset_index(name='Total')
+    df_patron = pd.merge(df_patron, df_patron_total, on='Dia_Nom')
+    df_patron['Pct'] = (df_patron['Cant'] / df_patron['Total']) * 100
+    return df_patron
+
+@medir_etapa
+def calcular_financiero_lotes(df_fin, c_lote, c_rend_dia, c_dni):
+    """Gasto, producción, dotación y costo unitario por lote (Tab 2)."""
+    df_fin_lote = _agregar_por_lote(df_fin, c_lote, **{
+        'Pago_Dia_Calc': ('Pago_Dia_Calc', 'sum'),
+        c_rend_dia: (c_rend_dia, 'sum'),
+        c_dni: ('Dni_Key' if 'Dni_Key' in df_fin.columns else c_dni, 'nunique')
+    })
+    df_fin_lote['Costo_Unitario'] = df_fin_lote['Pago_Dia_Calc'] / df_fin_lote[c_rend_dia]
+    return df_fin_lote
+
+@medir_etapa
+def calcular_costo_clasificacion(df_fin_costo):
+    """Pago promedio diario por clasificación AR/MR/BR."""
+    return df_fin_costo.groupby('Clasificacion_Calc')['Pago_Dia_Calc'].mean().reset_index()
+
+@medir_etapa
+def calcular_tendencia_financiera(df_fin, c_fecha, c_rend_dia):
+    """Gasto y producción diarios (Tab 2)."""
+    return agrupar(df_fin, c_fecha, {
+        'Pago_Dia_Calc': ('Pago_Dia_Calc', 'sum'),
+        c_rend_dia: (c_rend_dia, 'sum')
+    }).reset_index().sort_values(c_fecha)
+
+# ==============================================================================
+# FUNCIONES CACHEADAS PARA TAB3 (OPTIMIZACIÓN DE RENDIMIENTO)
+# ==============================================================================
+
+def mascara_periodo_variedad(df, col_map, date_range, sel_variedad):
+    """Máscara de periodo + variedad del sidebar usada por el cruce (sin filtro de labor)."""
+    c_fecha = col_map.get('Fecha'); c_variedad = col_map.get('Variedad')
+
+    # Validación de rango de fechas (evita IndexError si el usuario solo selecciona una fecha)
+    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+        mask_prod_cruce = (df[c_fecha].dt.date >= date_range[0]) & (df[c_fecha].dt.date <= date_range[1])
+    else:
+        mask_prod_cruce = (df[c_fecha].dt.date >= date_range[0])
+
+    if sel_variedad != '(TODAS)' and c_variedad:
+        mask_prod_cruce = mask_prod_cruce & (df[c_variedad].astype(str) == sel_variedad)
+
+    return mask_prod_cruce
+
+def _filas_produccion_cruce(df, col_map, date_range, sel_variedad, labor_exacta, con_labor=True):
+    """Posiciones de periodo + variedad (y labor exacta si con_labor), total sin labor y labores vistas."""
+    c_labor = col_map.get('Labor')
+    filas = np.flatnonzero(mascara_periodo_variedad(df, col_map, date_range, sel_variedad).to_numpy())
+    total_sin_labor = len(filas)
+    labores_disponibles = []
+
+    if c_labor and c_labor in df.columns:
+        labores = df[c_labor].iloc[filas]
+        labores_disponibles = labores.dropna().unique()
+        if con_labor:
+            # Match exacto (case-insensitive)
+            filas = filas[(labores.str.upper().str.strip() == labor_exacta.upper()).to_numpy()]
+
+    return filas, total_sin_labor, labores_disponibles
+
+@medir_etapa
+def resumir_produccion_cruce(df, col_map, date_range, sel_variedad):
+    """
+    Totales del debug de la Tab 3 sin materializar el filtrado.
+
+    Returns:
+        tuple: (total_sin_labor, labores_disponibles)
+    """
+    _, total_sin_labor, labores_disponibles = _filas_produccion_cruce(
+        df, col_map, date_range, sel_variedad, LABOR_CRUCE, con_labor=False)
+    return total_sin_labor, labores_disponibles
+
+@medir_etapa
+def filtrar_produccion_cruce(df, col_map, date_range, sel_variedad, labor_exacta=LABOR_CRUCE):
+    """
+    Filtra la producción base del cruce: periodo + variedad, ignorando el filtro de labor
+    del sidebar y quedándose solo con la labor exacta de cosecha.
+
+    Returns:
+        tuple: (df_f_cruce, total_sin_labor, labores_disponibles)
+    """
+    filas, total_sin_labor, labores_disponibles = _filas_produccion_cruce(
+        df, col_map, date_range, sel_variedad, labor_exacta)
+
+    # Una sola copia: filas del cruce y columnas del col_map
+    df_f_cruce = df.iloc[filas, df.columns.get_indexer(columnas_proyeccion(df, col_map))]
+
+    # Asegurar numérico
+    for col in [col_map.get('Rendimiento_Hora'), col_map.get('Meta_Min')]:
+        if col and col in df_f_cruce.columns:
+            df_f_cruce[col] = pd.to_numeric(df_f_cruce[col], errors='coerce').fillna(0)
+
+    return df_f_cruce, total_sin_labor, labores_disponibles
+
+@medir_etapa
+def preparar_produccion_cruce(df_f, c_fecha, c_lote, c_rend_hr, c_meta_min, c_semana=None):
+    """
+    Prepara el DataFrame de producción para cruce (Fecha_Cruce, Lote_Cruce, Eficiencia).
+    Las columnas nuevas van en una copia superficial: df_f no se modifica.
+    """
+    df_prod = df_f.copy(deep=False)
+
+    # Normalización de Fecha
+    df_prod['Fecha_Cruce'] = pd.to_datetime(df_prod[c_fecha], errors='coerce').dt.normalize()
+
+    # Semana: usar SOLO si existe en los datos, no calcular como fallback
+    if c_semana and c_semana in df_prod.columns:
+        df_prod['Semana_Cruce'] = pd.to_numeric(df_prod[c_semana], errors='coerce')
+    else:
+        df_prod['Semana_Cruce'] = None  # No calcular, dejar vacío si no existe
+
+    # Lote: etiqueta canónica y clave entera (una evaluación por lote distinto)
+    claves, df_prod['Lote_Cruce'] = codificar_lotes(df_prod[c_lote])
+    if 'Lote_Key' not in df_prod.columns:
+        df_prod['Lote_Key'] = claves
+
+    # Eficiencia: normalmente ya viene de la carga (agregar_columnas_derivadas)
+    if 'Eficiencia' not in df_prod.columns:
+        # Asegurar numérico y evitar división por cero
+        if c_rend_hr and c_meta_min:
+            rend_vals = pd.to_numeric(df_prod[c_rend_hr], errors='coerce').fillna(0)
+            meta_vals = pd.to_numeric(df_prod[c_meta_min], errors='coerce').fillna(0)
+            df_prod['Eficiencia'] = rend_vals / meta_vals.replace(0, np.nan)
+            df_prod['Eficiencia'] = df_prod['Eficiencia'].fillna(0)
+        else:
+            df_prod['Eficiencia'] = 0
+
+    return df_prod
+
+@medir_etapa
+def preparar_produccion_cruce_completa(df, col_map, labor_exacta=LABOR_CRUCE):
+    """
+    Producción del cruce para toda la temporada (sin periodo ni variedad): labor de cosecha,
+    métricas numéricas, Fecha_Cruce, Lote_Cruce y Eficiencia. Es fila a fila, así que
+    recortarla después por periodo/variedad da lo mismo que filtrar y luego preparar.
+    pru.py la mantiene una vez por proceso (o la toma del almacén Arrow, donde la publica
+    refrescador.py) y en cada rerun solo la recorta.
+    """
+    df_cosecha, _, _ = filtrar_produccion_cruce(df, col_map, [date.min, date.max], '(TODAS)', labor_exacta)
+    return preparar_produccion_cruce(df_cosecha, col_map.get('Fecha'), col_map.get('Lote'), col_map.get('Rendimiento_Hora'), col_map.get('Meta_Min'))
+
+@medir_etapa
+def recortar_produccion_cruce(df_prod_completa, col_map, date_range, sel_variedad):
+    """Recorta la producción del cruce pre-agregada al periodo y variedad del sidebar."""
+    return df_prod_completa[mascara_periodo_variedad(df_prod_completa, col_map, date_range, sel_variedad)]
+
+def _agregar_produccion_cruce(df_prod):
+    """Eficiencia media por Lote + Fecha (clave entera del lote)."""
+    return df_prod.groupby(['Lote_Key', 'Fecha_Cruce']).agg({'Eficiencia': 'mean'}).reset_index()
+
+def _agregar_calidad_cruce(df_qual, claves_extra=()):
+    """
+    Calidad por Asistente + Lote + Fecha (códigos enteros), con las etiquetas viajando con el
+    grupo; claves_extra antepone otras claves de agrupación (ej. Semana_Cruce).
+    """
+    claves = list(claves_extra)
+    qual_agg = df_qual.groupby(claves + ['Asistente_Key', 'Lote_Key', 'Fecha_Cruce']).agg({
+        'Asistente_Cruce': 'first', 'Lote_Cruce': 'first', 'Desv_Cruce': 'mean', 'Variedad_Cruce': 'first', 'Jabas_Cruce': 'sum'
+    }).reset_index()
+    # Mismo orden de filas y columnas que al agrupar por las etiquetas de texto
+    qual_agg = qual_agg.sort_values(claves + ['Asistente_Cruce', 'Lote_Cruce', 'Fecha_Cruce'], kind='stable', ignore_index=True)
+    qual_agg = qual_agg[claves + ['Asistente_Cruce', 'Lote_Cruce', 'Fecha_Cruce', 'Desv_Cruce', 'Variedad_Cruce', 'Jabas_Cruce',
+                                  'Lote_Key', 'Asistente_Key']]
+    return qual_agg.rename(columns={
+        'Asistente_Cruce': 'Asistente',
+        'Desv_Cruce': 'Desviacion_Total',
+        'Variedad_Cruce': 'Variedad',
+        'Jabas_Cruce': 'Jabas'
+    })
+
+def _cruzar_calidad_produccion(qual_agg, prod_agg):
+    """
+    Merge por Lote + Fecha (único cruce válido) sobre la clave entera, con Calidad_Calc. Las
+    claves enteras no salen del cruce: las tablas del Tab 3 y el Excel muestran sus columnas.
+    """
+    merged = pd.merge(qual_agg, prod_agg, on=['Lote_Key', 'Fecha_Cruce'], how='inner').drop(
+        columns=['Lote_Key', 'Asistente_Key'])
+    if not merged.empty:
+        merged['Calidad_Calc'] = 1.0 - merged['Desviacion_Total'].fillna(0)
+    return merged
+
+def aplicar_score(merged, ratio_calidad):
+    """Agrega Score (ponderación del slider) y Calidad_Tabla a un cruce ya calculado."""
+    if merged.empty:
+        return merged
+    merged = merged.copy(deep=False)
+    merged['Score'] = (merged['Calidad_Calc'] * ratio_calidad) + (merged['Eficiencia'] * (1 - ratio_calidad))
+    merged['Calidad_Tabla'] = merged['Calidad_Calc']
+    return merged
+
+@medir_etapa
+def calcular_merged_data(_df_prod_cruce, _df_calidad, semana_etiqueta, ratio_calidad):
+    """Calcula el merge entre producción y calidad usando FECHAS, no semanas calculadas."""
+    # 1. Filtrar calidad por la etiqueta de semana seleccionada
+    df_q_sem = _df_calidad[_df_calidad['Semana_Cruce'] == semana_etiqueta]
+
+    if df_q_sem.empty:
+        return pd.DataFrame(), pd.DataFrame(), df_q_sem
+
+    # 2. Obtener las FECHAS que pertenecen a esta semana (desde calidad)
+    fechas_semana = df_q_sem['Fecha_Cruce'].dropna().unique()
+
+    # 3. Filtrar producción por esas FECHAS exactas (NO por semana calculada)
+    df_p_sem = _df_prod_cruce[_df_prod_cruce['Fecha_Cruce'].isin(fechas_semana)]
+
+    if df_p_sem.empty:
+        return pd.DataFrame(), df_p_sem, df_q_sem
+
+    # 4-6. Producción por Lote + Fecha, calidad por Asistente + Lote + Fecha, y cruce
+    merged = _cruzar_calidad_produccion(_agregar_calidad_cruce(df_q_sem), _agregar_produccion_cruce(df_p_sem))
+    return aplicar_score(merged, ratio_calidad), df_p_sem, df_q_sem
+
+@medir_etapa
+def calcular_cruce_temporada(df_prod_cruce, df_calidad):
+    """
+    Cruce producción-calidad de todas las semanas en una sola pasada: un groupby de calidad
+    por (Semana, Asistente, Lote, Fecha) y un único merge por (Lote, Fecha) contra la
+    producción agregada. El resultado queda particionado por semana, así cambiar de semana
+    es una búsqueda; el Score se aplica después (depende del slider) con aplicar_score.
+
+    Returns:
+        dict: 'semanas' {semana: cruce sin Score, mismas filas y columnas que calcular_merged_data},
+              'filas_produccion' {semana: registros de producción en las fechas de la semana},
+              'posiciones_calidad' {semana: posiciones de sus filas en df_calidad},
+              'tendencia' {'Asistente' | 'Lote': (Semana_Cruce, Etiqueta, Eficiencia, Calidad_Calc,
+              Calidad_Score, Registros)}: medias por semana de cada asistente y cada lote,
+              'filas_produccion_total'
+    """
+    vacio = {'semanas': {}, 'filas_produccion': {}, 'posiciones_calidad': {}, 'tendencia': {},
+             'filas_produccion_total': len(df_prod_cruce)}
+    if df_calidad.empty or 'Semana_Cruce' not in df_calidad.columns:
+        return vacio
+    vacio['posiciones_calidad'] = df_calidad.groupby('Semana_Cruce').indices
+    if df_prod_cruce.empty:
+        return vacio
+
+    # Registros de producción por semana: los de las fechas que calidad asigna a esa semana
+    por_fecha = df_prod_cruce['Fecha_Cruce'].value_counts()
+    fechas_semana = df_calidad[['Semana_Cruce', 'Fecha_Cruce']].dropna().drop_duplicates()
+    filas_produccion = (fechas_semana['Fecha_Cruce'].map(por_fecha).fillna(0)
+                        .groupby(fechas_semana['Semana_Cruce']).sum().astype(int))
+
+    merged = _cruzar_calidad_produccion(_agregar_calidad_cruce(df_calidad, ['Semana_Cruce']),
+                                        _agregar_produccion_cruce(df_prod_cruce))
+    semanas = {semana: grupo.drop(columns='Semana_Cruce').reset_index(drop=True)
+               for semana, grupo in merged.groupby('Semana_Cruce', sort=False)}
+
+    # Tendencia multi-semana; Calidad_Score excluye filas sin Eficiencia (como la media del Score)
+    tendencia = {}
+    if not merged.empty:
+        base = merged.assign(Calidad_Score=merged['Calidad_Calc'].where(merged['Eficiencia'].notna()))
+        medidas = dict(Eficiencia=('Eficiencia', 'mean'), Calidad_Calc=('Calidad_Calc', 'mean'),
+                       Calidad_Score=('Calidad_Score', 'mean'), Registros=('Fecha_Cruce', 'size'))
+        tendencia = {dimension: base.groupby(['Semana_Cruce', columna]).agg(**medidas).reset_index()
+                                    .rename(columns={columna: 'Etiqueta'})
+                     for dimension, columna in (('Asistente', 'Asistente'), ('Lote', 'Lote_Cruce'))}
+
+    return dict(vacio, semanas=semanas, filas_produccion=filas_produccion.to_dict(), tendencia=tendencia)
+
+def cruce_de_semana(cruce, df_calidad, semana_etiqueta, ratio_calidad):
+    """
+    Lectura de una semana del cruce de temporada (equivale a calcular_merged_data).
+
+    Returns:
+        tuple: (merged con Score, registros de producción de la semana, df_q_sem)
+    """
+    posiciones = cruce['posiciones_calidad'].get(semana_etiqueta)
+    df_q_sem = df_calidad.iloc[posiciones] if posiciones is not None else df_calidad.iloc[0:0]
+    merged = cruce['semanas'].get(semana_etiqueta, pd.DataFrame())
+    return aplicar_score(merged, ratio_calidad), cruce['filas_produccion'].get(semana_etiqueta, 0), df_q_sem
+
+def tendencia_cruce(cruce, dimension, ratio_calidad):
+    """Tendencia por semana de una dimensión ('Asistente' o 'Lote') con el Score del slider."""
+    tendencia = cruce['tendencia'].get(dimension)
+    if tendencia is None:
+        return pd.DataFrame()
+    score = tendencia['Calidad_Score'] * ratio_calidad + tendencia['Eficiencia'] * (1 - ratio_calidad)
+    return tendencia.drop(columns='Calidad_Score').assign(Score=score)
+
+@cache_data_medido(show_spinner=False)
+def calcular_estadisticas_asistente(merged):
+    """Calcula estadísticas por asistente. Cacheado."""
+    if merged.empty:
+        return pd.DataFrame()
+    asist_stats = merged.groupby('Asistente')['Desviacion_Total'].mean().reset_index()
+    asist_stats['Desviacion_Pct'] = asist_stats['Desviacion_Total'] * 100
+    return asist_stats
+
+@cache_data_medido(show_spinner=False)
+def calcular_correlacion_lotes(merged):
+    """Calcula correlación de lotes. Cacheado."""
+    if merged.empty:
+        return pd.DataFrame()
+    return merged.groupby('Lote_Cruce')[['Eficiencia', 'Calidad_Calc']].mean().reset_index()
+
+def columna_categoria_defecto(df_calidad):
+    """Columna de categoría de defecto de la hoja de calidad (nombre con 'categoria' y 'defecto'), o None."""
+    return next((c for c in df_calidad.columns if 'categoria' in c.lower() and 'defecto' in c.lower()), None)
+
+@medir_etapa
+def construir_cubo_defectos(df_calidad):
+    """
+    Cubo de defectos: desviación y jabas sumadas por (Semana, Fecha, Asistente, Lote,
+    Categoría, Tipo de defecto), una vez por versión de datos. Los filtros de la
+    evolución de defectos son recortes y sumas sobre el cubo, no groupbys sobre calidad.
+
+    Las etiquetas quedan como category (ordenadas), así filtrar por asistente o lote
+    compara códigos y el cubo ocupa poco al publicarse en el almacén Arrow.
+
+    Returns:
+        pd.DataFrame: Una fila por combinación presente (vacío si calidad no tiene Semana_Cruce)
+    """
+    if df_calidad.empty or 'Semana_Cruce' not in df_calidad.columns:
+        return pd.DataFrame()
+    col_categoria = columna_categoria_defecto(df_calidad)
+    claves = {'Semana_Cruce': df_calidad['Semana_Cruce'], 'Fecha_Cruce': df_calidad['Fecha_Cruce'],
+              'Asistente_Cruce': df_calidad['Asistente_Cruce'], 'Lote_Cruce': df_calidad['Lote_Cruce']}
+    if col_categoria:
+        claves['Categoria'] = df_calidad[col_categoria]
+    claves['Defecto'] = df_calidad['Defecto_Cruce']
+    medidas = df_calidad[['Desv_Cruce', 'Jabas_Cruce']]
+    # dropna=False: los filtros en (TODOS) también suman filas sin asistente o lote
+    cubo = medidas.groupby([v.rename(k) for k, v in claves.items()], dropna=False, sort=False).sum().reset_index()
+    cubo = cubo[cubo['Semana_Cruce'].notna()]
+    for col in ['Asistente_Cruce', 'Lote_Cruce', 'Categoria', 'Defecto']:
+        if col in cubo.columns:
+            cubo[col] = cubo[col].astype('category')
+    return cubo.reset_index(drop=True)
+
+def particionar_cubo_defectos(cubo):
+    """{semana: cubo de la semana}: la semana completa queda precargada para cambiar de filtros al instante."""
+    if cubo.empty:
+        return {}
+    return {semana: cubo.take(posiciones).drop(columns='Semana_Cruce').reset_index(drop=True)
+            for semana, posiciones in cubo.groupby('Semana_Cruce').indices.items()}
+
+@medir_etapa
+def calcular_defects_trend(cubo_semana, filtro_asistente, filtro_lote, nivel='categoria'):
+    """Calcula tendencia de defectos recortando el cubo de la semana por asistente y lote.
+
+    Args:
+        cubo_semana: Partición de la semana del cubo (particionar_cubo_defectos)
+        nivel: 'categoria' o 'detalle' para cambiar agrupación
+    """
+    if cubo_semana is None or cubo_semana.empty:
+        return pd.DataFrame()
+
+    df_filtrado = cubo_semana
+
+    # Filtrar por asistente
+    if filtro_asistente != '(TODOS)':
+        df_filtrado = df_filtrado[df_filtrado['Asistente_Cruce'] == filtro_asistente]
+
+    # Filtrar por lote
+    if filtro_lote != '(TODOS)':
+        df_filtrado = df_filtrado[df_filtrado['Lote_Cruce'] == filtro_lote]
+
+    if df_filtrado.empty:
+        return pd.DataFrame()
+
+    # Agrupar por Categoria Defecto si calidad la trae; si no (o en detalle), por tipo de defecto
+    col_defecto = 'Categoria' if nivel == 'categoria' and 'Categoria' in df_filtrado.columns else 'Defecto'
+    trend = df_filtrado.groupby(['Fecha_Cruce', col_defecto], observed=True)['Desv_Cruce'].sum().reset_index()
+    trend = trend.rename(columns={col_defecto: 'Defecto'})
+    trend['Defecto'] = trend['Defecto'].astype(object)
+    return trend
+
+@cache_data_medido(show_spinner=False)
+def calcular_ranking_lotes(merged):
+    """Calcula top y bottom lotes. Cacheado."""
+    if merged.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    lote_stats = merged.groupby('Lote_Cruce')[['Eficiencia', 'Calidad_Calc']].mean().reset_index()
+    top_5 = lote_stats.nlargest(5, 'Eficiencia')
+    bottom_5 = lote_stats.nsmallest(5, 'Eficiencia')
+    return top_5, bottom_5
+
+@medir_etapa
+def calcular_pivot_score(merged, index_col, filtro_lote, ratio):
+    """Calcula pivot de score. NO cacheado para permitir cambios en ratio desde slider."""
+    if merged.empty:
+        return pd.DataFrame()
+
+    if filtro_lote != '(TODOS)':
+        df = merged[merged['Lote_Cruce'] == filtro_lote].copy()
+    else:
+        df = merged
+
+    if df.empty:
+        return pd.DataFrame()
+
+    df['Score'] = (df['Calidad_Calc'] * ratio) + (df['Eficiencia'] * (1 - ratio))
+
+    pivot = df.pivot_table(index=index_col, columns='Fecha_Cruce', values='Score', aggfunc='mean')
+    if not pivot.empty:
+        pivot['PROMEDIO'] = pivot.mean(axis=1)
+    return pivot
+
+@cache_data_medido(show_spinner=False)
+def calcular_pivot_metricas(merged, index_col, filtro_lote):
+    """Calcula pivot de métricas. Cacheado por índice y filtro."""
+    if merged.empty:
+        return pd.DataFrame(), []
+
+    if filtro_lote != '(TODOS)':
+        df = merged[merged['Lote_Cruce'] == filtro_lote]
+    else:
+        df = merged
+
+    if df.empty:
+        return pd.DataFrame(), []
+
+    pivot = df.pivot_table(
+        index=index_col,
+        columns='Fecha_Cruce',
+        values=['Calidad_Calc', 'Eficiencia'],
+        aggfunc='mean'
+    )
+    fechas = sorted(df['Fecha_Cruce'].unique())
+    return pivot, fechas
+
+# ==============================================================================
+# FORMATO DE TABLAS TAB 3
+# ==============================================================================
+
+@medir_etapa
+def formatear_pivot_score(pivot_score_raw):
+    """Formatea columnas de fecha y agrega la fila PROMEDIO a la tabla de Score."""
+    pivot_score = pivot_score_raw.copy()
+
+    # Formatear columnas de fecha
+    new_cols = [c.strftime('%d-%m') if hasattr(c, 'strftime') else str(c) for c in pivot_score.columns]
+    pivot_score.columns = new_cols
+
+    # Variable con promedios
+    promedios_col = pivot_score.mean(axis=0)
+    promedios_col.name = 'PROMEDIO'
+    return pd.concat([pivot_score, promedios_col.to_frame().T])
+
+@medir_etapa
+def construir_vista_metricas(pivot_gen_raw, fechas, merged_filtrado, index_col):
+    """
+    Construye la tabla de desglose diario Rend/Cal con iconos.
+
+    Returns:
+        pd.DataFrame: Vista formateada (vacía si no hay fechas con datos)
+    """
+    # Hacer copia para no modificar objeto cacheado
+    pivot_gen = pivot_gen_raw.copy()
+    frames_gen = []
+
+    for f in fechas:
+        f_str = f.strftime('%d-%m')
+        try:
+            eff_day = pivot_gen['Eficiencia'][f]
+            qual_day = pivot_gen['Calidad_Calc'][f]
+            eff_fmt = eff_day.apply(lambda x: format_with_icon(x, is_efficiency=True) if pd.notna(x) else "-")
+            qual_fmt = qual_day.apply(lambda x: format_with_icon(x, is_quality=True) if pd.notna(x) else "-")
+            frames_gen.append(eff_fmt.rename(f"{f_str} Rend"))
+            frames_gen.append(qual_fmt.rename(f"{f_str} Cal"))
+        except KeyError: continue
+
+    if not frames_gen:
+        return pd.DataFrame()
+
+    df_general_view = pd.concat(frames_gen, axis=1).fillna("-")
+    # Agregar columna promedio
+    df_general_view['PROM Rend'] = merged_filtrado.groupby(index_col)['Eficiencia'].mean().apply(lambda x: format_with_icon(x, is_efficiency=True) if pd.notna(x) else "-")
+    df_general_view['PROM Cal'] = merged_filtrado.groupby(index_col)['Calidad_Calc'].mean().apply(lambda x: format_with_icon(x, is_quality=True) if pd.notna(x) else "-")
+    return df_general_view.fillna("-")
+
+@medir_etapa
+def construir_tabla_detalle(subset_detalle, vista_tabla):
+    """Historial de trabajos del asistente/lote seleccionado, con fila PROMEDIO."""
+    if vista_tabla == 'Asistente':
+        detail_table = subset_detalle.groupby(['Fecha_Cruce', 'Lote_Cruce', 'Variedad']).agg({
+            'Eficiencia': 'mean', 'Calidad_Tabla': 'mean', 'Score': 'mean', 'Jabas': 'sum'
+        }).reset_index()
+    else:
+        detail_table = subset_detalle.groupby(['Fecha_Cruce', 'Asistente', 'Variedad']).agg({
+            'Eficiencia': 'mean', 'Calidad_Tabla': 'mean', 'Score': 'mean', 'Jabas': 'sum'
+        }).reset_index()
+
+    detail_table['Fecha'] = detail_table['Fecha_Cruce'].dt.strftime('%Y-%m-%d')
+
+    cols_mostrar = ['Fecha', 'Lote_Cruce' if vista_tabla == 'Asistente' else 'Asistente', 'Variedad', 'Jabas', 'Eficiencia', 'Calidad_Tabla', 'Score']
+
+    # Agregar fila de PROMEDIO
+    prom_row = {
+        'Fecha': 'PROMEDIO',
+        'Lote_Cruce' if vista_tabla == 'Asistente' else 'Asistente': '-',
+        'Variedad': '-',
+        'Jabas': detail_table['Jabas'].mean(),
+        'Eficiencia': detail_table['Eficiencia'].mean(),
+        'Calidad_Tabla': detail_table['Calidad_Tabla'].mean(),
+        'Score': detail_table['Score'].mean()
+    }
+    return pd.concat([detail_table[cols_mostrar], pd.DataFrame([prom_row])], ignore_index=True)
+
+# --- API CLIMA ---
+URL_OPEN_METEO = "https://archive-api.open-meteo.com/v1/archive"
+PARAMS_OPEN_METEO = {"latitude": -14.06, "longitude": -75.73, "daily": "temperature_2m_max", "timezone": "America/Lima"}
+
+@cache_data_medido(ttl=3600, show_spinner=False)  # Cache 1 hora, sin spinner
+def obtener_clima_ica(fecha_inicio, fecha_fin):
+    try:
+        params = dict(PARAMS_OPEN_METEO,
+                      start_date=fecha_inicio.strftime("%Y-%m-%d"),
+                      end_date=fecha_fin.strftime("%Y-%m-%d"))
+        # requests.get real o backend local de fuentes_datos (grabado/sintético)
+        r = http_get(URL_OPEN_METEO, params=params, timeout=3)  # Timeout 3 segundos
+        data = r.json()
+        if 'daily' in data:
+            return pd.DataFrame({'Fecha': pd.to_datetime(data['daily']['time']), 'Temp_Max_Ica': data['daily']['temperature_2m_max']})
+    except: pass
+    return pd.DataFrame()
+
+# --- PREPARACIÓN DATASET IA ---
+@medir_etapa
+def generar_dataset_ia(df_filtered, c_fecha, c_lote, c_labor, c_rend_hr, c_dni, df_clima):
+    grouper = [c_fecha, c_lote]
+    if c_labor: grouper.append(c_labor)
+    df_ai = agrupar(df_filtered, grouper, {
+        c_rend_hr: (c_rend_hr, 'mean'),
+        c_dni: ('Dni_Key' if 'Dni_Key' in df_filtered.columns else c_dni, 'nunique')}).reset_index()
+    df_ai['Mes'] = df_ai[c_fecha].dt.month
+    df_ai['Dia_Semana'] = df_ai[c_fecha].dt.dayofweek
+    df_ai['Dia_Anio'] = df_ai[c_fecha].dt.dayofyear
+    if not df_clima.empty:
+        df_ai = pd.merge(df_ai, df_clima, left_on=c_fecha, right_on='Fecha', how='left')
+        df_ai.drop(columns=['Fecha'], inplace=True, errors='ignore')
+        df_ai['Temp_Max_Ica'] = df_ai['Temp_Max_Ica'].ffill().fillna(df_ai['Temp_Max_Ica'].mean())
+    rename_dict = {
+        c_fecha: 'Fecha', c_lote: 'Lote_ID', c_rend_hr: 'TARGET_Rendimiento_Hr',
+        c_dni: 'Feature_Num_Operarios', 'Temp_Max_Ica': 'Feature_Temp_Max'
+    }
+    if c_labor: rename_dict[c_labor] = 'Feature_Labor'
+    return df_ai.rename(columns=rename_dict)
+
+# --- FEATURE STORE IA ---
+# Features por serie (lote, labor): {nombre: (columna, operación, días)}. Las ventanas son de
+# días calendario ANTERIORES al día (sin incluirlo): ninguna feature ve el target que se predice
+FEATURES_SERIE_IA = {
+    'Feature_Rend_Lag_1D': ('TARGET_Rendimiento_Hr', 'retardo', 1),
+    'Feature_Rend_Lag_7D': ('TARGET_Rendimiento_Hr', 'retardo', 7),
+    'Feature_Rend_Media_7D': ('TARGET_Rendimiento_Hr', 'media', 7),
+    'Feature_Rend_Media_28D': ('TARGET_Rendimiento_Hr', 'media', 28),
+    'Feature_Operarios_Media_7D': ('Feature_Num_Operarios', 'media', 7),
+    'Feature_Dias_Trabajados_28D': ('TARGET_Rendimiento_Hr', 'dias', 28),
+}
+# Ventanas del clima (hasta el día inclusive: la temperatura del día ya se conoce)
+FEATURES_CLIMA_IA = {'Feature_Temp_Max_Media_7D': ('mean', 7), 'Feature_Temp_Max_Max_3D': ('max', 3)}
+COLUMNAS_CLIMA_IA = ['Feature_Temp_Max', *FEATURES_CLIMA_IA]
+# Días hacia adelante que alcanza un cambio en un día (mantenimiento incremental)
+ALCANCE_FEATURES_IA = max(dias for _, _, dias in FEATURES_SERIE_IA.values())
+
+def base_features_ia(df, col_map):
+    """
+    Grano del feature store: una fila por (día, lote, labor) con el rendimiento medio (target),
+    los operarios distintos y el calendario; el mismo agrupamiento de generar_dataset_ia.
+
+    Args:
+        df (pd.DataFrame): Data Maestra limpia (toda la temporada o un tramo de fechas)
+        col_map (dict): Mapa de columnas de df
+
+    Returns:
+        pd.DataFrame: Fecha, Lote_ID, Feature_Labor, TARGET_Rendimiento_Hr, Feature_Num_Operarios,
+        Mes, Dia_Semana, Dia_Anio
+    """
+    c_lote, c_labor, c_dni = col_map['Lote'], col_map.get('Labor'), col_map.get('Dni')
+    if 'Fecha_Dia' not in df.columns:
+        df = df.assign(Fecha_Dia=df[col_map['Fecha']].dt.normalize())
+    claves = ['Fecha_Dia', c_lote] + ([c_labor] if c_labor else [])
+    base = agrupar(df, claves, {
+        'TARGET_Rendimiento_Hr': (col_map['Rendimiento_Hora'], 'mean'),
+        'Feature_Num_Operarios': ('Dni_Key' if 'Dni_Key' in df.columns else c_dni, 'nunique')}).reset_index()
+    base = base.rename(columns={'Fecha_Dia': 'Fecha', c_lote: 'Lote_ID', **({c_labor: 'Feature_Labor'} if c_labor else {})})
+    base['Mes'] = base['Fecha'].dt.month
+    base['Dia_Semana'] = base['Fecha'].dt.dayofweek
+    base['Dia_Anio'] = base['Fecha'].dt.dayofyear
+    return base
+
+def features_serie_ia(base):
+    """
+    Retardos y ventanas móviles de FEATURES_SERIE_IA por serie (lote, labor). Las series se
+    llevan a una grilla diaria densa (días x series) y cada ventana es una resta de sumas
+    acumuladas, para todas las series a la vez. Los días sin trabajo no cuentan en las medias.
+    """
+    base = base.reset_index(drop=True)
+    if base.empty:
+        return base.assign(**{nombre: pd.Series(dtype=float) for nombre in FEATURES_SERIE_IA})
+    dias = pd.date_range(base['Fecha'].min(), base['Fecha'].max(), freq='D')
+    fila = dias.get_indexer(base['Fecha'])
+    serie = base.groupby([c for c in ('Lote_ID', 'Feature_Labor') if c in base.columns], sort=False).ngroup().to_numpy()
+    acumulados = {}
+    for nombre, (columna, operacion, n_dias) in FEATURES_SERIE_IA.items():
+        if columna not in acumulados:
+            grilla = np.full((len(dias), serie.max() + 1), np.nan)
+            grilla[fila, serie] = base[columna].to_numpy(dtype=float)
+            presentes = ~np.isnan(grilla)
+            ceros = np.zeros((1, grilla.shape[1]))
+            # Fila k = suma (y cantidad) de los días anteriores a k
+            acumulados[columna] = (grilla, np.vstack([ceros, np.cumsum(np.where(presentes, grilla, 0), axis=0)]),
+                                   np.vstack([ceros, np.cumsum(presentes, axis=0)]))
+        grilla, suma, cantidad = acumulados[columna]
+        desde = np.maximum(fila - n_dias, 0)
+        if operacion == 'retardo':
+            valores = np.where(fila >= n_dias, grilla[np.maximum(fila - n_dias, 0), serie], np.nan)
+        elif operacion == 'dias':
+            valores = (cantidad[fila, serie] - cantidad[desde, serie]).astype(np.int64)
+        else:
+            n = cantidad[fila, serie] - cantidad[desde, serie]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                valores = np.where(n > 0, (suma[fila, serie] - suma[desde, serie]) / n, np.nan)
+        base[nombre] = valores
+    return base
+
+def features_clima_ia(df_clima):
+    """Temperatura máxima de cada día y sus ventanas móviles (FEATURES_CLIMA_IA), una fila por fecha."""
+    if df_clima is None or df_clima.empty:
+        return pd.DataFrame({'Fecha': pd.Series(dtype='datetime64[ns]'), **{c: pd.Series(dtype=float) for c in COLUMNAS_CLIMA_IA}})
+    serie = df_clima.drop_duplicates('Fecha').set_index('Fecha')['Temp_Max_Ica'].astype(float).sort_index().asfreq('D')
+    tabla = pd.DataFrame({'Feature_Temp_Max': serie})
+    for nombre, (funcion, n_dias) in FEATURES_CLIMA_IA.items():
+        tabla[nombre] = serie.rolling(n_dias, min_periods=1).agg(funcion)
+    return tabla.rename_axis('Fecha').reset_index()
+
+def unir_clima_ia(features, clima_ia):
+    """Pone (o reemplaza) las columnas de clima del feature store, por fecha."""
+    features = features.drop(columns=COLUMNAS_CLIMA_IA, errors='ignore')
+    return features.merge(clima_ia, on='Fecha', how='left')
+
+@medir_etapa
+def construir_features_ia(df, col_map, df_clima):
+    """
+    Feature store del dataset IA de toda la temporada: grano (día, lote, labor), retardos y
+    medias móviles por lote/labor y ventanas de clima. refrescador.py lo publica y mantiene
+    de forma incremental (mantenimiento_incremental); la app solo lo recorta.
+    """
+    return unir_clima_ia(features_serie_ia(base_features_ia(df, col_map)), features_clima_ia(df_clima))
+
+def recortar_features_ia(features, date_range, sel_labor, lotes=None, rellenar_temp=True):
+    """
+    Recorta el feature store a los filtros del sidebar: periodo, labor y, con una variedad
+    elegida, los lotes de esa variedad (`lotes`). Ordenado por fecha, lote y labor.
+
+    La variedad se filtra por lote, no por fila: las series son por (lote, labor) con todas
+    las variedades, así que en un lote con más de una variedad los operarios y las demás
+    features del día incluyen las otras (generar_dataset_ia las calculaba solo con la
+    variedad elegida). Con un lote por variedad, como en el fundo, el resultado es el mismo.
+    Las temperaturas que faltan se completan como en generar_dataset_ia: con la anterior
+    del recorte y, al inicio, con la media del recorte (rellenar_temp=False las deja nulas,
+    para recortar mes a mes y rellenar al exportar, ver exportar_dataset_ia).
+    """
+    dias = features['Fecha'].dt.date
+    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+        mask = (dias >= date_range[0]) & (dias <= date_range[1])
+    elif isinstance(date_range, (list, tuple)) and len(date_range) == 1:
+        mask = dias == date_range[0]
+    else:
+        mask = pd.Series(True, index=features.index)
+    if sel_labor != '(TODAS)' and 'Feature_Labor' in features.columns:
+        # isin y no ==: el feature store es compartido y de solo lectura (congelar)
+        mask &= features['Feature_Labor'].isin([sel_labor])
+    if lotes is not None:
+        mask &= features['Lote_ID'].astype(str).isin(pd.Index(lotes).astype(str))
+    claves = [c for c in ('Fecha', 'Lote_ID', 'Feature_Labor') if c in features.columns]
+    recorte = features[mask.to_numpy()].sort_values(claves, ignore_index=True)
+    if rellenar_temp and 'Feature_Temp_Max' in recorte.columns and recorte['Feature_Temp_Max'].notna().any():
+        temp = recorte['Feature_Temp_Max']
+        recorte['Feature_Temp_Max'] = temp.ffill().fillna(temp.mean())
+    return recorte
+
+# --- HISTORIAL POR OPERARIO ---
+# Columnas del historial: rol en col_map -> nombre en el índice (las de texto van como category)
+COLUMNAS_HISTORIAL = {'Fecha': 'Fecha', 'Lote': 'Lote', 'Labor': 'Labor', 'Variedad': 'Variedad',
+                      'Rendimiento_Hora': 'Rend_Hr', 'Rendimiento_Diario': 'Rend_Dia', 'Horas': 'Horas'}
+COLUMNAS_TEXTO_HISTORIAL = ['Lote', 'Labor', 'Variedad', 'Clasificacion_Calc']
+CLASES_RENDIMIENTO = ['AR', 'MR', 'BR']
+
+@medir_etapa
+def construir_historial_operarios(df, col_map):
+    """
+    Índice del historial de la temporada por operario: las filas de cada DNI quedan contiguas
+    (ordenadas por Dni_Key y fecha) y el resumen guarda, por código, su tramo [Inicio, Fin)
+    y los indicadores de la temporada. Consultar un operario es un corte por posición, sin
+    máscara sobre la temporada (historial_de_operario).
+
+    Args:
+        df (pd.DataFrame): Data Maestra limpia de toda la temporada (con columnas derivadas)
+        col_map (dict): Mapa de columnas de df
+
+    Returns:
+        tuple: (historial, resumen). historial: Dni_Key, Fecha, Lote, Labor, Variedad, Rend_Hr,
+        Rend_Dia, Horas, Cumplimiento, Clasificacion_Calc y Pago_Dia_Calc (las que existan).
+        resumen: una fila por Dni_Key con DNI, Operario, Registros, Dias_Trabajados, Lotes,
+        Rend_Hr_Medio, Cumplimiento_Medio, Produccion_Total, Horas_Total, Pago_Total,
+        Pct_AR/Pct_MR/Pct_BR, Primera_Fecha, Ultima_Fecha, Inicio y Fin
+    """
+    c_dni = col_map.get('Dni')
+    codigos = df['Dni_Key'] if 'Dni_Key' in df.columns else pd.Series(codificar_personas(df[c_dni]), index=df.index)
+    validos = codigos.notna().to_numpy()
+    codigos = codigos.to_numpy(dtype=np.int64, na_value=-1)[validos]
+    fechas = df[col_map['Fecha']].to_numpy()[validos]
+    orden = np.lexsort((fechas, codigos))
+    filas = np.flatnonzero(validos)[orden]
+
+    historial = pd.DataFrame({'Dni_Key': codigos[orden].astype(np.int32)})
+    origen = {nombre: col_map.get(rol) for rol, nombre in COLUMNAS_HISTORIAL.items()}
+    origen.update(Cumplimiento='Cumplimiento', Clasificacion_Calc='Clasificacion_Calc', Pago_Dia_Calc='Pago_Dia_Calc')
+    for nombre, columna in origen.items():
+        if columna and columna in df.columns:
+            valores = df[columna].take(filas).reset_index(drop=True)
+            historial[nombre] = valores.astype('category') if nombre in COLUMNAS_TEXTO_HISTORIAL else valores
+
+    # Tramo de cada código: las filas ya están agrupadas, basta con dónde empieza cada uno
+    claves = historial['Dni_Key'].to_numpy()
+    presentes = np.unique(claves)
+    inicio = np.searchsorted(claves, presentes, side='left')
+    fin = np.searchsorted(claves, presentes, side='right')
+    registros = fin - inicio
+
+    resumen = pd.DataFrame({'Dni_Key': presentes.astype(np.int32)})
+    # Primer valor de cada tramo: DNI; el último: nombre del operario más reciente
+    if c_dni and c_dni in df.columns:
+        resumen['DNI'] = df[c_dni].take(filas[inicio]).astype(str).to_numpy()
+    c_operario = col_map.get('Operario')
+    if c_operario and c_operario in df.columns:
+        resumen['Operario'] = df[c_operario].take(filas[fin - 1]).astype(str).to_numpy()
+    resumen['Registros'] = registros
+    dias = historial['Fecha'].dt.normalize().to_numpy()
+    cambio = np.ones(len(historial), dtype=bool)
+    cambio[1:] = (claves[1:] != claves[:-1]) | (dias[1:] != dias[:-1])
+    resumen['Dias_Trabajados'] = np.add.reduceat(cambio, inicio) if len(historial) else registros
+
+    medidas = {'Lotes': ('Lote', 'nunique'), 'Rend_Hr_Medio': ('Rend_Hr', 'mean'),
+               'Cumplimiento_Medio': ('Cumplimiento', 'mean'), 'Produccion_Total': ('Rend_Dia', 'sum'),
+               'Horas_Total': ('Horas', 'sum'), 'Pago_Total': ('Pago_Dia_Calc', 'sum')}
+    medidas = {salida: (col, func) for salida, (col, func) in medidas.items() if col in historial.columns}
+    if medidas:
+        # El historial está ordenado por Dni_Key: sort=False conserva el orden del resumen
+        agregados = historial.groupby('Dni_Key', sort=False).agg(**medidas)
+        for salida in medidas:
+            resumen[salida] = agregados[salida].to_numpy()
+    if 'Clasificacion_Calc' in historial.columns:
+        clases = historial['Clasificacion_Calc'].astype(str).to_numpy()
+        for clase in CLASES_RENDIMIENTO:
+            resumen[f'Pct_{clase}'] = np.add.reduceat(clases == clase, inicio) / registros if len(historial) else 0.0
+    resumen['Primera_Fecha'] = historial['Fecha'].to_numpy()[inicio]
+    resumen['Ultima_Fecha'] = historial['Fecha'].to_numpy()[fin - 1]
+    resumen['Inicio'], resumen['Fin'] = inicio, fin
+    return historial, resumen
+
+def historial_de_operario(historial, resumen, codigo):
+    """
+    Filas de la temporada de un operario (por fecha), como corte por posición del historial.
+
+    Args:
+        resumen (pd.DataFrame): Resumen indexado por Dni_Key (construir_historial_operarios)
+        codigo (int): Dni_Key del operario
+
+    Returns:
+        pd.DataFrame: Sus filas del historial (vacío si el código no está)
+    """
+    if codigo not in resumen.index:
+        return historial.iloc[0:0]
+    inicio, fin = resumen.loc[codigo, ['Inicio', 'Fin']]
+    return historial.iloc[int(inicio):int(fin)]
+
+def buscar_operarios(resumen, texto, limite=50):
+    """
+    Operarios cuyo DNI es `texto` o cuyo DNI o nombre lo contiene (sin distinguir mayúsculas),
+    primero los de más días trabajados.
+
+    Args:
+        resumen (pd.DataFrame): Resumen indexado por Dni_Key
+        texto (str): DNI o parte del DNI o del nombre
+        limite (int): Máximo de coincidencias
+
+    Returns:
+        pd.DataFrame: Filas del resumen que coinciden (como mucho `limite`)
+    """
+    texto = str(texto).strip()
+    if not texto:
+        return resumen.iloc[0:0]
+    if 'DNI' in resumen.columns:
+        exacto = resumen[resumen['DNI'].isin([texto]).to_numpy()]
+        if not exacto.empty:
+            return exacto
+    mask = pd.Series(False, index=resumen.index)
+    for col in ('DNI', 'Operario'):
+        if col in resumen.columns:
+            mask |= resumen[col].str.contains(texto, case=False, regex=False, na=False)
+    return resumen[mask.to_numpy()].sort_values('Dias_Trabajados', ascending=False, kind='stable').head(limite)
+
+def evolucion_semanal_operario(filas):
+    """Rend/Hr y Cumplimiento medios, días trabajados y pago por semana del historial de un operario."""
+    dias = filas['Fecha'].dt.normalize()
+    filas = filas.assign(Dia=dias, Semana=dias - pd.to_timedelta(dias.dt.dayofweek, unit='D'))
+    medidas = {'Dias_Trabajados': ('Dia', 'nunique')}
+    for salida, col, func in (('Rend_Hr', 'Rend_Hr', 'mean'), ('Cumplimiento', 'Cumplimiento', 'mean'),
+                              ('Pago', 'Pago_Dia_Calc', 'sum')):
+        if col in filas.columns:
+            medidas[salida] = (col, func)
+    return filas.groupby('Semana').agg(**medidas).reset_index()
+
+# --- FUNCIONES PDF ---
+@medir_etapa
+def crear_pdf_completo(df_lotes, conclusiones, df_pareto, df_turnos, df_scatter, df_evolucion, labor_sel, insights_asistencia, df_patron_semanal, df_trend, col_map, df_financiero_resumen):
+    class PDF(FPDF):
+        def header(self):
+            if os.path.exists("logo.png"):
+                try: self.image("logo.png", 10, 8, 30)
+                except: pass
+            self.set_font('Arial', 'B', 16)
+            self.cell(0, 8, 'EL PEDREGAL S.A.', 0, 1, 'C')
+            self.set_font('Arial', 'I', 11)
+            self.cell(0, 6, 'FUNDO YAURILLA - DEPARTAMENTO DE PRODUCTIVIDAD', 0, 1, 'C')
+            self.ln(10)
+            self.set_font('Arial', 'B', 12)
+            self.set_fill_color(240, 240, 240)
+            self.cell(0, 10, f' REPORTE TÉCNICO: {labor_sel}', 0, 1, 'L', True)
+            self.ln(5)
+        def footer(self):
+            self.set_y(-15); self.set_font('Arial', 'I', 8)
+            self.cell(0, 10, f'Página {self.page_no()} | {datetime.now().strftime("%d/%m/%Y %H:%M")}', 0, 0, 'C')
+
+    pdf = PDF(); pdf.add_page()
+
+    # 1. RESUMEN
+    pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "1. RESUMEN EJECUTIVO", 0, 1)
+    pdf.set_font("Arial", size=10)
+    for p in conclusiones:
+        if "REPORTE TÉCNICO" in p: continue
+        pdf.multi_cell(0, 5, txt=p); pdf.ln(2)
+    pdf.ln(5)
+
+    def save_plot(fig):
+        fd, path = tempfile.mkstemp(suffix=".png")
+        os.close(fd)
+        fig.savefig(path, bbox_inches='tight', dpi=100)
+        plt.close(fig)
+        return path
+
+    # GRÁFICO CUMPLIMIENTO
+    fig1, ax1 = plt.subplots(figsize=(10, 4))
+    colores = ['#D32F2F' if x < 100 else '#388E3C' for x in df_lotes['Cumplimiento_Meta']]
+    ax1.bar(df_lotes['Lote'], df_lotes['Cumplimiento_Meta'], color=colores)
+    ax1.axhline(100, color='blue', linestyle='--', label='Meta')
+    ax1.set_title('Cumplimiento por Lote (%)', fontsize=12, fontweight='bold')
+    plt.xticks(rotation=90, fontsize=8); ax1.grid(axis='y', linestyle='--', alpha=0.3)
+    pdf.image(save_plot(fig1), x=10, w=190); pdf.ln(5)
+
+    # 2. EVOLUCIÓN
+    pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "2. EVOLUCIÓN TEMPORAL Y CLIMA", 0, 1)
+    fig_line, ax_line = plt.subplots(figsize=(10, 5))
+    c_fecha = col_map['Fecha']; c_rend = col_map['Rendimiento_Hora']
+    c_meta_min = col_map['Meta_Min']; c_meta_max = col_map['Meta_Max']
+    fechas = df_trend[c_fecha]; rend = df_trend[c_rend]
+    ax_line.plot(fechas, rend, color='#2E7D32', linewidth=2, label='Rendimiento/Hr')
+    if c_meta_min and c_meta_min in df_trend.columns: ax_line.plot(fechas, df_trend[c_meta_min], color='#D32F2F', linestyle='--', label='Meta Min')
+    if c_meta_max and c_meta_max in df_trend.columns: ax_line.plot(fechas, df_trend[c_meta_max], color='#FFD700', linestyle='--', label='Meta Max')
+    ax_line.set_ylabel("Rendimiento / Hr", color='#2E7D32'); ax_line.tick_params(axis='y', labelcolor='#2E7D32'); ax_line.grid(True, linestyle='--', alpha=0.3)
+    if 'Temp_Max_Ica' in df_trend.columns:
+        ax_temp = ax_line.twinx()
+        ax_temp.fill_between(fechas, df_trend['Temp_Max_Ica'], color='#F57C00', alpha=0.2, label='Temp Max')
+        ax_temp.plot(fechas, df_trend['Temp_Max_Ica'], color='#F57C00', linewidth=1)
+        ax_temp.set_ylabel("Temperatura (°C)", color='#E65100'); ax_temp.tick_params(axis='y', labelcolor='#E65100'); ax_temp.set_ylim(bottom=15)
+    ax_line.set_title("Evolución de Rendimiento vs Temperatura", fontsize=12, fontweight='bold'); fig_line.autofmt_xdate()
+    pdf.image(save_plot(fig_line), x=10, w=190); pdf.ln(5)
+
+    # 3. PARETO
+    pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "3. ANÁLISIS DE PARETO", 0, 1)
+    lotes_p, prod_p, pct_p = df_pareto['Lote'].tolist(), df_pareto['Produccion_Total'].tolist(), df_pareto['Porcentaje_Acum'].tolist()
+    fig2, ax2 = plt.subplots(figsize=(10, 4.5))
+    ax2.bar(lotes_p, prod_p, color='#1976D2', label='Producción')
+    plt.xticks(rotation=90, fontsize=8); ax3 = ax2.twinx()
+    ax3.plot(lotes_p, pct_p, color='red', marker='o', markersize=3); ax3.set_ylim(0, 110)
+    ax2.set_title('Pareto de Producción', fontsize=12, fontweight='bold')
+    pdf.image(save_plot(fig2), x=10, w=190); pdf.ln(5)
+
+    # 4. ASISTENCIA
+    pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "4. PATRONES DE ASISTENCIA", 0, 1)
+    pdf.set_font("Arial", size=10); pdf.multi_cell(0, 5, txt=f"Insight Asistencia: {insights_asistencia}"); pdf.ln(5)
+    if not df_patron_semanal.empty:
+        fig_hm, ax_hm = plt.subplots(figsize=(10, 3.5))
+        pivot_hm = df_patron_semanal.pivot(index='Clasificacion_Calc', columns='Dia_Nom', values='Pct')
+        dias_orden = ['Lunes','Martes','Miércoles','Jueves','Viernes','Sábado','Domingo']
+        dias_presentes = [d for d in dias_orden if d in pivot_hm.columns]
+        pivot_hm = pivot_hm[dias_presentes].fillna(0)
+        ax_hm.imshow(pivot_hm, cmap='RdYlGn', aspect='auto')
+        ax_hm.set_xticks(np.arange(len(dias_presentes))); ax_hm.set_yticks(np.arange(len(pivot_hm.index)))
+        ax_hm.set_xticklabels(dias_presentes); ax_hm.set_yticklabels(pivot_hm.index)
+        for i in range(len(pivot_hm.index)):
+            for j in range(len(dias_presentes)): ax_hm.text(j, i, f"{pivot_hm.iloc[i, j]:.0f}%", ha="center", va="center", color="black", fontsize=8)
+        ax_hm.set_title("Distribución Semanal de Calidad (%)", fontweight='bold')
+        pdf.image(save_plot(fig_hm), x=10, w=190); pdf.ln(5)
+
+    # 5. EFICIENCIA
+    pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "5. EFICIENCIA OPERATIVA", 0, 1)
+    fig4, ax4 = plt.subplots(figsize=(10, 5))
+    ax4.scatter(df_scatter['Operarios_Unicos'], df_scatter['Produccion_Total'], c='purple', alpha=0.6, s=80)
+    for i, txt in enumerate(df_scatter['Lote']):
+        if i % 2 == 0: ax4.annotate(txt, (df_scatter['Operarios_Unicos'].iloc[i], df_scatter['Produccion_Total'].iloc[i]), fontsize=8)
+    ax4.set_xlabel('Operarios'); ax4.set_ylabel('Producción'); ax4.set_title('Eficiencia: Producción vs Dotación', fontsize=12, fontweight='bold'); ax4.grid(True, linestyle='--', alpha=0.5)
+    pdf.image(save_plot(fig4), x=10, w=190)
+
+    # 6. ANÁLISIS FINANCIERO
+    if df_financiero_resumen is not None and not df_financiero_resumen.empty:
+        pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "6. ANÁLISIS FINANCIERO Y COSTOS", 0, 1)
+        pdf.set_font("Arial", size=10)
+        total_pago = df_financiero_resumen['Pago_Estimado_Total'].sum()
+        prod_total_fin = df_financiero_resumen['Produccion_Total'].sum()
+        costo_unitario_avg = total_pago / prod_total_fin if prod_total_fin > 0 else 0
+
+        pdf.multi_cell(0, 5, txt=f"Gasto Total Estimado de Planilla (Periodo): S/ {total_pago:,.2f}")
+        pdf.multi_cell(0, 5, txt=f"Costo Promedio por Unidad Producida: S/ {costo_unitario_avg:.4f}")
+        pdf.ln(5)
+
+        # Gráfico Financiero (Eficiencia Financiera por Lote)
+        fig_fin, ax_fin = plt.subplots(figsize=(10, 5))
+        # Scatter: X=Producción, Y=Gasto
+        ax_fin.scatter(df_financiero_resumen['Produccion_Total'], df_financiero_resumen['Pago_Estimado_Total'], c='#2E7D32', alpha=0.7, s=100)
+
+        # Etiquetar lotes
+        for i, row in df_financiero_resumen.iterrows():
+             if i % 2 == 0: # Etiquetar alternados
+                ax_fin.annotate(str(row['Lote_ID']), (row['Produccion_Total'], row['Pago_Estimado_Total']), fontsize=8)
+
+        ax_fin.set_title('Eficiencia Financiera: Producción vs Gasto Total por Lote', fontsize=12, fontweight='bold')
+        ax_fin.set_xlabel('Producción Total (Unidades)')
+        ax_fin.set_ylabel('Gasto Total Planilla (S/)')
+        ax_fin.grid(True, linestyle='--', alpha=0.5)
+        pdf.image(save_plot(fig_fin), x=10, w=190)
+
+    return pdf.output(dest='S').encode('latin-1', 'replace')
@@ -0,0 +1,129 @@
+"""
+Programador de refrescos dentro del proceso de la app: un hilo demonio que, cada
+REFRESCO_INTERVALO segundos, publica una versión nueva en el almacén Arrow (lo mismo que
+refrescador.py, fuera del camino de las sesiones) y calienta las cachés de las vistas más
+pedidas. Ninguna sesión absorbe la descarga de Sheets, la limpieza ni los pre-agregados:
+el rerun siguiente encuentra la versión nueva ya publicada (puntero ACTUAL) y cargada.
+
+Con varios procesos sobre el mismo almacén, un bloqueo de archivo deja que publique uno
+solo; los demás solo calientan la versión nueva. Sin ALMACEN_ARROW_DIR no hay versión que
+publicar y el hilo solo calienta las cachés (al arrancar y luego en cada ciclo).
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import collections
+import dataclasses
+import os
+import threading
+import time
+from datetime import datetime
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.state import SafeSessionState, SessionState
+
+import almacen_arrow
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sin bloqueo entre procesos; la edad de ACTUAL evita la mayoría de los duplicados
+    fcntl = None
+
+ARCHIVO_BLOQUEO = ".refresco.lock"
+# Cada cuánto se revisa si hay versión nueva (publicada aquí, por otro proceso o por cron)
+REVISAR_CADA = 30
+
+_hilo = None
+_hilo_lock = threading.Lock()
+_calentar = None
+
+def _log(mensaje):
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] programador: {mensaje}", flush=True)
+
+def _edad_version(directorio):
+    """Segundos desde la última publicación (cambio del puntero ACTUAL); infinito si no hay."""
+    try:
+        return time.time() - os.path.getmtime(os.path.join(directorio, almacen_arrow.ARCHIVO_ACTUAL))
+    except FileNotFoundError:
+        return float('inf')
+
+def refrescar_si_toca(directorio, intervalo):
+    """
+    Publica una versión nueva si la vigente tiene `intervalo` segundos o más. Si otro proceso
+    tiene el bloqueo (está refrescando) no espera: esa versión se calienta en el ciclo siguiente.
+
+    Returns:
+        str | None: Versión publicada, o None si no tocaba o refrescaba otro proceso
+    """
+    if _edad_version(directorio) < intervalo:
+        return None
+    # refrescador importa google_sheets_utils: se carga solo si el programador publica
+    import refrescador
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, ARCHIVO_BLOQUEO), 'a') as bloqueo:
+        if fcntl is not None:
+            try:
+                fcntl.flock(bloqueo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+        # Otro proceso pudo publicar entre la primera revisión y el bloqueo
+        if _edad_version(directorio) < intervalo:
+            return None
+        return refrescador.refrescar(directorio)
+
+def _contexto_hilo():
+    """
+    Contexto de script para el hilo: st.cache_data/st.cache_resource solo guardan resultados
+    si hay un ScriptRunContext. Es una copia del de la sesión que inicia el programador con
+    estado propio y sin destino para los mensajes (spinners de caché), así no toca esa sesión.
+    """
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return None
+    return dataclasses.replace(ctx, session_id="programador", _enqueue=lambda msg: None,
+                               session_state=SafeSessionState(SessionState(), lambda: None),
+                               tracked_commands=[], tracked_commands_counter=collections.Counter(), cursors={}, widget_ids_this_run=set(),
+                               widget_user_keys_this_run=set(), form_ids_this_run=set(), script_requests=None)
+
+def _ciclo(directorio, intervalo):
+    while True:
+        if directorio:
+            try:
+                refrescar_si_toca(directorio, intervalo)
+            except Exception as e:
+                # La versión vigente sigue publicada; las sesiones no notan el fallo
+                _log(f"❌ Refresco fallido, se mantiene {almacen_arrow.version_actual(directorio)}: {e}")
+        try:
+            # Con la caché caliente cada llamada es un hit; solo cuesta tras una versión nueva o un ttl vencido
+            _calentar(almacen_arrow.version_actual(directorio) if directorio else None)
+        except Exception as e:
+            _log(f"⚠️ No se pudieron calentar las cachés: {e}")
+        time.sleep(min(intervalo, REVISAR_CADA))
+
+def iniciar_programador(calentar, intervalo=None, directorio=None):
+    """
+    Inicia (una sola vez por proceso) el hilo del programador. Se llama en cada rerun para
+    que `calentar` sea siempre la función del script vigente.
+
+    Args:
+        calentar (callable): calentar(version) carga en caché las vistas más pedidas
+        intervalo (float, optional): Segundos entre refrescos; por defecto REFRESCO_INTERVALO.
+            0 (por defecto) lo desactiva
+        directorio (str, optional): Almacén Arrow; por defecto ALMACEN_ARROW_DIR
+
+    Returns:
+        threading.Thread | None: Hilo activo, o None si está desactivado
+    """
+    global _hilo, _calentar
+    if intervalo is None:
+        intervalo = float(os.environ.get("REFRESCO_INTERVALO", 0))
+    if not intervalo:
+        return None
+    _calentar = calentar
+    with _hilo_lock:
+        if _hilo is None:
+            directorio = directorio or almacen_arrow.directorio_configurado()
+            _hilo = threading.Thread(target=_ciclo, args=(directorio, intervalo), name="programador-refresco", daemon=True)
+            add_script_run_ctx(_hilo, _contexto_hilo())
+            _hilo.start()
+        return _hilo
@@ -1,22 +1,53 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import matplotlib.pyplot as plt
-from fpdf import FPDF
-import tempfile
+from datetime import datetime, date, timedelta
 import os
-import requests
-from datetime import datetime
+import tempfile
 import locale
-from io import BytesIO
 import altair as alt
-import unicodedata
-import re
 import glob
 
+# Limpieza, agregaciones, cruce y PDF (separados para poder medirlos fuera de la app)
+from procesamiento_datos import (
+    limpiar_data_maestra, agregar_columnas_derivadas, limpiar_calidad, claves_de_etiquetas, dimension_lotes,
+    codificar_personas, clave_persona, dimension_personas, construir_mascara, proyectar_filtrado, agregar_columnas_calculadas,
+    columnas_agregacion_tab1, asegurar_numericas, calcular_tendencia_diaria, calcular_resumen_lotes,
+    calcular_pareto, calcular_evolucion_clasificacion, calcular_patron_semanal,
+    calcular_financiero_lotes, calcular_costo_clasificacion, calcular_tendencia_financiera,
+    resumir_produccion_cruce, preparar_produccion_cruce_completa, recortar_produccion_cruce, calcular_cruce_temporada,
+    cruce_de_semana, tendencia_cruce,
+    calcular_estadisticas_asistente, calcular_correlacion_lotes, construir_cubo_defectos,
+    particionar_cubo_defectos, calcular_defects_trend,
+    calcular_ranking_lotes, calcular_pivot_score, calcular_pivot_metricas,
+    formatear_pivot_score, construir_vista_metricas, construir_tabla_detalle,
+    obtener_clima_ica, construir_features_ia, recortar_features_ia, crear_pdf_completo, LABOR_CRUCE, DIAS_ORDEN,
+    CLAVES_PERSONA, construir_historial_operarios, historial_de_operario, buscar_operarios, evolucion_semanal_operario,
+    CLASES_RENDIMIENTO
+)
+# Tiempos por etapa y hit/miss de caché (panel "Debug Sistema")
+from perfilador import iniciar_traza, etapa, cache_resource_medido, mostrar_traza
+# Data Maestra y Calidad: una copia por proceso, de solo lectura; cada sesión usa una vista
+from datos_compartidos import congelar, vista
+from graficos import (PUNTOS_MAX_SERIE, series_reducidas, top_n_con_otros, etiquetas_top_n, clase_dispersion,
+                      mostrar_figura, COLOR_OTROS, ETIQUETA_OTROS)
+# Versiones publicadas por refrescador.py (Arrow con memory-map, compartidas entre procesos)
+import almacen_arrow
+# Respaldo Excel leído por tramos, con snapshot Arrow por libro (se parsea una sola vez)
+from lectura_excel import leer_excel
+# Dataset IA (recorte del feature store) por meses en disco, para descarga o para entrenamiento
+from exportacion_ia import (exportar_dataset_ia, comprimir_directorio, PARQUET_AVAILABLE, BYTES_MAX_DESCARGA_IA,
+                            directorio_configurado as directorio_dataset_ia)
+# Tablas del Tab 3 a Excel (openpyxl write-only, semana a semana)
+from exportacion_excel import exportar_tablas_cruce, EXCEL_AVAILABLE
+# Refresco programado del almacén y pre-calentado de cachés en un hilo del proceso
+from programador import iniciar_programador
+# Métricas operativas en formato Prometheus (endpoint local /metrics y/o archivo .prom)
+from metricas import (FALLBACK_EXCEL, CARGA_FILAS, CRUCE_DURACION, CRUCE_FILAS,
+                      PDF_DURACION, PDF_GENERADOS, PDF_BYTES, iniciar_servidor, escribir_archivo)
+
 # Importar utilidades de Google Sheets
 try:
     import google_sheets_utils as gs_utils
@@ -27,6 +58,8 @@ except ImportError:
 
 # --- CONFIGURACIÓN GLOBAL ---
 pd.set_option("styler.render.max_elements", 1000000)
+# Copy-on-write: las vistas de los datasets compartidos se copian solo si una sesión las modifica
+pd.set_option("mode.copy_on_write", True)
 
 try:
     locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
@@ -39,6 +72,10 @@ except:
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(page_title="BI Productividad - El Pedregal", page_icon="🍇", layout="wide")
 
+# --- PERFILADO DEL RERUN Y MÉTRICAS ---
+iniciar_traza()
+iniciar_servidor()  # Una sola vez por proceso (METRICAS_PUERTO, por defecto 9464; 0 lo desactiva)
+
 # --- ESTILOS CSS ---
 st.markdown("""
 <style>
@@ -82,8 +119,24 @@ def mostrar_kpi(titulo, valor, delta=None, color_borde="#2196F3"):
     st.markdown(html, unsafe_allow_html=True)
 
 # --- CARGA DE DATOS ---
-@st.cache_data(show_spinner="Cargando datos de productividad...")
-def cargar_datos():
+# Con ALMACEN_ARROW_DIR, los datos salen de la última versión publicada por refrescador.py
+# (el cambio de versión invalida la caché); sin él, se cargan desde Sheets/Excel como siempre.
+# Con el almacén, Data Maestra está particionada por mes y solo se leen los meses del periodo.
+# Periodo inicial del sidebar con almacén particionado (0 = toda la temporada); los meses
+# anteriores se leen recién cuando se elige un periodo que los incluye
+DIAS_PERIODO_INICIAL = int(os.environ.get("DIAS_PERIODO_INICIAL", "14"))
+
+@cache_resource_medido(show_spinner="Cargando datos de productividad...", max_entries=4)
+def cargar_datos(version=None, particiones=None):
+    if version:
+        with etapa("arrow:maestra"):
+            df = almacen_arrow.abrir_tabla(version, 'maestra', particiones=particiones)
+        col_map = almacen_arrow.leer_manifiesto(version)['col_map']
+        # Versiones publicadas antes de las columnas derivadas: se completan aquí
+        agregar_columnas_derivadas(df, col_map)
+        CARGA_FILAS.set(len(df), fuente="data_maestra")
+        return congelar(df), col_map
+
     # 1. CARGAR DATA MAESTRA (desde Google Sheets o Excel local)
     try:
         # Intentar cargar desde Google Sheets primero
@@ -93,115 +146,44 @@ def cargar_datos():
                 if df.empty:
                     raise Exception("DataFrame vacío")
             except:
-                df = pd.read_excel("Data_Maestra_Limpia.xlsx")
+                FALLBACK_EXCEL.inc(hoja="data_maestra")
+                with etapa("read_excel:Data_Maestra"):
+                    df = leer_excel("Data_Maestra_Limpia.xlsx")
         else:
-            df = pd.read_excel("Data_Maestra_Limpia.xlsx")
-        # Mapeo inteligente de columnas
-        col_map = {
-            'Fecha': next((c for c in df.columns if 'fecha' in c.lower()), None),
-            'Dni': next((c for c in df.columns if 'dni' in c.lower()), None),
-            'Rendimiento_Diario': next((c for c in df.columns if c.strip() == 'Rendimiento'), None),
-            'Rendimiento_Hora': next((c for c in df.columns if 'rend/hr real' in c.lower()), None),
-            'Horas': next((c for c in df.columns if 'horas' in c.lower() and 'totales' in c.lower()), None), 
-            'Labor': next((c for c in df.columns if 'pep' in c.lower() or 'labor' in c.lower()), None),
-            'Operario': next((c for c in df.columns if 'nombre' in c.lower() or 'operario' in c.lower()), None),
-            'Lote': next((c for c in df.columns if 'lote' in c.lower()), None),
-            'Meta_Min': next((c for c in df.columns if 'min' in c.lower() and 'meta' in c.lower()), None),
-            'Meta_Max': next((c for c in df.columns if 'max' in c.lower() and 'meta' in c.lower()), None),
-            'Clasificacion': next((c for c in df.columns if 'clasifi' in c.lower()), None),
-            'Turno2': next((c for c in df.columns if 'turno' in c.lower()), None),
-            # NUEVAS COLUMNAS
-            'Salario': next((c for c in df.columns if any(x in c.lower() for x in ['salario', 'importe', 'monto', 'pago']) and 'tipo' not in c.lower()), None),
-            'Variedad': next((c for c in df.columns if 'variedad' in c.lower()), None)
-        }
-        
-        c_fecha = col_map['Fecha']
-        if c_fecha:
-            df[c_fecha] = pd.to_datetime(df[c_fecha])
-            
-        if col_map['Lote']:
-            df[col_map['Lote']] = df[col_map['Lote']].astype(str).str.split('.').str[0].str.zfill(3)
-        
-        if col_map['Labor']:
-            df[col_map['Labor']] = df[col_map['Labor']].astype(str).str.strip().str.upper()
-            
-        if col_map['Variedad']:
-            df[col_map['Variedad']] = df[col_map['Variedad']].astype(str).str.strip().str.upper()
-
-        # Limpieza de Salario (asegurar numérico)
-        if col_map['Salario']:
-            df[col_map['Salario']] = pd.to_numeric(df[col_map['Salario']], errors='coerce').fillna(0)
+            FALLBACK_EXCEL.inc(hoja="data_maestra")
+            with etapa("read_excel:Data_Maestra"):
+                df = leer_excel("Data_Maestra_Limpia.xlsx")
+        # Mapeo inteligente de columnas y normalización de tipos
+        df, col_map = limpiar_data_maestra(df)
+        # Cumplimiento, clasificación, pago y clave de fecha: una vez por carga, no por rerun
+        agregar_columnas_derivadas(df, col_map)
+        CARGA_FILAS.set(len(df), fuente="data_maestra")
 
     except Exception as e:
         st.error(f"Error cargando Data Maestra: {e}")
         return pd.DataFrame(), {}
 
-    return df, col_map
+    # Objeto compartido por todas las sesiones (cache_resource): se congela
+    return congelar(df), col_map
 
 # ==============================================================================
-# FUNCIONES Y CARGA DE DATOS PARA TAB 3 (CRUCE CALIDAD)
+# CARGA DE DATOS PARA TAB 3 (CRUCE CALIDAD)
 # ==============================================================================
 
-def normalize_text_cruce(text):
-    """Elimina acentos y convierte a minúsculas para búsquedas flexibles."""
-    if not isinstance(text, str): return str(text)
-    n = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode('utf-8')
-    return n.lower()
-
-def clean_lote_cruce(val):
-    """
-    Normaliza el formato del lote: '001' -> '1', 'L35 (1)' -> '35', 'Fundo.35' -> '35'
-    Alineado con lógica de negocio original de El Pedregal.
-    """
-    if pd.isna(val) or val == "": return "Desconocido"
-    s = str(val).upper().strip()
-    if '.' in s: # Caso "Fundo.Lote"
-        parts = s.split('.')
-        if len(parts) > 1: s = parts[1].strip()
-    if '(' in s: # Caso "L40 (1)"
-        s = s.split('(')[0].strip()
-    s = s.replace('L', '') # Quitar la L
-    s = s.strip()
-    # Intentar convertir a número para quitar ceros a la izquierda (035 -> 35)
-    try:
-        match = re.search(r'(\d+)', s)
-        if match: return str(int(match.group(1)))
-    except:
-        pass
-    return s
-
-def codigo_a_variedad(val):
-    """Convierte código de variedad a nombre completo (inverso del original)."""
-    mapa_inverso = {
-        'TM': 'TIMPSON', 'AL': 'ALLISON', 'CC': 'COTTON CANDY',
-        'SS': 'SABLE SEEDLESS', 'CH': 'CANDY HEARTS', 'RG': 'RED GLOBE',
-        'S54': 'SUGRA54', 'SG': 'SWEET GLOBE', 'IV': 'IVORY', 'AC': 'AUTUMN CRISP'
-    }
-    val_upper = str(val).upper().strip()
-    return mapa_inverso.get(val_upper, val)
-
-def find_col_cruce(df, candidates):
-    """Busca una columna en el DataFrame coincidiendo con una lista de candidatos."""
-    df_cols_norm = {normalize_text_cruce(c): c for c in df.columns}
-    for cand in candidates:
-        cand_norm = normalize_text_cruce(cand)
-        if cand_norm in df_cols_norm:
-            return df_cols_norm[cand_norm]
-    return None
-
-def format_with_icon(val, is_efficiency=False, is_quality=False):
-    """Formatea el valor numérico con iconos de alerta/éxito."""
-    if pd.isna(val): return "-"
-    icon = ""
-    if is_efficiency:
-        icon = "✅" if val >= 1.0 else "🚩"
-    elif is_quality:
-        icon = "✅" if val >= 0.95 else "🚩"
-    return f"{icon} {val:.1%}"
-
-@st.cache_data(show_spinner="Cargando datos de calidad...")
-def cargar_datos_calidad():
+@cache_resource_medido(show_spinner="Cargando datos de calidad...", max_entries=2)
+def cargar_datos_calidad(version=None):
     """Carga el archivo de calidad para el módulo de cruce (Tab 3)."""
+    if version:
+        with etapa("arrow:calidad"):
+            df_qual = almacen_arrow.abrir_tabla(version, 'calidad')
+        # Versiones publicadas antes de las claves enteras de lote
+        if 'Lote_Key' not in df_qual.columns and 'Lote_Cruce' in df_qual.columns:
+            df_qual['Lote_Key'] = claves_de_etiquetas(df_qual['Lote_Cruce'])
+        if 'Asistente_Key' not in df_qual.columns and 'Asistente_Cruce' in df_qual.columns:
+            df_qual['Asistente_Key'] = codificar_personas(df_qual['Asistente_Cruce'])
+        CARGA_FILAS.set(len(df_qual), fuente="calidad")
+        return congelar(df_qual), tuple(almacen_arrow.leer_manifiesto(version).get('debug_calidad', []))
+
     df_qual = pd.DataFrame()
     debug_msg = []
     
@@ -221,7 +203,9 @@ def cargar_datos_calidad():
         try:
             files = glob.glob("*calidad*.xlsx") + glob.glob("*calidad*.xls")
             if files:
-                df_qual = pd.read_excel(files[0], engine='openpyxl')
+                FALLBACK_EXCEL.inc(hoja="calidad")
+                with etapa("read_excel:Calidad"):
+                    df_qual = leer_excel(files[0])
                 df_qual.columns = [str(c).strip() for c in df_qual.columns]
             else:
                 debug_msg.append("No se encontró archivo de calidad local.")
@@ -229,422 +213,200 @@ def cargar_datos_calidad():
             debug_msg.append(f"Error local: {e}")
 
     # PROCESAMIENTO Y NORMALIZACIÓN (Aplica a Sheets y Local)
-    if not df_qual.empty:
-        try:
-            # Mapeo de columnas con candidatos flexibles y específicos (vistos en procesamiento_calidad.py y cruce.py)
-            c_fecha = find_col_cruce(df_qual, ['Fecha', 'Date', 'FECHA'])
-            c_lote = find_col_cruce(df_qual, ['Lote - Cuartel', 'LoteSer', 'Lote_Clean', 'Lote', 'Ubicacion'])
-            c_asist = find_col_cruce(df_qual, ['Asistente: Nombres Abreviatura', 'Asistente_C', 'Asistente_Clean', 'Asistente', 'Nombre'])
-            c_semana = find_col_cruce(df_qual, ['Semana', 'EtiquetaSemana', 'Semana_Cruce', 'SEMANA'])
-            c_desv = find_col_cruce(df_qual, ['Desviacion_Total_Grupo', 'Desv_Tot', 'Desviacion_Total', 'Desviacion'])
-            c_tasa = find_col_cruce(df_qual, ['%Calidad', 'Tasa_Valor', '% Calidad', 'Tasa Valor'])
-            c_variedad = find_col_cruce(df_qual, ['Variedad', 'Variedad_Cod', 'Variedad_Unified'])
-            c_defecto = find_col_cruce(df_qual, ['Tipo_Defecto', 'Tipo_Defe', 'Categoria Defecto', 'Defecto', 'Tipo Defecto'])
-            c_jabas = find_col_cruce(df_qual, ['Cantidad_J', 'Cantidad_Jabas', 'Conteo_Jabas', 'Jabas'])
-            
-            # UNIFORMIZACIÓN DE FECHAS
-            if c_fecha:
-                # Intentar varios formatos, priorizando el que use '-' o '/'
-                df_qual['Fecha_Cruce'] = pd.to_datetime(df_qual[c_fecha], errors='coerce')
-                # Normalizar a solo fecha (medianoche)
-                df_qual['Fecha_Cruce'] = df_qual['Fecha_Cruce'].dt.normalize()
-            
-            # SEMANA: Priorizar columna del sheet, si no existe calcular
-            if c_semana:
-                # Limpiar si viene como "Semana 40" -> 40
-                def clean_sem(val):
-                    if pd.isna(val): return None
-                    s = str(val).lower()
-                    match = re.search(r'(\d+)', s)
-                    return int(match.group(1)) if match else None
-                df_qual['Semana_Cruce'] = df_qual[c_semana].apply(clean_sem)
-            
-            # Semana DEBE venir del sheet de calidad, no se calcula
-            # if 'Semana_Cruce' not in df_qual.columns or df_qual['Semana_Cruce'].isnull().all():
-            #     if 'Fecha_Cruce' in df_qual.columns:
-            #         df_qual['Semana_Cruce'] = df_qual['Fecha_Cruce'].dt.isocalendar().week
-            
-            # Lotes limpios
-            df_qual['Lote_Cruce'] = df_qual[c_lote].apply(clean_lote_cruce) if c_lote else "Desconocido"
-            
-            # Asistente
-            df_qual['Asistente_Cruce'] = df_qual[c_asist].astype(str).str.strip() if c_asist else "Sin Asignar"
-            
-            # Desviación / Calidad
-            if c_desv:
-                df_qual['Desv_Cruce'] = pd.to_numeric(df_qual[c_desv], errors='coerce').fillna(0)
-            elif c_tasa:
-                v_tasa = pd.to_numeric(df_qual[c_tasa], errors='coerce').fillna(0)
-                # Si es %Calidad (ej 0.98), desv = 1 - 0.98
-                if v_tasa.mean() > 0.5: df_qual['Desv_Cruce'] = 1.0 - v_tasa
-                else: df_qual['Desv_Cruce'] = v_tasa
-            else:
-                df_qual['Desv_Cruce'] = 0
-            
-            # Variedad y Defecto
-            df_qual['Variedad_Cruce'] = df_qual[c_variedad].apply(codigo_a_variedad) if c_variedad else "ND"
-            df_qual['Defecto_Cruce'] = df_qual[c_defecto] if c_defecto else "Sin Detalle"
-            
-            # Jabas
-            df_qual['Jabas_Cruce'] = pd.to_numeric(df_qual[c_jabas], errors='coerce').fillna(0).astype(int) if c_jabas else 0
-            
-        except Exception as e:
-            debug_msg.append(f"Error procesando Calidad: {e}")
-    
-    return df_qual, debug_msg
-
-# ==============================================================================
-# FUNCIONES CACHEADAS PARA TAB3 (OPTIMIZACIÓN DE RENDIMIENTO)
-# ==============================================================================
-
-@st.cache_data(show_spinner=False)
-def preparar_produccion_cruce(_df_f, c_fecha, c_lote, c_rend_hr, c_meta_min, c_semana=None):
-    """Prepara el DataFrame de producción para cruce. Cacheado para evitar recálculo."""
-    df_prod = _df_f.copy()
+    df_qual, debug_proc = limpiar_calidad(df_qual)
+    debug_msg.extend(debug_proc)
+    CARGA_FILAS.set(len(df_qual), fuente="calidad")
     
-    # Normalización de Fecha
-    df_prod['Fecha_Cruce'] = pd.to_datetime(df_prod[c_fecha], errors='coerce').dt.normalize()
-    
-    # Semana: usar SOLO si existe en los datos, no calcular como fallback
-    if c_semana and c_semana in df_prod.columns:
-        df_prod['Semana_Cruce'] = pd.to_numeric(df_prod[c_semana], errors='coerce')
-    else:
-        df_prod['Semana_Cruce'] = None  # No calcular, dejar vacío si no existe
-        
-    # Lote
-    df_prod['Lote_Cruce'] = df_prod[c_lote].apply(clean_lote_cruce)
-    
-    # Eficiencia (Asegurar numérico y evitar división por cero)
-    if c_rend_hr and c_meta_min:
-        rend_vals = pd.to_numeric(df_prod[c_rend_hr], errors='coerce').fillna(0)
-        meta_vals = pd.to_numeric(df_prod[c_meta_min], errors='coerce').fillna(0)
-        df_prod['Eficiencia'] = rend_vals / meta_vals.replace(0, np.nan)
-        df_prod['Eficiencia'] = df_prod['Eficiencia'].fillna(0)
-    else:
-        df_prod['Eficiencia'] = 0
-        
-    return df_prod
-
-def calcular_merged_data(_df_prod_cruce, _df_calidad, semana_etiqueta, ratio_calidad):
-    """Calcula el merge entre producción y calidad usando FECHAS, no semanas calculadas."""
-    # 1. Filtrar calidad por la etiqueta de semana seleccionada
-    df_q_sem = _df_calidad[_df_calidad['Semana_Cruce'] == semana_etiqueta].copy()
-    
-    if df_q_sem.empty:
-        return pd.DataFrame(), pd.DataFrame(), df_q_sem
-    
-    # 2. Obtener las FECHAS que pertenecen a esta semana (desde calidad)
-    fechas_semana = df_q_sem['Fecha_Cruce'].dropna().unique()
-    
-    # 3. Filtrar producción por esas FECHAS exactas (NO por semana calculada)
-    df_p_sem = _df_prod_cruce[_df_prod_cruce['Fecha_Cruce'].isin(fechas_semana)].copy()
-    
-    if df_p_sem.empty:
-        return pd.DataFrame(), df_p_sem, df_q_sem
-    
-    # 4. Agrupar producción por Lote + Fecha
-    prod_agg = df_p_sem.groupby(['Lote_Cruce', 'Fecha_Cruce']).agg({'Eficiencia': 'mean'}).reset_index()
-    
-    # 5. Agrupar calidad por Asistente + Lote + Fecha
-    qual_agg = df_q_sem.groupby(['Asistente_Cruce', 'Lote_Cruce', 'Fecha_Cruce']).agg({
-        'Desv_Cruce': 'mean', 'Variedad_Cruce': 'first', 'Jabas_Cruce': 'sum'
-    }).reset_index()
-    qual_agg.rename(columns={
-        'Asistente_Cruce': 'Asistente', 
-        'Desv_Cruce': 'Desviacion_Total', 
-        'Variedad_Cruce': 'Variedad',
-        'Jabas_Cruce': 'Jabas'
-    }, inplace=True)
-    
-    # 6. Merge por Lote + Fecha (Único cruce válido)
-    merged = pd.merge(qual_agg, prod_agg, on=['Lote_Cruce', 'Fecha_Cruce'], how='inner')
-    
-    if not merged.empty:
-        merged['Calidad_Calc'] = 1.0 - merged['Desviacion_Total'].fillna(0)
-        merged['Score'] = (merged['Calidad_Calc'] * ratio_calidad) + (merged['Eficiencia'] * (1 - ratio_calidad))
-        merged['Calidad_Tabla'] = merged['Calidad_Calc']
-    
-    return merged, df_p_sem, df_q_sem
-
-@st.cache_data(show_spinner=False)
-def calcular_estadisticas_asistente(merged):
-    """Calcula estadísticas por asistente. Cacheado."""
-    if merged.empty:
-        return pd.DataFrame()
-    asist_stats = merged.groupby('Asistente')['Desviacion_Total'].mean().reset_index()
-    asist_stats['Desviacion_Pct'] = asist_stats['Desviacion_Total'] * 100
-    return asist_stats
-
-@st.cache_data(show_spinner=False)
-def calcular_correlacion_lotes(merged):
-    """Calcula correlación de lotes. Cacheado."""
-    if merged.empty:
-        return pd.DataFrame()
-    return merged.groupby('Lote_Cruce')[['Eficiencia', 'Calidad_Calc']].mean().reset_index()
-
-@st.cache_data(show_spinner=False)
-def calcular_defects_trend(df_q_sem, filtro_asistente, filtro_lote, nivel='categoria'):
-    """Calcula tendencia de defectos. Cacheado por filtro de asistente y lote.
-    
-    Args:
-        nivel: 'categoria' o 'detalle' para cambiar agrupación
+    return congelar(df_qual), tuple(debug_msg)
+
+@cache_resource_medido(show_spinner=False, max_entries=4)
+def cargar_zonas(version, tabla='maestra'):
+    """Entrada de una tabla en el manifiesto (mapa de zonas por mes); None si no está particionada."""
+    info = almacen_arrow.leer_manifiesto(version)['tablas'].get(tabla, {})
+    return info if info.get('particiones') else None
+
+def periodo_de_zonas(zonas):
+    """(min_d, max_d, periodo inicial del sidebar) según el mapa de zonas, sin leer datos."""
+    fechas = [date.fromisoformat(z[k]) for z in zonas['particiones'] if z['desde'] for k in ('desde', 'hasta')]
+    min_d, max_d = min(fechas), max(fechas)
+    desde = max(min_d, max_d - timedelta(days=DIAS_PERIODO_INICIAL - 1)) if DIAS_PERIODO_INICIAL > 0 else min_d
+    return min_d, max_d, [desde, max_d]
+
+def particiones_del_periodo(zonas, periodo, filtros=None):
+    """Meses de una tabla que tocan el periodo (con una sola fecha elegida, de ella en adelante)."""
+    periodo = list(periodo)
+    return almacen_arrow.particiones_en_rango(zonas, periodo[0] if periodo else None,
+                                              periodo[1] if len(periodo) > 1 else None, filtros)
+
+@cache_resource_medido(show_spinner=False, max_entries=2)
+def cargar_produccion_cruce(version=None):
     """
-    if df_q_sem.empty:
-        return pd.DataFrame()
-    
-    df_filtrado = df_q_sem.copy()
-    
-    # Filtrar por asistente
-    if filtro_asistente != '(TODOS)':
-        df_filtrado = df_filtrado[df_filtrado['Asistente_Cruce'] == filtro_asistente]
-    
-    # Filtrar por lote  
-    if filtro_lote != '(TODOS)':
-        df_filtrado = df_filtrado[df_filtrado['Lote_Cruce'] == filtro_lote]
-    
-    if df_filtrado.empty:
-        return pd.DataFrame()
-    
-    # Agrupar según nivel
-    if nivel == 'categoria':
-        # Agrupar por Categoria Defecto
-        col_defecto = next((c for c in df_filtrado.columns if 'categoria' in c.lower() and 'defecto' in c.lower()), None)
-        if col_defecto:
-            return df_filtrado.groupby(['Fecha_Cruce', col_defecto])['Desv_Cruce'].sum().reset_index().rename(columns={col_defecto: 'Defecto'})
-    
-    # Detalle: usar Tipo_Defecto o Defecto_Cruce
-    return df_filtrado.groupby(['Fecha_Cruce', 'Defecto_Cruce'])['Desv_Cruce'].sum().reset_index().rename(columns={'Defecto_Cruce': 'Defecto'})
-
-@st.cache_data(show_spinner=False)
-def calcular_ranking_lotes(merged):
-    """Calcula top y bottom lotes. Cacheado."""
-    if merged.empty:
-        return pd.DataFrame(), pd.DataFrame()
-    lote_stats = merged.groupby('Lote_Cruce')[['Eficiencia', 'Calidad_Calc']].mean().reset_index()
-    top_5 = lote_stats.nlargest(5, 'Eficiencia')
-    bottom_5 = lote_stats.nsmallest(5, 'Eficiencia')
-    return top_5, bottom_5
-
-def calcular_pivot_score(merged, index_col, filtro_lote, ratio):
-    """Calcula pivot de score. NO cacheado para permitir cambios en ratio desde slider."""
-    if merged.empty:
-        return pd.DataFrame()
-    
-    if filtro_lote != '(TODOS)':
-        df = merged[merged['Lote_Cruce'] == filtro_lote].copy()
+    Producción del cruce de toda la temporada, una sola copia por proceso y de solo lectura;
+    cada rerun solo la recorta por periodo y variedad. Con almacén Arrow se usa la que
+    pre-calcula refrescador.py.
+    """
+    if version:
+        df_prod = almacen_arrow.abrir_tabla(version, 'produccion_cruce')
+        if df_prod is not None and 'Lote_Key' in df_prod.columns:
+            return congelar(df_prod)
+    df_base, col_map_base = cargar_datos(version)
+    return congelar(preparar_produccion_cruce_completa(df_base, col_map_base))
+
+@cache_resource_medido(show_spinner=False, max_entries=2)
+def cargar_dimensiones(version=None):
+    """
+    Dimensiones de la versión de datos: lotes (clave entera, etiquetas y hoja de origen) y
+    personas (código -> DNI, operario o asistente).
+    """
+    if version and cargar_zonas(version):
+        # Solo las columnas de lote y personas de todos los meses, sin cargar Data Maestra entera
+        col_map_base = almacen_arrow.leer_manifiesto(version)['col_map']
+        columnas = ['Lote_Key', col_map_base.get('Lote')] + [c for rol, clave in CLAVES_PERSONA.items()
+                                                             for c in (clave, col_map_base.get(rol))]
+        df_base = almacen_arrow.abrir_tabla(version, 'maestra', columnas=columnas)
     else:
-        df = merged
+        df_base, col_map_base = cargar_datos(version)
+    df_qual = cargar_datos_calidad(version)[0]
+    return dimension_lotes(df_base, col_map_base, df_qual), dimension_personas(df_base, col_map_base, df_qual)
 
-    if df.empty:
-        return pd.DataFrame()
-    
-    df['Score'] = (df['Calidad_Calc'] * ratio) + (df['Eficiencia'] * (1 - ratio))
-    
-    pivot = df.pivot_table(index=index_col, columns='Fecha_Cruce', values='Score', aggfunc='mean')
-    if not pivot.empty:
-        pivot['PROMEDIO'] = pivot.mean(axis=1)
-    return pivot
-
-@st.cache_data(show_spinner=False)
-def calcular_pivot_metricas(merged, index_col, filtro_lote):
-    """Calcula pivot de métricas. Cacheado por índice y filtro."""
-    if merged.empty:
-        return pd.DataFrame(), []
-    
-    if filtro_lote != '(TODOS)':
-        df = merged[merged['Lote_Cruce'] == filtro_lote]
-    else:
-        df = merged
-    
-    if df.empty:
-        return pd.DataFrame(), []
-    
-    pivot = df.pivot_table(
-        index=index_col,
-        columns='Fecha_Cruce',
-        values=['Calidad_Calc', 'Eficiencia'],
-        aggfunc='mean'
-    )
-    fechas = sorted(df['Fecha_Cruce'].unique())
-    return pivot, fechas
-
-
-# --- API CLIMA ---
-@st.cache_data(ttl=3600, show_spinner=False)  # Cache 1 hora, sin spinner
-def obtener_clima_ica(fecha_inicio, fecha_fin):
-    try:
-        url = "https://archive-api.open-meteo.com/v1/archive"
-        params = {
-            "latitude": -14.06, "longitude": -75.73,
-            "start_date": fecha_inicio.strftime("%Y-%m-%d"),
-            "end_date": fecha_fin.strftime("%Y-%m-%d"),
-            "daily": "temperature_2m_max", "timezone": "America/Lima"
-        }
-        r = requests.get(url, params=params, timeout=3)  # Timeout 3 segundos
-        data = r.json()
-        if 'daily' in data:
-            return pd.DataFrame({'Fecha': pd.to_datetime(data['daily']['time']), 'Temp_Max_Ica': data['daily']['temperature_2m_max']})
-    except: pass
-    return pd.DataFrame()
-
-# --- PREPARACIÓN DATASET IA ---
-def generar_dataset_ia(df_filtered, c_fecha, c_lote, c_labor, c_rend_hr, c_dni, df_clima):
-    grouper = [c_fecha, c_lote]
-    if c_labor: grouper.append(c_labor)
-    df_ai = df_filtered.groupby(grouper).agg({
-        c_rend_hr: 'mean', c_dni: 'nunique'}).reset_index()
-    df_ai['Mes'] = df_ai[c_fecha].dt.month
-    df_ai['Dia_Semana'] = df_ai[c_fecha].dt.dayofweek
-    df_ai['Dia_Anio'] = df_ai[c_fecha].dt.dayofyear
-    if not df_clima.empty:
-        df_ai = pd.merge(df_ai, df_clima, left_on=c_fecha, right_on='Fecha', how='left')
-        df_ai.drop(columns=['Fecha'], inplace=True, errors='ignore')
-        df_ai['Temp_Max_Ica'] = df_ai['Temp_Max_Ica'].fillna(method='ffill').fillna(df_ai['Temp_Max_Ica'].mean())
-    rename_dict = {
-        c_fecha: 'Fecha', c_lote: 'Lote_ID', c_rend_hr: 'TARGET_Rendimiento_Hr',
-        c_dni: 'Feature_Num_Operarios', 'Temp_Max_Ica': 'Feature_Temp_Max'
-    }
-    if c_labor: rename_dict[c_labor] = 'Feature_Labor'
-    return df_ai.rename(columns=rename_dict)
-
-# --- FUNCIONES PDF ---
-def crear_pdf_completo(df_lotes, conclusiones, df_pareto, df_turnos, df_scatter, df_evolucion, labor_sel, insights_asistencia, df_patron_semanal, df_trend, col_map, df_financiero_resumen):
-    class PDF(FPDF):
-        def header(self):
-            if os.path.exists("logo.png"):
-                try: self.image("logo.png", 10, 8, 30)
-                except: pass
-            self.set_font('Arial', 'B', 16)
-            self.cell(0, 8, 'EL PEDREGAL S.A.', 0, 1, 'C')
-            self.set_font('Arial', 'I', 11)
-            self.cell(0, 6, 'FUNDO YAURILLA - DEPARTAMENTO DE PRODUCTIVIDAD', 0, 1, 'C')
-            self.ln(10)
-            self.set_font('Arial', 'B', 12)
-            self.set_fill_color(240, 240, 240)
-            self.cell(0, 10, f' REPORTE TÉCNICO: {labor_sel}', 0, 1, 'L', True)
-            self.ln(5)
-        def footer(self):
-            self.set_y(-15); self.set_font('Arial', 'I', 8)
-            self.cell(0, 10, f'Página {self.page_no()} | {datetime.now().strftime("%d/%m/%Y %H:%M")}', 0, 0, 'C')
-
-    pdf = PDF(); pdf.add_page()
-    
-    # 1. RESUMEN
-    pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "1. RESUMEN EJECUTIVO", 0, 1)
-    pdf.set_font("Arial", size=10)
-    for p in conclusiones:
-        if "REPORTE TÉCNICO" in p: continue
-        pdf.multi_cell(0, 5, txt=p); pdf.ln(2)
-    pdf.ln(5)
-
-    def save_plot(fig):
-        fd, path = tempfile.mkstemp(suffix=".png")
-        os.close(fd)
-        fig.savefig(path, bbox_inches='tight', dpi=100)
-        plt.close(fig)
-        return path
-
-    # GRÁFICO CUMPLIMIENTO
-    fig1, ax1 = plt.subplots(figsize=(10, 4))
-    colores = ['#D32F2F' if x < 100 else '#388E3C' for x in df_lotes['Cumplimiento_Meta']]
-    ax1.bar(df_lotes['Lote'], df_lotes['Cumplimiento_Meta'], color=colores)
-    ax1.axhline(100, color='blue', linestyle='--', label='Meta')
-    ax1.set_title('Cumplimiento por Lote (%)', fontsize=12, fontweight='bold')
-    plt.xticks(rotation=90, fontsize=8); ax1.grid(axis='y', linestyle='--', alpha=0.3)
-    pdf.image(save_plot(fig1), x=10, w=190); pdf.ln(5)
-
-    # 2. EVOLUCIÓN
-    pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "2. EVOLUCIÓN TEMPORAL Y CLIMA", 0, 1)
-    fig_line, ax_line = plt.subplots(figsize=(10, 5))
-    c_fecha = col_map['Fecha']; c_rend = col_map['Rendimiento_Hora']
-    c_meta_min = col_map['Meta_Min']; c_meta_max = col_map['Meta_Max']
-    fechas = df_trend[c_fecha]; rend = df_trend[c_rend]
-    ax_line.plot(fechas, rend, color='#2E7D32', linewidth=2, label='Rendimiento/Hr')
-    if c_meta_min and c_meta_min in df_trend.columns: ax_line.plot(fechas, df_trend[c_meta_min], color='#D32F2F', linestyle='--', label='Meta Min')
-    if c_meta_max and c_meta_max in df_trend.columns: ax_line.plot(fechas, df_trend[c_meta_max], color='#FFD700', linestyle='--', label='Meta Max')
-    ax_line.set_ylabel("Rendimiento / Hr", color='#2E7D32'); ax_line.tick_params(axis='y', labelcolor='#2E7D32'); ax_line.grid(True, linestyle='--', alpha=0.3)
-    if 'Temp_Max_Ica' in df_trend.columns:
-        ax_temp = ax_line.twinx()
-        ax_temp.fill_between(fechas, df_trend['Temp_Max_Ica'], color='#F57C00', alpha=0.2, label='Temp Max')
-        ax_temp.plot(fechas, df_trend['Temp_Max_Ica'], color='#F57C00', linewidth=1)
-        ax_temp.set_ylabel("Temperatura (°C)", color='#E65100'); ax_temp.tick_params(axis='y', labelcolor='#E65100'); ax_temp.set_ylim(bottom=15)
-    ax_line.set_title("Evolución de Rendimiento vs Temperatura", fontsize=12, fontweight='bold'); fig_line.autofmt_xdate()
-    pdf.image(save_plot(fig_line), x=10, w=190); pdf.ln(5)
-
-    # 3. PARETO
-    pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "3. ANÁLISIS DE PARETO", 0, 1)
-    lotes_p, prod_p, pct_p = df_pareto['Lote'].tolist(), df_pareto['Produccion_Total'].tolist(), df_pareto['Porcentaje_Acum'].tolist()
-    fig2, ax2 = plt.subplots(figsize=(10, 4.5))
-    ax2.bar(lotes_p, prod_p, color='#1976D2', label='Producción')
-    plt.xticks(rotation=90, fontsize=8); ax3 = ax2.twinx()
-    ax3.plot(lotes_p, pct_p, color='red', marker='o', markersize=3); ax3.set_ylim(0, 110)
-    ax2.set_title('Pareto de Producción', fontsize=12, fontweight='bold')
-    pdf.image(save_plot(fig2), x=10, w=190); pdf.ln(5)
-
-    # 4. ASISTENCIA
-    pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "4. PATRONES DE ASISTENCIA", 0, 1)
-    pdf.set_font("Arial", size=10); pdf.multi_cell(0, 5, txt=f"Insight Asistencia: {insights_asistencia}"); pdf.ln(5)
-    if not df_patron_semanal.empty:
-        fig_hm, ax_hm = plt.subplots(figsize=(10, 3.5))
-        pivot_hm = df_patron_semanal.pivot(index='Clasificacion_Calc', columns='Dia_Nom', values='Pct')
-        dias_orden = ['Lunes','Martes','Miércoles','Jueves','Viernes','Sábado','Domingo']
-        dias_presentes = [d for d in dias_orden if d in pivot_hm.columns]
-        pivot_hm = pivot_hm[dias_presentes].fillna(0)
-        im = ax_hm.imshow(pivot_hm, cmap='RdYlGn', aspect='auto')
-        ax_hm.set_xticks(np.arange(len(dias_presentes))); ax_hm.set_yticks(np.arange(len(pivot_hm.index)))
-        ax_hm.set_xticklabels(dias_presentes); ax_hm.set_yticklabels(pivot_hm.index)
-        for i in range(len(pivot_hm.index)):
-            for j in range(len(dias_presentes)): ax_hm.text(j, i, f"{pivot_hm.iloc[i, j]:.0f}%", ha="center", va="center", color="black", fontsize=8)
-        ax_hm.set_title("Distribución Semanal de Calidad (%)", fontweight='bold')
-        pdf.image(save_plot(fig_hm), x=10, w=190); pdf.ln(5)
-
-    # 5. EFICIENCIA
-    pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "5. EFICIENCIA OPERATIVA", 0, 1)
-    fig4, ax4 = plt.subplots(figsize=(10, 5))
-    ax4.scatter(df_scatter['Operarios_Unicos'], df_scatter['Produccion_Total'], c='purple', alpha=0.6, s=80)
-    for i, txt in enumerate(df_scatter['Lote']):
-        if i % 2 == 0: ax4.annotate(txt, (df_scatter['Operarios_Unicos'].iloc[i], df_scatter['Produccion_Total'].iloc[i]), fontsize=8)
-    ax4.set_xlabel('Operarios'); ax4.set_ylabel('Producción'); ax4.set_title('Eficiencia: Producción vs Dotación', fontsize=12, fontweight='bold'); ax4.grid(True, linestyle='--', alpha=0.5)
-    pdf.image(save_plot(fig4), x=10, w=190)
-
-    # 6. ANÁLISIS FINANCIERO
-    if df_financiero_resumen is not None and not df_financiero_resumen.empty:
-        pdf.add_page(); pdf.set_font("Arial", 'B', 11); pdf.cell(0, 8, "6. ANÁLISIS FINANCIERO Y COSTOS", 0, 1)
-        pdf.set_font("Arial", size=10)
-        total_pago = df_financiero_resumen['Pago_Estimado_Total'].sum()
-        prod_total_fin = df_financiero_resumen['Produccion_Total'].sum()
-        costo_unitario_avg = total_pago / prod_total_fin if prod_total_fin > 0 else 0
-        
-        pdf.multi_cell(0, 5, txt=f"Gasto Total Estimado de Planilla (Periodo): S/ {total_pago:,.2f}")
-        pdf.multi_cell(0, 5, txt=f"Costo Promedio por Unidad Producida: S/ {costo_unitario_avg:.4f}")
-        pdf.ln(5)
-        
-        # Gráfico Financiero (Eficiencia Financiera por Lote)
-        fig_fin, ax_fin = plt.subplots(figsize=(10, 5))
-        # Scatter: X=Producción, Y=Gasto
-        ax_fin.scatter(df_financiero_resumen['Produccion_Total'], df_financiero_resumen['Pago_Estimado_Total'], c='#2E7D32', alpha=0.7, s=100)
-        
-        # Etiquetar lotes
-        for i, row in df_financiero_resumen.iterrows():
-             if i % 2 == 0: # Etiquetar alternados
-                ax_fin.annotate(str(row['Lote_ID']), (row['Produccion_Total'], row['Pago_Estimado_Total']), fontsize=8)
-                
-        ax_fin.set_title('Eficiencia Financiera: Producción vs Gasto Total por Lote', fontsize=12, fontweight='bold')
-        ax_fin.set_xlabel('Producción Total (Unidades)')
-        ax_fin.set_ylabel('Gasto Total Planilla (S/)')
-        ax_fin.grid(True, linestyle='--', alpha=0.5)
-        pdf.image(save_plot(fig_fin), x=10, w=190)
+@cache_resource_medido(show_spinner="Cruzando producción y calidad de la temporada...", max_entries=4)
+def cargar_cruce_temporada(version, periodo, sel_variedad):
+    """
+    Cruce producción-calidad de todas las semanas, por versión de datos y filtros del sidebar
+    que recortan la producción (periodo y variedad); cambiar de semana no lo recalcula.
+    """
+    col_map_base = almacen_arrow.leer_manifiesto(version)['col_map'] if version else cargar_datos(version)[1]
+    df_prod = recortar_produccion_cruce(cargar_produccion_cruce(version), col_map_base, list(periodo), sel_variedad)
+    cruce = calcular_cruce_temporada(df_prod, cargar_datos_calidad(version)[0])
+    for merged in cruce['semanas'].values():
+        congelar(merged)
+    for tendencia in cruce['tendencia'].values():
+        congelar(tendencia)
+    return cruce
+
+@cache_resource_medido(show_spinner=False, max_entries=2)
+def cargar_cubo_defectos(version=None):
+    """
+    Cubo de defectos de la versión de datos, particionado por semana (una partición precargada
+    por semana). Con almacén Arrow se usa el que publica refrescador.py.
+    """
+    cubo = almacen_arrow.abrir_tabla(version, 'cubo_defectos') if version else None
+    if cubo is None:
+        cubo = construir_cubo_defectos(cargar_datos_calidad(version)[0])
+    particiones = particionar_cubo_defectos(cubo)
+    for cubo_semana in particiones.values():
+        congelar(cubo_semana)
+    return particiones
+
+@cache_resource_medido(show_spinner="Calculando features IA de la temporada...", max_entries=4)
+def cargar_features_ia(version=None, particiones=None):
+    """
+    Feature store del dataset IA (retardos y ventanas por lote/labor y de clima). Con almacén
+    Arrow se leen los meses pedidos de la tabla que mantiene refrescador.py; sin almacén (o
+    en versiones anteriores al feature store) se calcula una vez por proceso para la temporada.
+    """
+    if version:
+        features = almacen_arrow.abrir_tabla(version, 'features_ia', particiones=particiones)
+        if features is not None:
+            return congelar(features)
+    df_base, col_map_base = cargar_datos(version)
+    fechas = df_base[col_map_base['Fecha']]
+    return congelar(construir_features_ia(df_base, col_map_base, obtener_clima_ica(fechas.min(), fechas.max())))
+
+def features_ia_del_periodo(version, periodo, sel_labor, lotes=None):
+    """Recorte del feature store para el sidebar; con almacén solo se leen los meses y labores que tocan."""
+    zonas = cargar_zonas(version, 'features_ia') if version else None
+    particiones = (particiones_del_periodo(zonas, periodo, {'Feature_Labor': sel_labor} if sel_labor != '(TODAS)' else None)
+                   if zonas else None)
+    return recortar_features_ia(cargar_features_ia(version, particiones), periodo, sel_labor, lotes)
+
+def bloques_features_ia(version, periodo, sel_labor, lotes=None):
+    """
+    Recorte del feature store para exportar_dataset_ia: (bloques, media de temperatura). Con
+    almacén cada bloque es un mes leído de su partición sin pasar por la caché (se descarta al
+    escribirlo) y la media sale de una lectura previa de solo las columnas de filtro y clima;
+    sin almacén es un único bloque, el de features_ia_del_periodo.
+    """
+    zonas = cargar_zonas(version, 'features_ia') if version else None
+    if not zonas:
+        return [features_ia_del_periodo(version, periodo, sel_labor, lotes)], None
+    archivos = particiones_del_periodo(zonas, periodo, {'Feature_Labor': sel_labor} if sel_labor != '(TODAS)' else None)
+    clima = almacen_arrow.abrir_tabla(version, 'features_ia', particiones=archivos,
+                                      columnas=['Fecha', 'Lote_ID', 'Feature_Labor', 'Feature_Temp_Max'])
+    temp = recortar_features_ia(clima, periodo, sel_labor, lotes, rellenar_temp=False).get('Feature_Temp_Max')
+    bloques = (recortar_features_ia(almacen_arrow.abrir_tabla(version, 'features_ia', particiones=[archivo]),
+                                    periodo, sel_labor, lotes, rellenar_temp=False)
+               for archivo in archivos)
+    return bloques, (temp.mean() if temp is not None else None)
+
+@cache_resource_medido(show_spinner="Indexando el historial por operario...", max_entries=2)
+def cargar_historial_operarios(version=None):
+    """
+    Historial de la temporada con las filas de cada DNI contiguas y el resumen por operario
+    (indexado por Dni_Key, con su tramo Inicio/Fin). Con almacén Arrow se usan las tablas que
+    publica refrescador.py; sin almacén (o en versiones anteriores) se indexa una vez por proceso.
+    """
+    if version:
+        historial = almacen_arrow.abrir_tabla(version, 'historial_operarios')
+        resumen = almacen_arrow.abrir_tabla(version, 'resumen_operarios')
+        if historial is not None and resumen is not None:
+            return congelar(historial), congelar(resumen.set_index('Dni_Key'))
+    df_base, col_map_base = cargar_datos(version)
+    historial, resumen = construir_historial_operarios(df_base, col_map_base)
+    return congelar(historial), congelar(resumen.set_index('Dni_Key'))
+
+def calentar_caches(version):
+    """
+    Carga en caché las vistas más pedidas de una versión: el periodo inicial de las Tabs 1
+    y 2 (con su clima), las dimensiones del debug, el cruce de la temporada de la Tab 3,
+    que incluye la semana más reciente, el feature store IA del periodo y el historial por
+    operario de la Tab 4. Corre en el hilo del programador, fuera del camino de las sesiones,
+    con los mismos argumentos que un rerun con los filtros por defecto.
+    """
+    zonas = cargar_zonas(version) if version else None
+    periodo = periodo_de_zonas(zonas)[2] if zonas else None
+    df_base, col_map_base = cargar_datos(version, particiones_del_periodo(zonas, periodo) if zonas else None)
+    c_fecha = col_map_base.get('Fecha')
+    if df_base.empty or not c_fecha or c_fecha not in df_base.columns:
+        return
+    if periodo is None:
+        periodo = [df_base[c_fecha].min().date(), df_base[c_fecha].max().date()]
+    fechas = df_base.loc[construir_mascara(df_base, col_map_base, periodo, '(TODAS)', '(TODAS)').to_numpy(), c_fecha]
+    if not fechas.empty:
+        obtener_clima_ica(fechas.min(), fechas.max())
+    if col_map_base.get('Lote') and col_map_base.get('Rendimiento_Hora') and col_map_base.get('Dni'):
+        features_ia_del_periodo(version, periodo, '(TODAS)')
+    if col_map_base.get('Dni'):
+        cargar_historial_operarios(version)
+    df_qual = cargar_datos_calidad(version)[0]
+    if df_qual.empty:
+        return
+    cargar_dimensiones(version)
+    if 'Semana_Cruce' in df_qual.columns:
+        cargar_cruce_temporada(version, tuple(periodo), '(TODAS)')
+        cargar_cubo_defectos(version)
 
-    return pdf.output(dest='S').encode('latin-1', 'replace')
+# Refresco y pre-calentado en segundo plano (REFRESCO_INTERVALO; 0 o sin definir lo desactiva)
+iniciar_programador(calentar_caches)
 
 # --- CARGA INICIAL DE DATOS ---
-df, col_map = cargar_datos()
+version_datos = almacen_arrow.version_actual()  # None si no se usa el almacén
+zonas_maestra = cargar_zonas(version_datos) if version_datos else None
+particiones_cargadas = None
+if zonas_maestra:
+    # El periodo del rerun (el widget ya dejó su valor en session_state) decide qué meses leer
+    min_d, max_d, periodo_inicial = periodo_de_zonas(zonas_maestra)
+    particiones_cargadas = (particiones_del_periodo(zonas_maestra, st.session_state.get('periodo_select', periodo_inicial))
+                            or particiones_del_periodo(zonas_maestra, periodo_inicial))
+df_compartido, col_map_compartido = cargar_datos(version_datos, particiones_cargadas)
+df, col_map = vista(df_compartido), dict(col_map_compartido)
 
 # --- MAIN APP ---
 if df.empty:
     st.warning("⚠️ Sin datos. Verifica 'Data_Maestra_Limpia.xlsx'.")
 else:
-    tab1, tab2, tab3 = st.tabs(["📊 Análisis Productivo", "💰 Análisis Financiero & Pagos", "🔗 Cruce Calidad"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 Análisis Productivo", "💰 Análisis Financiero & Pagos", "🔗 Cruce Calidad",
+                                      "👷 Historial Operario"])
 
     with st.sidebar:
         try: st.image("logo.png", use_container_width=True)
@@ -656,26 +418,42 @@ else:
             st.write("**Columnas Detectadas:**")
             for key, val in col_map.items():
                 st.write(f"- {key}: {'✅ ' + val if val else '❌ None'}")
-            st.write(f"**Total filas cargadas**: {len(df)}")
+            st.write(f"**Total filas cargadas**: {len(df)}" + (
+                f" ({len(particiones_cargadas)}/{len(zonas_maestra['particiones'])} meses)" if zonas_maestra else ""))
+            st.write(f"**Versión de datos**: {version_datos or 'carga directa (sin almacén Arrow)'}")
+            # Se llena al final del script con la cascada de tiempos de este rerun
+            panel_perfil = st.empty()
         
         # FILTRO FECHA - Manejo robusto
         c_fecha = col_map.get('Fecha')
-        if not df.empty and c_fecha and c_fecha in df.columns:
+        if zonas_maestra:
+            # Rango y opciones salen del mapa de zonas, sin leer los meses fuera del periodo
+            date_range = st.date_input("Periodo:", periodo_inicial, key='periodo_select')
+            periodo_temporada = (min_d, max_d)
+            particiones_periodo = particiones_del_periodo(zonas_maestra, date_range)
+            if particiones_periodo != particiones_cargadas:
+                particiones_cargadas = particiones_periodo
+                df = vista(cargar_datos(version_datos, particiones_cargadas)[0])
+        elif not df.empty and c_fecha and c_fecha in df.columns:
             try:
                 min_d, max_d = df[c_fecha].min().date(), df[c_fecha].max().date()
                 date_range = st.date_input("Periodo:", [min_d, max_d])
+                periodo_temporada = (min_d, max_d)
             except Exception as e:
                 st.error(f"Error en filtro de fecha: {e}")
                 date_range = [datetime.now().date(), datetime.now().date()]
+                periodo_temporada = tuple(date_range)
         else:
             st.warning("⚠️ Columna Fecha no detectada")
             date_range = [datetime.now().date(), datetime.now().date()]
+            periodo_temporada = tuple(date_range)
         
         # FILTRO LABOR - Manejo robusto
         c_labor = col_map.get('Labor')
         if c_labor and c_labor in df.columns:
             try:
-                labores = ['(TODAS)'] + sorted(df[c_labor].dropna().astype(str).unique().tolist())
+                labores = ['(TODAS)'] + (almacen_arrow.valores_zonas(zonas_maestra, c_labor) if zonas_maestra
+                                         else sorted(df[c_labor].dropna().astype(str).unique().tolist()))
                 sel_labor = st.selectbox("Labor:", labores, key='labor_select')
             except Exception as e:
                 st.error(f"Error en filtro Labor: {e}")
@@ -688,7 +466,8 @@ else:
         c_variedad = col_map.get('Variedad')
         if c_variedad and c_variedad in df.columns:
             try:
-                variedades = ['(TODAS)'] + sorted(df[c_variedad].dropna().astype(str).unique().tolist())
+                variedades = ['(TODAS)'] + (almacen_arrow.valores_zonas(zonas_maestra, c_variedad) if zonas_maestra
+                                            else sorted(df[c_variedad].dropna().astype(str).unique().tolist()))
                 sel_variedad = st.selectbox("Variedad:", variedades, key='variedad_select')
             except Exception as e:
                 st.error(f"Error en filtro Variedad: {e}")
@@ -704,7 +483,8 @@ else:
         
         # Cargar datos de calidad CON manejo de errores
         try:
-            df_calidad, debug_calidad = cargar_datos_calidad()
+            df_calidad_compartido, debug_calidad = cargar_datos_calidad(version_datos)
+            df_calidad = vista(df_calidad_compartido)
         except Exception as e:
             st.error(f"Error cargando datos de calidad: {e}")
             df_calidad = pd.DataFrame()
@@ -736,25 +516,16 @@ else:
             st.write(f"Filas Calidad: {len(df_calidad)}")
             if not df_calidad.empty:
                 st.write(f"Columnas: {list(df_calidad.columns[:10])}...")
+                dim_lotes, dim_personas = cargar_dimensiones(version_datos)
+                st.write(f"Lotes: {len(dim_lotes)} | solo producción: {(~dim_lotes['En_Calidad']).sum()} | "
+                         f"solo calidad: {(~dim_lotes['En_Produccion']).sum()}")
+                st.write("Personas: " + " | ".join(f"{rol}: {len(valores)}" for rol, valores in dim_personas.items()))
 
     # Máscara de fecha robusta CON manejo de errores
     try:
-        if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
-            mask = (df[c_fecha].dt.date >= date_range[0]) & (df[c_fecha].dt.date <= date_range[1])
-        elif isinstance(date_range, list) and len(date_range) == 1:
-            mask = (df[c_fecha].dt.date == date_range[0])
-        else:
-            # Fallback: todos los datos
-            mask = pd.Series([True] * len(df), index=df.index)
-        
-        # Aplicar filtros adicionales de forma segura
-        if sel_labor != '(TODAS)' and c_labor and c_labor in df.columns:
-            mask = mask & (df[c_labor] == sel_labor)
-        
-        if sel_variedad != '(TODAS)' and c_variedad and c_variedad in df.columns:
-            mask = mask & (df[c_variedad].astype(str) == sel_variedad)
-        
-        df_f = df[mask].copy()
+        mask = construir_mascara(df, col_map, date_range, sel_labor, sel_variedad)
+        # Única copia por rerun: filas filtradas y columnas del col_map
+        df_f = proyectar_filtrado(df, col_map, mask)
         
         if df_f.empty:
             st.warning(f"⚠️ Sin datos para los filtros seleccionados. Labor: {sel_labor}, Variedad: {sel_variedad}")
@@ -777,35 +548,12 @@ else:
     c_operario = col_map.get('Operario')
     c_salario = col_map.get('Salario')
 
-    # Calcular Cumplimiento (Solución Robusta)
-    if 'Cumplimiento' not in df_f.columns and not df_f.empty:
-        # Validar que las columnas necesarias existan
-        c_r = col_map.get('Rendimiento_Hora')
-        c_m = col_map.get('Meta_Min')
-        
-        if c_r and c_m and c_r in df_f.columns and c_m in df_f.columns:
-            rend_vals = pd.to_numeric(df_f[c_r], errors='coerce').fillna(0)
-            meta_vals = pd.to_numeric(df_f[c_m], errors='coerce').fillna(0)
-            df_f['Cumplimiento'] = (rend_vals / meta_vals.replace(0, np.nan)) * 100
-            df_f['Cumplimiento'] = df_f['Cumplimiento'].fillna(0)
-        else:
-            df_f['Cumplimiento'] = 0.0
-
-    if not df_f.empty:
-        conditions = [(df_f['Cumplimiento'] >= 100), (df_f['Cumplimiento'] >= 85), (df_f['Cumplimiento'] < 85)]
-        df_f['Clasificacion_Calc'] = np.select(conditions, ['AR', 'MR', 'BR'], default='BR')
-
-    # LÓGICA FINANCIERA (DIRECTA)
-    # Ya no se cruza con export, se usa la columna Salario/Monto directa
+    # Cumplimiento, Clasificacion_Calc y Pago_Dia_Calc ya vienen de la carga; solo se completan si faltan
     if not df_f.empty:
-        # Si no hay columna Salario detectada, usar 62 por defecto
-        if c_salario:
-            df_f['Pago_Dia_Calc'] = df_f[c_salario]
-        else:
-            df_f['Pago_Dia_Calc'] = 62.0 # Fallback Jornal Base
+        agregar_columnas_calculadas(df_f, col_map)
         
-        # DataFrame para pestaña financiera (es el mismo filtrado)
-        df_fin = df_f.copy()
+        # DataFrame para pestaña financiera (es el mismo filtrado; vista sin copia)
+        df_fin = vista(df_f)
 
     # PESTAÑA 1 (PRODUCTIVO)
     with tab1:
@@ -815,24 +563,16 @@ else:
             st.markdown(f"<h3 style='color:black;'>Reporte Productivo: {sel_labor} ({sel_variedad})</h3>", unsafe_allow_html=True)
             
             # Construir agg_cols de forma segura (solo si las columnas existen)
-            agg_cols = {}
-            if c_rend_hr and c_rend_hr in df_f.columns: agg_cols[c_rend_hr] = 'mean'
-            if c_dni and c_dni in df_f.columns: agg_cols[c_dni] = 'nunique'
-            if c_rend_dia and c_rend_dia in df_f.columns: agg_cols[c_rend_dia] = 'sum'
-            if c_meta_min and c_meta_min in df_f.columns: agg_cols[c_meta_min] = 'mean'
-            if c_meta_max and c_meta_max in df_f.columns: agg_cols[c_meta_max] = 'mean'
+            agg_cols = columnas_agregacion_tab1(df_f, col_map)
             
             if not agg_cols:
                 st.error("No se encontraron columnas críticas para el análisis.")
                 st.stop()
             
             # CRÍTICO: Asegurar que todas las columnas a agregar sean numéricas
-            # Esto previene TypeError cuando hay valores no numéricos mezclados
-            for col in agg_cols.keys():
-                if col in df_f.columns:
-                    df_f[col] = pd.to_numeric(df_f[col], errors='coerce')
+            asegurar_numericas(df_f, [origen for origen, _ in agg_cols.values()])
             
-            df_trend = df_f.groupby(c_fecha).agg(agg_cols).reset_index().sort_values(c_fecha)
+            df_trend = calcular_tendencia_diaria(df_f, c_fecha, agg_cols)
             
             # Clima
             fecha_min, fecha_max = df_trend[c_fecha].min(), df_trend[c_fecha].max()
@@ -840,85 +580,88 @@ else:
             if not df_clima.empty:
                 df_trend = pd.merge(df_trend, df_clima, left_on=c_fecha, right_on='Fecha', how='left')
 
-            fig_main = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.06, row_heights=[0.5, 0.25, 0.25], specs=[[{"secondary_y": True}], [{"secondary_y": False}], [{"secondary_y": False}]], subplot_titles=("Prod. Real y Rendimiento", "Dotación Operarios", "Clima"))
-            fig_main.add_trace(go.Scatter(x=df_trend[c_fecha], y=df_trend[c_rend_hr], name='Rend/Hr', line=dict(color='#2E7D32', width=3)), row=1, col=1, secondary_y=False)
-            if c_meta_min: fig_main.add_trace(go.Scatter(x=df_trend[c_fecha], y=df_trend[c_meta_min], name='Meta Min', line=dict(color='#D32F2F', dash='dot')), row=1, col=1, secondary_y=False)
-            if c_meta_max and c_meta_max in df_trend.columns: fig_main.add_trace(go.Scatter(x=df_trend[c_fecha], y=df_trend[c_meta_max], name='Meta Max', line=dict(color='#FFD700', dash='dot')), row=1, col=1, secondary_y=False)
-            fig_main.add_trace(go.Scatter(x=df_trend[c_fecha], y=df_trend[c_rend_dia], name='Prod. Total', line=dict(color='#1565C0', width=2, dash='solid')), row=1, col=1, secondary_y=True)
-            fig_main.add_trace(go.Bar(x=df_trend[c_fecha], y=df_trend[c_dni], name='Operarios', marker_color='#1976D2'), row=2, col=1)
-            if 'Temp_Max_Ica' in df_trend.columns:
-                t_min, t_max = df_trend['Temp_Max_Ica'].min(), df_trend['Temp_Max_Ica'].max()
-                fig_main.add_trace(go.Scatter(x=df_trend[c_fecha], y=df_trend['Temp_Max_Ica'], name='Temp Max', line=dict(color='#F57C00', width=2), fill='none'), row=3, col=1)
-                fig_main.add_hline(y=30, line_dash="dot", line_color="red", row=3, col=1)
-                fig_main.update_yaxes(range=[t_min-0.5, t_max+0.5], row=3, col=1)
-            fig_main.update_layout(height=700, template="plotly_white", hovermode="x unified", margin=dict(t=30, b=10))
-            fig_main.update_annotations(font=dict(color="black")); st.plotly_chart(fig_main, use_container_width=True)
-
-            grp = df_f.groupby(c_lote)
-            df_lotes = grp.agg(Produccion_Total=(c_rend_dia, 'sum'), Operarios_Unicos=(c_dni, 'nunique'), Cumplimiento_Meta=('Cumplimiento', 'mean')).reset_index()
+            # Series largas: se reducen con LTTB para no enviar al navegador más puntos de los que se ven
+            max_puntos = PUNTOS_MAX_SERIE
+            if len(df_trend) > PUNTOS_MAX_SERIE:
+                if st.toggle("Serie completa (sin reducir)", key="serie_completa"):
+                    max_puntos = None
+                else:
+                    st.caption(f"Mostrando {PUNTOS_MAX_SERIE:,} de {len(df_trend):,} días por serie (LTTB: conserva picos y caídas). Active 'Serie completa' o acote el periodo para ver cada día.")
+            serie = series_reducidas(df_trend, c_fecha, [c for c in (c_rend_hr, c_meta_min, c_meta_max, c_rend_dia, c_dni, 'Temp_Max_Ica') if c], max_puntos)
+
+            Dispersion = clase_dispersion(len(serie[c_rend_hr]['x']))
+            with etapa("plotly:principal", len(df_trend)):
+                fig_main = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.06, row_heights=[0.5, 0.25, 0.25], specs=[[{"secondary_y": True}], [{"secondary_y": False}], [{"secondary_y": False}]], subplot_titles=("Prod. Real y Rendimiento", "Dotación Operarios", "Clima"))
+                fig_main.add_trace(Dispersion(**serie[c_rend_hr], name='Rend/Hr', line=dict(color='#2E7D32', width=3)), row=1, col=1, secondary_y=False)
+                if c_meta_min: fig_main.add_trace(Dispersion(**serie[c_meta_min], name='Meta Min', line=dict(color='#D32F2F', dash='dot')), row=1, col=1, secondary_y=False)
+                if c_meta_max and c_meta_max in df_trend.columns: fig_main.add_trace(Dispersion(**serie[c_meta_max], name='Meta Max', line=dict(color='#FFD700', dash='dot')), row=1, col=1, secondary_y=False)
+                fig_main.add_trace(Dispersion(**serie[c_rend_dia], name='Prod. Total', line=dict(color='#1565C0', width=2, dash='solid')), row=1, col=1, secondary_y=True)
+                fig_main.add_trace(go.Bar(**serie[c_dni], name='Operarios', marker_color='#1976D2'), row=2, col=1)
+                if 'Temp_Max_Ica' in df_trend.columns:
+                    t_min, t_max = df_trend['Temp_Max_Ica'].min(), df_trend['Temp_Max_Ica'].max()
+                    fig_main.add_trace(Dispersion(**serie['Temp_Max_Ica'], name='Temp Max', line=dict(color='#F57C00', width=2), fill='none'), row=3, col=1)
+                    fig_main.add_hline(y=30, line_dash="dot", line_color="red", row=3, col=1)
+                    fig_main.update_yaxes(range=[t_min-0.5, t_max+0.5], row=3, col=1)
+                fig_main.update_layout(height=700, template="plotly_white", hovermode="x unified", margin=dict(t=30, b=10))
+                fig_main.update_annotations(font=dict(color="black")); mostrar_figura(fig_main)
+
+            df_lotes = calcular_resumen_lotes(df_f, c_lote, c_rend_dia, c_dni)
             k1, k2, k3, k4 = st.columns(4)
             with k1: mostrar_kpi("Producción Total", f"{df_lotes['Produccion_Total'].sum():,.0f}", color_borde="#039BE5")
-            with k2: mostrar_kpi("Operarios Únicos", f"{df_f[c_dni].nunique()}", color_borde="#8E24AA")
+            with k2: mostrar_kpi("Operarios Únicos", f"{df_f[clave_persona(df_f, col_map, 'Dni')].nunique()}", color_borde="#8E24AA")
             cumpl = df_lotes['Cumplimiento_Meta'].mean()
             with k3: mostrar_kpi("Cumplimiento Global", f"{cumpl:.1f}%", delta="OK" if cumpl >= 100 else "-BAJO", color_borde="#43A047" if cumpl >= 100 else "#E53935")
             temp_txt = f"{df_trend['Temp_Max_Ica'].max():.1f}°C" if 'Temp_Max_Ica' in df_trend.columns else "N/A"
             with k4: mostrar_kpi("Pico Temperatura", temp_txt, color_borde="#FB8C00")
 
             c1, c2 = st.columns(2)
-            with c1:
+            # Gráficos por lote: los LOTES_MAX_GRAFICO de mayor producción y el resto en "Otros"
+            df_lotes_graf = top_n_con_otros(df_lotes, c_lote, 'Produccion_Total', {'Produccion_Total': 'sum', 'Cumplimiento_Meta': 'mean'})
+            with c1, etapa("plotly:cumplimiento_lote"):
                 st.subheader("📊 Cumplimiento por Lote")
-                colores_bar = ['#E53935' if x < 100 else '#43A047' for x in df_lotes['Cumplimiento_Meta']]
-                fig_bar = go.Figure(go.Bar(x=df_lotes[c_lote], y=df_lotes['Cumplimiento_Meta'], marker_color=colores_bar))
+                colores_bar = [COLOR_OTROS if str(l).startswith(ETIQUETA_OTROS) else '#E53935' if x < 100 else '#43A047' for l, x in zip(df_lotes_graf[c_lote], df_lotes_graf['Cumplimiento_Meta'])]
+                fig_bar = go.Figure(go.Bar(x=df_lotes_graf[c_lote], y=df_lotes_graf['Cumplimiento_Meta'], marker_color=colores_bar))
                 fig_bar.add_hline(y=100, line_dash="dash", line_color="black", annotation_text="Meta")
-                fig_bar.update_layout(template="plotly_white", height=350); st.plotly_chart(fig_bar, use_container_width=True)
-            with c2:
+                fig_bar.update_layout(template="plotly_white", height=350); mostrar_figura(fig_bar)
+            with c2, etapa("plotly:turnos"):
                 st.subheader("🌓 Comparativa Turnos")
                 if c_turno and df_f[c_turno].nunique() > 1:
                     df_turn = df_f.groupby(c_turno)[c_rend_hr].mean().reset_index()
                     fig_turn = px.bar(df_turn, x=c_turno, y=c_rend_hr, color=c_turno, title="Rendimiento Medio", color_discrete_sequence=['#FFB300', '#3949AB'])
-                    fig_turn.update_layout(template="plotly_white", height=350); st.plotly_chart(fig_turn, use_container_width=True)
+                    fig_turn.update_layout(template="plotly_white", height=350); mostrar_figura(fig_turn)
                 else: st.info("Data de turnos no disponible.")
             
             c3, c4 = st.columns(2)
-            with c3:
+            with c3, etapa("plotly:treemap_lotes"):
                 st.subheader("🔥 Mapa de Calor Lotes")
-                fig_tree = px.treemap(df_lotes, path=[c_lote], values='Produccion_Total', color='Cumplimiento_Meta', color_continuous_scale='RdYlGn', color_continuous_midpoint=100)
-                fig_tree.update_layout(template="plotly_white"); st.plotly_chart(fig_tree, use_container_width=True)
-            with c4:
+                fig_tree = px.treemap(df_lotes_graf, path=[c_lote], values='Produccion_Total', color='Cumplimiento_Meta', color_continuous_scale='RdYlGn', color_continuous_midpoint=100)
+                fig_tree.update_layout(template="plotly_white"); mostrar_figura(fig_tree)
+            with c4, etapa("plotly:pareto"):
                 st.subheader("📉 Pareto")
-                df_pareto = df_lotes.sort_values('Produccion_Total', ascending=False)
-                df_pareto['Acum'] = df_pareto['Produccion_Total'].cumsum()
-                df_pareto['Porcentaje_Acum'] = 100 * df_pareto['Acum'] / df_pareto['Produccion_Total'].sum()
+                df_pareto = calcular_pareto(df_lotes)
+                df_pareto_graf = top_n_con_otros(df_pareto, c_lote, 'Produccion_Total', {'Produccion_Total': 'sum', 'Acum': 'max', 'Porcentaje_Acum': 'max'})
                 fig_par = make_subplots(specs=[[{"secondary_y": True}]])
-                fig_par.add_trace(go.Bar(x=df_pareto[c_lote], y=df_pareto['Produccion_Total'], marker_color='#1976D2', name='Prod'), secondary_y=False)
-                fig_par.add_trace(go.Scatter(x=df_pareto[c_lote], y=df_pareto['Porcentaje_Acum'], marker_color='#D32F2F', name='%'), secondary_y=True)
-                fig_par.update_xaxes(type='category'); fig_par.update_layout(template="plotly_white"); st.plotly_chart(fig_par, use_container_width=True)
+                fig_par.add_trace(go.Bar(x=df_pareto_graf[c_lote], y=df_pareto_graf['Produccion_Total'], marker_color='#1976D2', name='Prod'), secondary_y=False)
+                fig_par.add_trace(go.Scatter(x=df_pareto_graf[c_lote], y=df_pareto_graf['Porcentaje_Acum'], marker_color='#D32F2F', name='%'), secondary_y=True)
+                fig_par.update_xaxes(type='category'); fig_par.update_layout(template="plotly_white"); mostrar_figura(fig_par)
 
             st.markdown("---")
             col_disp, col_ev = st.columns(2)
-            with col_disp:
+            with col_disp, etapa("plotly:dotacion"):
                 st.subheader("🔍 Eficiencia de Dotación")
-                fig_scat = px.scatter(df_lotes, x='Operarios_Unicos', y='Produccion_Total', size='Cumplimiento_Meta', color='Cumplimiento_Meta', color_continuous_scale='RdYlGn', hover_name=c_lote, text=c_lote)
-                fig_scat.update_traces(textposition='top center'); fig_scat.update_layout(template="plotly_white", height=400); st.plotly_chart(fig_scat, use_container_width=True)
-            with col_ev:
+                fig_scat = px.scatter(df_lotes, x='Operarios_Unicos', y='Produccion_Total', size='Cumplimiento_Meta', color='Cumplimiento_Meta', color_continuous_scale='RdYlGn', hover_name=c_lote, text=etiquetas_top_n(df_lotes, c_lote, 'Produccion_Total'))
+                fig_scat.update_traces(textposition='top center'); fig_scat.update_layout(template="plotly_white", height=400); mostrar_figura(fig_scat)
+            with col_ev, etapa("plotly:evolucion_calidad"):
                 st.subheader("📊 Evolución de Calidad")
-                df_ev = df_f.groupby([c_fecha, 'Clasificacion_Calc']).size().reset_index(name='Conteo')
-                df_totals = df_f.groupby(c_fecha).size().reset_index(name='Total')
-                df_ev = pd.merge(df_ev, df_totals, on=c_fecha)
-                df_ev['Pct'] = (df_ev['Conteo'] / df_ev['Total']) * 100
+                df_ev = calcular_evolucion_clasificacion(df_f, c_fecha)
                 fig_ev = px.area(df_ev, x=c_fecha, y='Pct', color='Clasificacion_Calc', color_discrete_map={'AR': '#43A047', 'MR': '#FFB300', 'BR': '#E53935'})
-                fig_ev.update_layout(template="plotly_white", yaxis_title="% Personal", height=400); st.plotly_chart(fig_ev, use_container_width=True)
+                fig_ev.update_layout(template="plotly_white", yaxis_title="% Personal", height=400); mostrar_figura(fig_ev)
 
             st.markdown("---"); st.subheader("📅 Patrones de Asistencia Semanal")
-            df_f['Dia_Semana'] = df_f[c_fecha].dt.day_name(); dias_map = {0:'Lunes',1:'Martes',2:'Miércoles',3:'Jueves',4:'Viernes',5:'Sábado',6:'Domingo'}
-            df_f['Dia_Num'] = df_f[c_fecha].dt.dayofweek; df_f['Dia_Nom'] = df_f['Dia_Num'].map(dias_map)
-            df_patron = df_f.groupby(['Dia_Nom', 'Clasificacion_Calc']).size().reset_index(name='Cant')
-            df_patron_total = df_f.groupby('Dia_Nom').size().reset_index(name='Total')
-            df_patron = pd.merge(df_patron, df_patron_total, on='Dia_Nom')
-            df_patron['Pct'] = (df_patron['Cant'] / df_patron['Total']) * 100
-            dias_orden = ['Lunes','Martes','Miércoles','Jueves','Viernes','Sábado','Domingo']
-            fig_hm = px.density_heatmap(df_patron, x='Dia_Nom', y='Clasificacion_Calc', z='Pct', title="Concentración (%) por Día", color_continuous_scale='RdYlGn', category_orders={"Dia_Nom": dias_orden, "Clasificacion_Calc": ["BR", "MR", "AR"]}, text_auto='.0f')
-            fig_hm.update_layout(template="plotly_white", height=400); st.plotly_chart(fig_hm, use_container_width=True)
+            df_patron = calcular_patron_semanal(df_f, c_fecha)
+            with etapa("plotly:patron_semanal"):
+                fig_hm = px.density_heatmap(df_patron, x='Dia_Nom', y='Clasificacion_Calc', z='Pct', title="Concentración (%) por Día", color_continuous_scale='RdYlGn', category_orders={"Dia_Nom": DIAS_ORDEN, "Clasificacion_Calc": ["BR", "MR", "AR"]}, text_auto='.0f')
+                fig_hm.update_layout(template="plotly_white", height=400); mostrar_figura(fig_hm)
 
     # PESTAÑA 2 (FINANCIERA)
     with tab2:
@@ -939,77 +682,72 @@ else:
             # 1. GRÁFICO DISPERSIÓN POR LOTE (Financiera)
             st.subheader("🚨 Eficiencia Financiera por Lote")
             
-            df_fin_lote = df_fin.groupby(c_lote).agg({
-                'Pago_Dia_Calc': 'sum', 
-                c_rend_dia: 'sum', 
-                c_dni: 'nunique'
-            }).reset_index()
-            
-            df_fin_lote['Costo_Unitario'] = df_fin_lote['Pago_Dia_Calc'] / df_fin_lote[c_rend_dia]
-
-            fig_bubble_lote = px.scatter(
-                df_fin_lote, 
-                x=c_rend_dia, 
-                y='Pago_Dia_Calc',
-                size='Costo_Unitario', 
-                color='Costo_Unitario',
-                hover_name=c_lote,
-                text=c_lote,
-                color_continuous_scale='RdYlGn_r',
-                title="Gasto Total vs Producción Total (Tamaño = Costo Unitario)"
-            )
-            fig_bubble_lote.update_traces(textposition='top center')
-            fig_bubble_lote.update_layout(template="plotly_white", height=500, xaxis_title="Producción Total (Unidades)", yaxis_title="Gasto Planilla Total (S/)")
-            st.plotly_chart(fig_bubble_lote, use_container_width=True)
+            df_fin_lote = calcular_financiero_lotes(df_fin, c_lote, c_rend_dia, c_dni)
+
+            with etapa("plotly:financiero_lotes", len(df_fin_lote)):
+                fig_bubble_lote = px.scatter(
+                    df_fin_lote, 
+                    x=c_rend_dia, 
+                    y='Pago_Dia_Calc',
+                    size='Costo_Unitario', 
+                    color='Costo_Unitario',
+                    hover_name=c_lote,
+                    text=etiquetas_top_n(df_fin_lote, c_lote, 'Costo_Unitario'),
+                    color_continuous_scale='RdYlGn_r',
+                    title="Gasto Total vs Producción Total (Tamaño = Costo Unitario)"
+                )
+                fig_bubble_lote.update_traces(textposition='top center')
+                fig_bubble_lote.update_layout(template="plotly_white", height=500, xaxis_title="Producción Total (Unidades)", yaxis_title="Gasto Planilla Total (S/)")
+                mostrar_figura(fig_bubble_lote)
 
             # 2. COMPARATIVA COSTO PROMEDIO DIARIO (AR vs BR)
             st.subheader("💸 Costo Promedio Diario por Clasificación")
             
             # --- FILTRO POR TURNO ---
-            df_fin_costo = df_fin.copy()
+            df_fin_costo = df_fin
             if c_turno and c_turno in df_fin.columns:
                 turnos_disponibles = ['(TODOS)'] + sorted(df_fin[c_turno].dropna().unique().tolist())
                 sel_turno_fin = st.selectbox("Filtrar por Turno (Gráfico de Costos):", turnos_disponibles, index=0)
                 if sel_turno_fin != '(TODOS)':
                     df_fin_costo = df_fin[df_fin[c_turno] == sel_turno_fin]
             
-            df_costo_clasif = df_fin_costo.groupby('Clasificacion_Calc')['Pago_Dia_Calc'].mean().reset_index()
+            df_costo_clasif = calcular_costo_clasificacion(df_fin_costo)
             
-            fig_bar_costo = px.bar(
-                df_costo_clasif, 
-                x='Clasificacion_Calc', 
-                y='Pago_Dia_Calc',
-                color='Clasificacion_Calc',
-                color_discrete_map={'AR': '#43A047', 'MR': '#FFB300', 'BR': '#E53935'},
-                title=f"Pago Promedio Diario ({sel_turno_fin if 'sel_turno_fin' in locals() else 'General'}) (S/)",
-                text_auto='.1f'
-            )
-            fig_bar_costo.update_layout(template="plotly_white", height=400, yaxis_title="Pago Promedio (S/)")
-            st.plotly_chart(fig_bar_costo, use_container_width=True)
+            with etapa("plotly:costo_clasificacion"):
+                fig_bar_costo = px.bar(
+                    df_costo_clasif, 
+                    x='Clasificacion_Calc', 
+                    y='Pago_Dia_Calc',
+                    color='Clasificacion_Calc',
+                    color_discrete_map={'AR': '#43A047', 'MR': '#FFB300', 'BR': '#E53935'},
+                    title=f"Pago Promedio Diario ({sel_turno_fin if 'sel_turno_fin' in locals() else 'General'}) (S/)",
+                    text_auto='.1f'
+                )
+                fig_bar_costo.update_layout(template="plotly_white", height=400, yaxis_title="Pago Promedio (S/)")
+                mostrar_figura(fig_bar_costo)
 
             # 3. TENDENCIA DE COSTOS
             st.subheader("📉 Evolución del Gasto de Planilla")
-            df_fin_trend = df_fin.groupby(c_fecha).agg({
-                'Pago_Dia_Calc': 'sum',
-                c_rend_dia: 'sum'
-            }).reset_index().sort_values(c_fecha)
-
-            fig_cost = make_subplots(specs=[[{"secondary_y": True}]])
-            fig_cost.add_trace(go.Bar(x=df_fin_trend[c_fecha], y=df_fin_trend['Pago_Dia_Calc'], name='Gasto Total (S/)', marker_color='#FFB74D'), secondary_y=False)
-            fig_cost.add_trace(go.Scatter(x=df_fin_trend[c_fecha], y=df_fin_trend[c_rend_dia], name='Producción Total', line=dict(color='#1565C0', width=2)), secondary_y=True)
-            fig_cost.update_yaxes(title_text="Soles (S/)", secondary_y=False)
-            fig_cost.update_yaxes(title_text="Unidades", secondary_y=True)
-            fig_cost.update_layout(template="plotly_white", height=450, title="Gasto Diario vs Producción")
-            st.plotly_chart(fig_cost, use_container_width=True)
+            df_fin_trend = calcular_tendencia_financiera(df_fin, c_fecha, c_rend_dia)
+
+            with etapa("plotly:tendencia_gasto", len(df_fin_trend)):
+                fig_cost = make_subplots(specs=[[{"secondary_y": True}]])
+                fig_cost.add_trace(go.Bar(x=df_fin_trend[c_fecha], y=df_fin_trend['Pago_Dia_Calc'], name='Gasto Total (S/)', marker_color='#FFB74D'), secondary_y=False)
+                fig_cost.add_trace(clase_dispersion(len(df_fin_trend))(x=df_fin_trend[c_fecha], y=df_fin_trend[c_rend_dia], name='Producción Total', line=dict(color='#1565C0', width=2)), secondary_y=True)
+                fig_cost.update_yaxes(title_text="Soles (S/)", secondary_y=False)
+                fig_cost.update_yaxes(title_text="Unidades", secondary_y=True)
+                fig_cost.update_layout(template="plotly_white", height=450, title="Gasto Diario vs Producción")
+                mostrar_figura(fig_cost)
 
             # 4. TABLA DE DESVIACIONES
             st.subheader("📋 Top Lotes con Mayor Costo Unitario")
             df_fin_lote_sorted = df_fin_lote.sort_values('Costo_Unitario', ascending=False).head(10)
-            st.dataframe(df_fin_lote_sorted.style.format({
-                'Pago_Dia_Calc': 'S/ {:,.2f}',
-                c_rend_dia: '{:,.0f}',
-                'Costo_Unitario': 'S/ {:.4f}'
-            }).background_gradient(subset=['Costo_Unitario'], cmap='Reds'), use_container_width=True)
+            with etapa("styler:top_costo_unitario"):
+                st.dataframe(df_fin_lote_sorted.style.format({
+                    'Pago_Dia_Calc': 'S/ {:,.2f}',
+                    c_rend_dia: '{:,.0f}',
+                    'Costo_Unitario': 'S/ {:.4f}'
+                }).background_gradient(subset=['Costo_Unitario'], cmap='Reds'), use_container_width=True)
 
     # ==============================================================================
     # TAB 3: CRUCE CALIDAD (MÓDULO MEJORADO CON COLORIMETRÍA DINÁMICA)
@@ -1062,52 +800,30 @@ else:
             # Para el cruce, ignoramos el filtro de labor del sidebar para centrarnos en 'COSECHA'
             # que es el labor que tiene data de calidad, tal como funcionaba originalmente.
             
-            # Validación de rango de fechas (evita IndexError si el usuario solo selecciona una fecha)
-            if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
-                mask_prod_cruce = (df[c_fecha].dt.date >= date_range[0]) & (df[c_fecha].dt.date <= date_range[1])
-            else:
-                mask_prod_cruce = (df[c_fecha].dt.date >= date_range[0])
-                
-            if sel_variedad != '(TODAS)' and c_variedad:
-                mask_prod_cruce = mask_prod_cruce & (df[c_variedad].astype(str) == sel_variedad)
-            
-            df_f_cruce = df[mask_prod_cruce].copy()
+            # Periodo + variedad del sidebar, SOLO labor exacta: "COSECHA Y LIMPIEZA DE RACIMOS"
+            total_sin_labor, labores_disponibles = resumir_produccion_cruce(df, col_map, date_range, sel_variedad)
+            # Cruce de toda la temporada (recorte de la producción ya preparada), una vez por versión y filtros
+            cruce_temporada = cargar_cruce_temporada(version_datos, tuple(date_range), sel_variedad)
             
             # DEBUG: Mostrar totales ANTES de filtrar por labor
-            st.caption(f"🔍 DEBUG - Total registros producción (sin filtro labor): {len(df_f_cruce):,}")
+            st.caption(f"🔍 DEBUG - Total registros producción (sin filtro labor): {total_sin_labor:,}")
             
-            # Filtrar SOLO por labor exacta: "COSECHA Y LIMPIEZA DE RACIMOS"
-            labor_exacta = "COSECHA Y LIMPIEZA DE RACIMOS"
-            if c_labor and c_labor in df_f_cruce.columns:
-                # Buscar la labor exacta O variaciones con mayúsculas/minúsculas
-                labores_disponibles = df_f_cruce[c_labor].dropna().unique()
-                st.caption(f"🔍 Buscando labor exacta: '{labor_exacta}'")
-                
-                # Match exacto (case-insensitive)
-                df_f_cruce = df_f_cruce[
-                    df_f_cruce[c_labor].str.upper().str.strip() == labor_exacta.upper()
-                ]
-                
-                if df_f_cruce.empty:
-                    st.error(f"❌ No se encontró la labor '{labor_exacta}'. Labores disponibles: {', '.join(map(str, labores_disponibles[:10]))}")
+            if c_labor and c_labor in df.columns:
+                st.caption(f"🔍 Buscando labor exacta: '{LABOR_CRUCE}'")
+                if cruce_temporada['filas_produccion_total'] == 0:
+                    st.error(f"❌ No se encontró la labor '{LABOR_CRUCE}'. Labores disponibles: {', '.join(map(str, labores_disponibles[:10]))}")
                 else:
-                    st.caption(f"✅ Filtrando por '{labor_exacta}': {len(df_f_cruce):,} registros")
-            
-            # Asegurar numérico
-            for col in [c_rend_hr, c_meta_min]:
-                if col and col in df_f_cruce.columns:
-                    df_f_cruce[col] = pd.to_numeric(df_f_cruce[col], errors='coerce').fillna(0)
-            
-            # Preparar producción SIN calcular semana
-            df_p_cruce = preparar_produccion_cruce(df_f_cruce, c_fecha, c_lote, c_rend_hr, c_meta_min)
+                    st.caption(f"✅ Filtrando por '{LABOR_CRUCE}': {cruce_temporada['filas_produccion_total']:,} registros")
             
-            # Calcular merged usando fechas de calidad, no semanas
-            merged, df_p_sem, df_q_sem = calcular_merged_data(df_p_cruce, df_calidad, sel_semana_cruce, ratio_calidad)
+            # Semana seleccionada: lectura del cruce de temporada (cruce por fechas de calidad, no semanas)
+            with CRUCE_DURACION.medir():
+                merged, filas_p_sem, df_q_sem = cruce_de_semana(cruce_temporada, df_calidad, sel_semana_cruce, ratio_calidad)
+            CRUCE_FILAS.set(len(merged))
             
             # DEBUG detallado
-            st.caption(f"📊 Resultados: Producción={len(df_p_sem):,} | Calidad={len(df_q_sem):,} | Cruzados={len(merged):,}")
+            st.caption(f"📊 Resultados: Producción={filas_p_sem:,} | Calidad={len(df_q_sem):,} | Cruzados={len(merged):,}")
             
-            if df_p_sem.empty or df_q_sem.empty:
+            if filas_p_sem == 0 or df_q_sem.empty:
                 st.warning(f"⚠️ No hay datos suficientes para la Semana {sel_semana_cruce}.")
             elif merged.empty:
                 st.error("❌ No se encontraron coincidencias entre Producción y Calidad (Lote + Fecha).")
@@ -1206,8 +922,8 @@ else:
                 )
                 nivel_api = 'categoria' if nivel_detalle.startswith('Categor') else 'detalle'
                 
-                # Usar función cacheada para tendencia de defectos
-                defects_trend = calcular_defects_trend(df_q_sem, filtro_asist_evol, filtro_lote_evol, nivel=nivel_api)
+                # Tendencia de defectos: recorte del cubo de la semana (construido una vez por versión)
+                defects_trend = calcular_defects_trend(cargar_cubo_defectos(version_datos).get(sel_semana_cruce), filtro_asist_evol, filtro_lote_evol, nivel=nivel_api)
                 
                 if not defects_trend.empty:
                     # Contar fechas únicas para ajustar ancho
@@ -1268,6 +984,42 @@ else:
                 with col_dev2:
                     st.altair_chart(create_combo_chart(bottom_5_eff, "⚠️ Bottom 5 Rendimiento", '#F44336', "ascending"), use_container_width=True)
                 
+                # --- FILA 4: TENDENCIA MULTI-SEMANA (desde el cruce de temporada) ---
+                st.markdown("---")
+                st.subheader("📆 Tendencia Semana a Semana")
+                col_tend1, col_tend2 = st.columns(2)
+                with col_tend1:
+                    dim_tendencia = st.radio("Comparar por:", ['Asistente', 'Lote'], horizontal=True, key='dim_tendencia')
+                with col_tend2:
+                    sel_metrica = st.radio("Métrica:", ['Eficiencia (Score)', 'Rendimiento', 'Calidad'], horizontal=True, key='metrica_tendencia')
+                    metrica_tendencia = {'Eficiencia (Score)': 'Score', 'Rendimiento': 'Eficiencia', 'Calidad': 'Calidad_Calc'}[sel_metrica]
+                df_tendencia = tendencia_cruce(cruce_temporada, dim_tendencia, ratio_calidad)
+                if df_tendencia.empty:
+                    st.info("No hay semanas cruzadas para comparar.")
+                else:
+                    col_etiqueta = 'Asistente' if dim_tendencia == 'Asistente' else 'Lote_Cruce'
+                    etiquetas_tendencia = sorted(df_tendencia['Etiqueta'].unique().tolist())
+                    sel_tendencia = st.multiselect(
+                        f"{dim_tendencia}s a comparar:", etiquetas_tendencia,
+                        default=sorted(merged[col_etiqueta].unique().tolist())[:8], key=f'sel_tendencia_{dim_tendencia}'
+                    )
+                    df_tend_sel = df_tendencia[df_tendencia['Etiqueta'].isin(sel_tendencia)]
+                    if df_tend_sel.empty:
+                        st.info(f"Seleccione al menos un {dim_tendencia.lower()}.")
+                    else:
+                        chart_tendencia = alt.Chart(df_tend_sel).mark_line(point=True).encode(
+                            x=alt.X('Semana_Cruce:O', title='Semana'),
+                            y=alt.Y(f'{metrica_tendencia}:Q', title=sel_metrica, axis=alt.Axis(format='%')),
+                            color=alt.Color('Etiqueta:N', title=dim_tendencia),
+                            tooltip=['Semana_Cruce', 'Etiqueta', alt.Tooltip(f'{metrica_tendencia}:Q', format='.1%'), 'Registros']
+                        ).properties(height=320)
+                        st.altair_chart(chart_tendencia, use_container_width=True)
+                        st.dataframe(
+                            df_tend_sel.pivot(index='Etiqueta', columns='Semana_Cruce', values=metrica_tendencia)
+                            .style.format("{:.1%}", na_rep=""),
+                            use_container_width=True
+                        )
+
                 # --- EXPLORADOR DETALLADO CON VISTA ASISTENTE/LOTE ---
                 st.markdown("---")
                 st.header("🔍 Explorador Detallado")
@@ -1288,7 +1040,8 @@ else:
                     filtro_lote = st.selectbox(
                         "🏷️ Filtrar por Lote:",
                         lotes_disponibles,
-                        index=lotes_disponibles.index(st.session_state.tab3_cache['filtro_lote']) if st.session_state.tab3_cache['filtro_lote'] in lotes_disponibles else 0
+                        index=lotes_disponibles.index(st.session_state.tab3_cache['filtro_lote']) if st.session_state.tab3_cache['filtro_lote'] in lotes_disponibles else 0,
+                        key='filtro_lote_select'
                     )
                     st.session_state.tab3_cache['filtro_lote'] = filtro_lote
                 
@@ -1317,27 +1070,20 @@ else:
                     pivot_score_raw = calcular_pivot_score(merged, index_col, filtro_lote, ratio_calidad)
                     
                     if not pivot_score_raw.empty:
-                        pivot_score = pivot_score_raw.copy()
-                        
-                        # Formatear columnas de fecha
-                        new_cols = [c.strftime('%d-%m') if hasattr(c, 'strftime') else str(c) for c in pivot_score.columns]
-                        pivot_score.columns = new_cols
-                        
-                        # 2. Variable con promedios
-                        promedios_col = pivot_score.mean(axis=0)
-                        promedios_col.name = 'PROMEDIO'
-                        pivot_score_con_prom = pd.concat([pivot_score, promedios_col.to_frame().T])
+                        # 2. Columnas de fecha formateadas + fila de promedios
+                        pivot_score_con_prom = formatear_pivot_score(pivot_score_raw)
                         
                         # ⚠️ IMPORTANTE: ELIMINAMOS .fillna('') AQUÍ
                         # pivot_score_con_prom = pivot_score_con_prom.fillna('') 
                         
                         # 3. Mostramos la tabla usando na_rep para los vacíos
-                        st.dataframe(
-                            pivot_score_con_prom.style
-                            .format("{:.1%}", na_rep="")      # na_rep="" muestra vacío sin romper el número
-                            .applymap(style_score_dinamico),  # Aplica colores
-                            use_container_width=True
-                        )
+                        with etapa("styler:pivot_score", len(pivot_score_con_prom)):
+                            st.dataframe(
+                                pivot_score_con_prom.style
+                                .format("{:.1%}", na_rep="")      # na_rep="" muestra vacío sin romper el número
+                                .applymap(style_score_dinamico),  # Aplica colores
+                                use_container_width=True
+                            )
                     else:
                         st.info("No hay datos para calcular la Eficiencia.")       
 
@@ -1350,27 +1096,9 @@ else:
                     pivot_gen_raw, fechas = calcular_pivot_metricas(merged, index_col, filtro_lote)
                     
                     if not pivot_gen_raw.empty and fechas:
-                        # Hacer copia para no modificar objeto cacheado
-                        pivot_gen = pivot_gen_raw.copy()
-                        frames_gen = []
-                        
-                        for f in fechas:
-                            f_str = f.strftime('%d-%m')
-                            try:
-                                eff_day = pivot_gen['Eficiencia'][f]
-                                qual_day = pivot_gen['Calidad_Calc'][f]
-                                eff_fmt = eff_day.apply(lambda x: format_with_icon(x, is_efficiency=True) if pd.notna(x) else "-")
-                                qual_fmt = qual_day.apply(lambda x: format_with_icon(x, is_quality=True) if pd.notna(x) else "-")
-                                frames_gen.append(eff_fmt.rename(f"{f_str} Rend"))
-                                frames_gen.append(qual_fmt.rename(f"{f_str} Cal"))
-                            except KeyError: continue
-                        
-                        if frames_gen:
-                            df_general_view = pd.concat(frames_gen, axis=1).fillna("-")
-                            # Agregar columna promedio
-                            df_general_view['PROM Rend'] = merged_filtrado.groupby(index_col)['Eficiencia'].mean().apply(lambda x: format_with_icon(x, is_efficiency=True) if pd.notna(x) else "-")
-                            df_general_view['PROM Cal'] = merged_filtrado.groupby(index_col)['Calidad_Calc'].mean().apply(lambda x: format_with_icon(x, is_quality=True) if pd.notna(x) else "-")
-                            st.dataframe(df_general_view.fillna("-"), use_container_width=True)
+                        df_general_view = construir_vista_metricas(pivot_gen_raw, fechas, merged_filtrado, index_col)
+                        if not df_general_view.empty:
+                            st.dataframe(df_general_view, use_container_width=True)
                 
                 # --- SELECTOR DE ASISTENTE/LOTE PARA DETALLE ---
                 st.divider()
@@ -1387,44 +1115,102 @@ else:
                     titulo_detalle = f"Lote {sel_detalle}"
                 
                 if subset_detalle is not None and not subset_detalle.empty:
-                    if vista_tabla == 'Asistente':
-                        detail_table = subset_detalle.groupby(['Fecha_Cruce', 'Lote_Cruce', 'Variedad']).agg({
-                            'Eficiencia': 'mean', 'Calidad_Tabla': 'mean', 'Score': 'mean', 'Jabas': 'sum'
-                        }).reset_index()
-                    else:
-                        detail_table = subset_detalle.groupby(['Fecha_Cruce', 'Asistente', 'Variedad']).agg({
-                            'Eficiencia': 'mean', 'Calidad_Tabla': 'mean', 'Score': 'mean', 'Jabas': 'sum'
-                        }).reset_index()
-                    
-                    detail_table['Fecha'] = detail_table['Fecha_Cruce'].dt.strftime('%Y-%m-%d')
+                    # Historial agrupado + fila de PROMEDIO
+                    detail_table_con_prom = construir_tabla_detalle(subset_detalle, vista_tabla)
                     
                     st.write(f"**📋 Historial de Trabajos - {titulo_detalle}**")
                     st.caption("Leyenda: ✅ Meta cumplida / Calidad óptima. 🚩 Por debajo.")
                     
-                    cols_mostrar = ['Fecha', 'Lote_Cruce' if vista_tabla == 'Asistente' else 'Asistente', 'Variedad', 'Jabas', 'Eficiencia', 'Calidad_Tabla', 'Score']
-                    
-                    # Agregar fila de PROMEDIO
-                    prom_row = {
-                        'Fecha': 'PROMEDIO',
-                        'Lote_Cruce' if vista_tabla == 'Asistente' else 'Asistente': '-',
-                        'Variedad': '-',
-                        'Jabas': detail_table['Jabas'].mean(),
-                        'Eficiencia': detail_table['Eficiencia'].mean(),
-                        'Calidad_Tabla': detail_table['Calidad_Tabla'].mean(),
-                        'Score': detail_table['Score'].mean()
-                    }
-                    detail_table_con_prom = pd.concat([detail_table[cols_mostrar], pd.DataFrame([prom_row])], ignore_index=True)
-                    
-                    st.dataframe(
-                        detail_table_con_prom.style.format({
-                            'Jabas': '{:,.0f}',
-                            'Eficiencia': '{:.1%}',
-                            'Calidad_Tabla': '{:.1%}',
-                            'Score': '{:.2f}'
-                        }).applymap(style_score_dinamico, subset=['Score']),
-                        use_container_width=True,
-                        hide_index=True
-                    )
+                    with etapa("styler:detalle", len(detail_table_con_prom)):
+                        st.dataframe(
+                            detail_table_con_prom.style.format({
+                                'Jabas': '{:,.0f}',
+                                'Eficiencia': '{:.1%}',
+                                'Calidad_Tabla': '{:.1%}',
+                                'Score': '{:.2f}'
+                            }).applymap(style_score_dinamico, subset=['Score']),
+                            use_container_width=True,
+                            hide_index=True
+                        )
+
+                # --- EXPORTAR TABLAS A EXCEL (write-only, colores como reglas de la hoja) ---
+                if EXCEL_AVAILABLE:
+                    st.divider()
+                    col_exp1, col_exp2 = st.columns([2, 1])
+                    with col_exp1:
+                        alcance_excel = st.radio("📥 Exportar tablas a Excel:", [f"Semana {sel_semana_cruce}", "Toda la temporada"],
+                                                 horizontal=True, key='alcance_excel')
+                    if col_exp2.button("Generar Excel", key='generar_excel_cruce'):
+                        if alcance_excel == "Toda la temporada":
+                            # La temporada completa no se recorta al periodo del sidebar (solo a la variedad).
+                            # Generador: cada semana se cruza, se escribe y se descarta
+                            cruce_excel = cargar_cruce_temporada(version_datos, periodo_temporada, sel_variedad)
+                            semanas_excel = ((s, cruce_de_semana(cruce_excel, df_calidad, s, ratio_calidad)[0])
+                                             for s in sorted(cruce_excel['semanas']))
+                        else:
+                            semanas_excel = [(sel_semana_cruce, merged)]
+                        with tempfile.TemporaryDirectory() as carpeta_excel:
+                            ruta_excel = os.path.join(carpeta_excel, 'cruce_calidad.xlsx')
+                            resumen_excel = exportar_tablas_cruce(semanas_excel, ruta_excel, vista_tabla, filtro_lote,
+                                                                  ratio_calidad, umbral_rojo, umbral_ambar)
+                            with open(ruta_excel, 'rb') as archivo_excel:
+                                st.download_button("Descargar Excel (.xlsx)", archivo_excel, f"Cruce_Calidad_{vista_tabla}.xlsx",
+                                                   "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                        st.caption(f"{len(resumen_excel['semanas'])} semana(s): {resumen_excel['filas_historial']:,} filas de historial")
+
+    # ==============================================================================
+    # TAB 4: HISTORIAL POR OPERARIO (toda la temporada, sin los filtros del sidebar)
+    # ==============================================================================
+    with tab4:
+        if not c_dni:
+            st.warning("No se detectó la columna DNI: el historial por operario no está disponible.")
+        else:
+            st.markdown("<h3 style='color:black;'>Historial de Temporada por Operario</h3>", unsafe_allow_html=True)
+            texto_operario = st.text_input("Buscar operario (DNI o parte del DNI o del nombre):", key='buscar_operario')
+            if texto_operario.strip():
+                historial_op, resumen_op = cargar_historial_operarios(version_datos)
+                encontrados = buscar_operarios(resumen_op, texto_operario)
+                if encontrados.empty:
+                    st.info(f"Sin operarios que coincidan con '{texto_operario.strip()}'.")
+                else:
+                    codigo_op = encontrados.index[0]
+                    if len(encontrados) > 1:
+                        nombres_op = encontrados['Operario'] if 'Operario' in encontrados.columns else encontrados['DNI']
+                        codigos_op = dict(zip(encontrados['DNI'] + " - " + nombres_op, encontrados.index))
+                        codigo_op = codigos_op[st.selectbox(f"{len(encontrados)} coincidencias (las de más días trabajados primero):",
+                                                            list(codigos_op), key='sel_operario')]
+                    ficha_op = resumen_op.loc[codigo_op]
+                    filas_op = historial_de_operario(historial_op, resumen_op, codigo_op)
+
+                    st.caption(f"DNI {ficha_op['DNI']} · {ficha_op.get('Operario', '')} · "
+                               f"{ficha_op['Primera_Fecha']:%d/%m/%Y} a {ficha_op['Ultima_Fecha']:%d/%m/%Y} · "
+                               f"{ficha_op['Registros']:,} registros en {ficha_op.get('Lotes', 0):,} lotes")
+                    o1, o2, o3, o4, o5 = st.columns(5)
+                    with o1: mostrar_kpi("Rend/Hr Promedio", f"{ficha_op.get('Rend_Hr_Medio', 0):.2f}", color_borde="#2E7D32")
+                    with o2: mostrar_kpi("Cumplimiento Promedio", f"{ficha_op.get('Cumplimiento_Medio', 0):.1f}%",
+                                         delta="OK" if ficha_op.get('Cumplimiento_Medio', 0) >= 100 else "-Bajo meta", color_borde="#1565C0")
+                    with o3: mostrar_kpi("Días Trabajados", f"{ficha_op['Dias_Trabajados']:,}", color_borde="#6A1B9A")
+                    with o4: mostrar_kpi("Pago Temporada", f"S/ {ficha_op.get('Pago_Total', 0):,.0f}", color_borde="#FF9800")
+                    with o5: mostrar_kpi("Mix AR / MR / BR", " / ".join(f"{ficha_op.get(f'Pct_{c}', 0):.0%}" for c in CLASES_RENDIMIENTO),
+                                         color_borde="#009688")
+
+                    df_semanas_op = evolucion_semanal_operario(filas_op)
+                    with etapa("plotly:historial_operario", len(df_semanas_op)):
+                        fig_op = make_subplots(specs=[[{"secondary_y": True}]])
+                        fig_op.add_trace(go.Bar(x=df_semanas_op['Semana'], y=df_semanas_op['Dias_Trabajados'], name='Días trabajados', marker_color='#B0BEC5'), secondary_y=True)
+                        if 'Cumplimiento' in df_semanas_op.columns:
+                            fig_op.add_trace(go.Scatter(x=df_semanas_op['Semana'], y=df_semanas_op['Cumplimiento'], name='Cumplimiento (%)', mode='lines+markers', line=dict(color='#1565C0', width=3)), secondary_y=False)
+                            fig_op.add_hline(y=100, line_dash='dot', line_color='#D32F2F')
+                        fig_op.update_yaxes(title_text="Cumplimiento (%)", secondary_y=False)
+                        fig_op.update_yaxes(title_text="Días", secondary_y=True, showgrid=False)
+                        fig_op.update_layout(template="plotly_white", height=400, title="Evolución Semanal del Operario")
+                        mostrar_figura(fig_op)
+
+                    st.subheader("📋 Registros de la Temporada")
+                    st.dataframe(filas_op.drop(columns='Dni_Key'), use_container_width=True, hide_index=True,
+                                 column_config={'Fecha': st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
+                                                'Cumplimiento': st.column_config.NumberColumn(format="%.1f%%"),
+                                                'Pago_Dia_Calc': st.column_config.NumberColumn("Pago (S/)", format="%.2f")})
 
     # --- BOTÓN PDF GLOBAL ---
     st.markdown("---")
@@ -1453,12 +1239,42 @@ else:
 
         df_turn_pdf = df_f.groupby(c_turno)[c_rend_hr].mean().reset_index() if c_turno and df_f[c_turno].nunique() > 1 else None
         
-        pdf_bytes = crear_pdf_completo(df_lotes, txt_concl, df_pareto, df_turn_pdf, df_lotes, df_ev, sel_labor, insight_asist, df_patron, df_trend, col_map, df_fin_lote_resumen)
+        try:
+            with PDF_DURACION.medir():
+                pdf_bytes = crear_pdf_completo(df_lotes, txt_concl, df_pareto, df_turn_pdf, df_lotes, df_ev, sel_labor, insight_asist, df_patron, df_trend, col_map, df_fin_lote_resumen)
+        except Exception:
+            PDF_GENERADOS.inc(resultado="error")
+            raise
+        PDF_GENERADOS.inc(resultado="ok")
+        PDF_BYTES.set(len(pdf_bytes))
         st.download_button("📥 Descargar PDF Inteligente", pdf_bytes, f"Reporte_{sel_labor}.pdf", "application/pdf")
         st.success("Reporte generado con Módulo Financiero.")
 
     with st.expander("🤖 Zona de Inteligencia Artificial & Machine Learning"):
-        if st.button("📥 Generar Dataset Listo para IA (.csv)"):
-            df_ai = generar_dataset_ia(df_f, c_fecha, c_lote, c_labor, c_rend_hr, c_dni, df_clima)
-            csv = df_ai.to_csv(index=False).encode('utf-8')
-            st.download_button("Descargar CSV Entrenamiento", csv, "dataset_agricola_ia.csv", "text/csv")
\ No newline at end of file
+        # Recorte del feature store (ya calculado), escrito en disco particionado por mes (ver exportacion_ia)
+        formatos_ia = {"CSV comprimido (.csv.gz)": 'csv', "Parquet": 'parquet'} if PARQUET_AVAILABLE else {"CSV comprimido (.csv.gz)": 'csv'}
+        formato_ia = formatos_ia[st.radio("Formato:", list(formatos_ia), horizontal=True, key='formato_ia')]
+        lotes_ia = df_f[c_lote].unique() if sel_variedad != '(TODAS)' else None
+        if st.button("📥 Generar Dataset Listo para IA"):
+            with tempfile.TemporaryDirectory() as carpeta_ia:
+                bloques_ia, temp_media_ia = bloques_features_ia(version_datos, date_range, sel_labor, lotes_ia)
+                resumen_ia = exportar_dataset_ia(bloques_ia, os.path.join(carpeta_ia, 'dataset'), formato_ia, temp_media_ia)
+                ruta_zip = comprimir_directorio(os.path.join(carpeta_ia, 'dataset'), os.path.join(carpeta_ia, 'dataset.zip'))
+                if os.path.getsize(ruta_zip) > BYTES_MAX_DESCARGA_IA:
+                    # download_button retiene el archivo entero en memoria: el periodo largo va por DATASET_IA_DIR
+                    st.warning(f"⚠️ El ZIP ({os.path.getsize(ruta_zip) / 1024 ** 2:,.0f} MB) supera el límite de descarga de "
+                               f"{BYTES_MAX_DESCARGA_IA / 1024 ** 2:,.0f} MB: acota el periodo o escribe el dataset con DATASET_IA_DIR.")
+                else:
+                    with open(ruta_zip, 'rb') as archivo_zip:
+                        st.download_button("Descargar Dataset Entrenamiento (.zip)", archivo_zip, "dataset_agricola_ia.zip", "application/zip")
+            st.caption(f"{resumen_ia['filas']:,} filas en {len(resumen_ia['meses'])} particiones mensuales ({resumen_ia['bytes'] / 1024:,.0f} KB)")
+        dir_ia = directorio_dataset_ia()
+        if dir_ia and st.button(f"💾 Escribir en {dir_ia}"):
+            destino_ia = os.path.join(dir_ia, "_".join([sel_labor, *map(str, date_range)]).replace(' ', '_').replace('/', '-'))
+            bloques_ia, temp_media_ia = bloques_features_ia(version_datos, date_range, sel_labor, lotes_ia)
+            resumen_ia = exportar_dataset_ia(bloques_ia, destino_ia, formato_ia, temp_media_ia)
+            st.success(f"{resumen_ia['filas']:,} filas escritas en {destino_ia} ({', '.join(resumen_ia['meses'])})")
+
+    # --- CASCADA DE TIEMPOS DEL RERUN (panel "Debug Sistema") ---
+    mostrar_traza(panel_perfil)
+    escribir_archivo()  # Solo si METRICAS_ARCHIVO está definido
\ No newline at end of file
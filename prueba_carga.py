@@ -0,0 +1,262 @@
+"""
+Prueba de carga: simula N sesiones concurrentes de pru.py con Streamlit AppTest y mide
+la latencia de cada rerun (p50/p95/p99) y la memoria del proceso.
+
+Google Sheets y Open-Meteo se sirven con el backend local de fuentes_datos (datos grabados
+o sintéticos), así que la prueba corre sin credenciales ni red; la latencia y los fallos del
+upstream se pueden inyectar para ver cómo responden cargas, cachés y fallbacks.
+
+Uso:
+    python prueba_carga.py --sesiones 1 5 10 --reruns 10 --filas 50000
+    python prueba_carga.py --sesiones 20 --datos-dir ./datos_prueba --json resultado.json
+    python prueba_carga.py --sesiones 5 --latencia-ms 200-1500 --prob-fallo 0.2 --tipo-fallo cuota --limpiar-cache
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import timedelta
+
+import numpy as np
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# Mensajes st.error de pru.py que cuentan como rerun fallido (los avisos de conexión a Google no:
+# el fallback a Excel es parte de la prueba)
+ERRORES_APP = ("❌ ERROR CRÍTICO", "Error en filtro", "Error en selector", "No se encontraron columnas críticas")
+
+DIR_APP = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_APP = os.path.join(DIR_APP, "pru.py")
+
+# ==============================================================================
+# ENTORNO LOCAL (BACKEND fuentes_datos + RUNTIME COMPARTIDO)
+# ==============================================================================
+
+def instalar_entorno(directorio, latencia_ms=(0, 0), prob_fallo=0.0, tipo_fallo='error', semilla=None):
+    """
+    Activa el backend local de fuentes_datos (Sheets y clima desde el directorio, con la
+    latencia y fallos indicados) y fija un Runtime único para todas las sesiones.
+
+    AppTest reemplaza Runtime._instance en cada run; con varias sesiones en hilos eso se
+    pisa entre ellas. Se fija una sola vez aquí para todo el proceso.
+    """
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import app_test
+
+    sys.path.insert(0, DIR_APP)
+    import fuentes_datos
+    fuentes_datos.configurar('local', directorio, latencia_ms=latencia_ms, prob_fallo=prob_fallo,
+                             tipo_fallo=tipo_fallo, semilla=semilla)
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # Las asignaciones de AppTest a Runtime._instance quedan en esta subclase y no en la real
+    app_test.Runtime = type('RuntimeCompartido', (Runtime,), {'_instance': None})
+
+def resumen_fuentes():
+    """Lecturas a Sheets por resultado, fallbacks a Excel y hit/miss de caché (desde metricas)."""
+    import metricas
+
+    def plano(metrica):
+        return {'/'.join(k): v for k, v in metrica.muestras().items()}
+    return {
+        'sheets_api': plano(metricas.SHEETS_LLAMADAS),
+        'fallback_excel': plano(metricas.FALLBACK_EXCEL),
+        'cache': plano(metricas.CACHE_LLAMADAS),
+    }
+
+# ==============================================================================
+# SESIONES
+# ==============================================================================
+
+def memoria_proceso_mb():
+    """RSS actual y pico del proceso (MB). Sin psutil, el actual sale de /proc si existe."""
+    pico_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pico = pico_kb / 1024 if sys.platform != 'darwin' else pico_kb / 1024 ** 2
+    if PSUTIL_AVAILABLE:
+        actual = psutil.Process().memory_info().rss / 1024 ** 2
+    else:
+        try:
+            with open('/proc/self/statm') as f:
+                actual = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+        except (OSError, ValueError):
+            actual = None
+    return actual, pico
+
+def _acciones(at, rng, rango_total):
+    """Acciones de sidebar disponibles en el estado actual de la sesión."""
+    acciones = []
+    if at.date_input:
+        def cambiar_periodo():
+            inicio, fin = rango_total
+            dias = (fin - inicio).days
+            a = inicio + timedelta(days=rng.randint(0, max(dias - 1, 0)))
+            at.date_input[0].set_value((a, min(fin, a + timedelta(days=rng.choice([1, 7, 14, 30])))))
+        acciones.append(('periodo', cambiar_periodo))
+    # lote: filtro del Explorador Detallado (Tab 3), que recorta la semana compartida del cruce de temporada
+    for nombre, key in (('labor', 'labor_select'), ('variedad', 'variedad_select'), ('semana', 'semana_select'),
+                        ('lote', 'filtro_lote_select')):
+        sb = at.selectbox(key=key) if any(s.key == key for s in at.selectbox) else None
+        if sb is not None and sb.options:
+            acciones.append((nombre, lambda sb=sb: sb.select_index(rng.randrange(len(sb.options)))))
+    # Labor, variedad y lote (Tab 3) a la vez: filtros por igualdad sobre los datos compartidos
+    filtros = [at.selectbox(key=key) for key in ('labor_select', 'variedad_select', 'filtro_lote_evol_select')
+               if any(s.key == key for s in at.selectbox)]
+    if any(sb.options for sb in filtros):
+        def cambiar_filtros():
+            for sb in filtros:
+                if sb.options:
+                    sb.select_index(rng.randrange(len(sb.options)))
+        acciones.append(('filtros', cambiar_filtros))
+    if any(s.key == 'ratio_slider' for s in at.slider):
+        acciones.append(('ratio', lambda: at.slider(key='ratio_slider').set_value(round(rng.randint(0, 20) * 0.05, 2))))
+    return acciones
+
+def ejecutar_sesion(id_sesion, reruns, timeout, barrera, resultados, semilla):
+    """Una sesión: carga inicial y luego `reruns` cambios aleatorios de sidebar."""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(semilla + id_sesion)
+    at = AppTest.from_file(SCRIPT_APP, default_timeout=timeout)
+    barrera.wait()
+
+    rango_total = None
+    for i in range(reruns + 1):
+        accion = 'inicial'
+        if i > 0:
+            if rango_total is None and at.date_input:
+                rango_total = at.date_input[0].value
+            acciones = _acciones(at, rng, rango_total)
+            if not acciones:
+                break
+            accion, aplicar = rng.choice(acciones)
+            aplicar()
+        t0 = time.perf_counter()
+        error = None
+        try:
+            at.run()
+            if at.exception:
+                error = at.exception[0].value
+            else:
+                # pru.py muestra sus fallos con st.error (+ st.stop), sin excepción
+                error = next((e.value for e in at.error if e.value.startswith(ERRORES_APP)), None)
+        except Exception as e:
+            error = str(e)
+        resultados.append({'sesion': id_sesion, 'accion': accion, 'segundos': time.perf_counter() - t0, 'error': error})
+
+def percentil(valores, p):
+    """Percentil p (0-100) por interpolación lineal."""
+    return float(np.percentile(valores, p)) if valores else float('nan')
+
+def ejecutar_nivel(n_sesiones, reruns, timeout, semilla, limpiar_cache=False):
+    """Lanza n_sesiones en hilos a la vez y resume latencias y memoria."""
+    if limpiar_cache:
+        # Fuerza que el nivel vuelva a leer Sheets/clima (y pase por la latencia/fallos inyectados):
+        # los cargadores de datos son cache_resource, el clima y las agregaciones cache_data
+        import streamlit as st
+        st.cache_data.clear()
+        st.cache_resource.clear()
+    resultados = []
+    barrera = threading.Barrier(n_sesiones)
+    hilos = [threading.Thread(target=ejecutar_sesion, args=(i, reruns, timeout, barrera, resultados, semilla))
+             for i in range(n_sesiones)]
+    t0 = time.perf_counter()
+    for h in hilos: h.start()
+    for h in hilos: h.join()
+    duracion = time.perf_counter() - t0
+
+    tiempos = [r['segundos'] for r in resultados if not r['error']]
+    rss, rss_pico = memoria_proceso_mb()
+    por_accion = {}
+    for r in resultados:
+        if not r['error']:
+            por_accion.setdefault(r['accion'], []).append(r['segundos'])
+    return {
+        'sesiones': n_sesiones,
+        'reruns': len(resultados),
+        'errores': [r['error'] for r in resultados if r['error']][:10],
+        'n_errores': sum(1 for r in resultados if r['error']),
+        'duracion_s': round(duracion, 2),
+        'reruns_por_s': round(len(resultados) / duracion, 2) if duracion else None,
+        'p50_s': round(percentil(tiempos, 50), 4),
+        'p95_s': round(percentil(tiempos, 95), 4),
+        'p99_s': round(percentil(tiempos, 99), 4),
+        'media_s': round(statistics.mean(tiempos), 4) if tiempos else None,
+        'p50_por_accion_s': {k: round(percentil(v, 50), 4) for k, v in sorted(por_accion.items())},
+        'rss_mb': round(rss, 1) if rss is not None else None,
+        'rss_pico_mb': round(rss_pico, 1),
+        # Acumulado del proceso hasta el final de este nivel
+        'fuentes': resumen_fuentes(),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de pru.py con sesiones concurrentes (AppTest).")
+    parser.add_argument('--sesiones', type=int, nargs='+', default=[1, 5, 10], help="Niveles de sesiones concurrentes")
+    parser.add_argument('--reruns', type=int, default=10, help="Cambios de sidebar por sesión")
+    parser.add_argument('--filas', type=int, default=50_000, help="Filas de Data Maestra sintética")
+    parser.add_argument('--datos-dir', help="Directorio del backend local: maestra/calidad (.json grabado o .csv) y clima.json; "
+                                           "si no existen se generan sintéticos")
+    parser.add_argument('--latencia-ms', default='0', help="Latencia por llamada a Sheets/clima: fija ('200') o rango ('100-800')")
+    parser.add_argument('--prob-fallo', type=float, default=0.0, help="Probabilidad de fallo por llamada (0-1)")
+    parser.add_argument('--tipo-fallo', choices=['error', 'cuota', 'timeout'], default='error')
+    parser.add_argument('--limpiar-cache', action='store_true', help="Vaciar st.cache_data y st.cache_resource antes de cada nivel")
+    parser.add_argument('--timeout', type=float, default=300, help="Timeout por rerun (s)")
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--json', metavar='ARCHIVO', help="Guardar el resumen en JSON")
+    args = parser.parse_args(argv)
+
+    # Los avisos de deprecación del script se repetirían en cada rerun de cada sesión
+    warnings.filterwarnings('ignore', category=FutureWarning)
+
+    sys.path.insert(0, DIR_APP)
+    import fuentes_datos
+    directorio = os.path.abspath(args.datos_dir or os.path.join(tempfile.gettempdir(), f"bi_prueba_carga_{args.filas}"))
+    if not any(os.path.exists(os.path.join(directorio, f"maestra{ext}")) for ext in ('.json', '.csv')):
+        fuentes_datos.preparar_sintetico(directorio, args.filas, args.semilla)
+    instalar_entorno(directorio, fuentes_datos._parsear_latencia(args.latencia_ms), args.prob_fallo,
+                     args.tipo_fallo, args.semilla)
+    # Los fallbacks a Excel del app buscan en el directorio actual
+    os.chdir(directorio)
+
+    rss, _ = memoria_proceso_mb()
+    print(f"Datos: {directorio} | RSS inicial: {rss:.0f} MB" if rss is not None else f"Datos: {directorio}")
+    print(f"{'sesiones':>8} {'reruns':>7} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rerun/s':>8} {'RSS MB':>8} {'pico MB':>8}")
+
+    resumen = []
+    for n in args.sesiones:
+        r = ejecutar_nivel(n, args.reruns, args.timeout, args.semilla, args.limpiar_cache)
+        resumen.append(r)
+        print(f"{r['sesiones']:>8} {r['reruns']:>7} {r['n_errores']:>4} {r['p50_s']:>8.3f} {r['p95_s']:>8.3f} {r['p99_s']:>8.3f} "
+              f"{r['reruns_por_s']:>8.2f} {r['rss_mb'] or 0:>8.0f} {r['rss_pico_mb']:>8.0f}")
+        for e in r['errores'][:3]:
+            print(f"         ❌ {e}")
+        if r['fuentes']['sheets_api'] or r['fuentes']['fallback_excel']:
+            print(f"         Sheets: {r['fuentes']['sheets_api']} | Fallback Excel: {r['fuentes']['fallback_excel']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'filas': args.filas, 'niveles': resumen}, f, indent=2, ensure_ascii=False)
+        print(f"Resumen guardado en {args.json}")
+    return 1 if any(r['n_errores'] for r in resumen) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
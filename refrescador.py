@@ -0,0 +1,125 @@
+"""
+Refrescador: carga Data Maestra y Calidad (Google Sheets con fallback a Excel), las limpia,
+calcula los pre-agregados y publica una versión nueva en el almacén Arrow (almacen_arrow);
+Data Maestra se guarda particionada por mes para que la app lea solo el periodo.
+Los pre-agregados se mantienen de forma incremental (mantenimiento_incremental): solo se
+recalculan las fechas cuyas particiones cambiaron respecto de la versión vigente. Entre ellos
+está el feature store del dataset IA (features_ia, con el clima de la temporada).
+Los procesos de la app (ALMACEN_ARROW_DIR apuntando al mismo directorio) toman la versión
+nueva en su siguiente rerun, sin volver a leer de Google.
+
+Uso:
+    python refrescador.py --dir almacen_arrow --una-vez
+    python refrescador.py --dir almacen_arrow --intervalo 600
+Autor: El Pedregal S.A. - Departamento de BI
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+import almacen_arrow
+import google_sheets_utils as gs_utils
+from mantenimiento_incremental import construir_derivadas
+from procesamiento_datos import limpiar_data_maestra, agregar_columnas_derivadas, limpiar_calidad, obtener_clima_ica
+
+# Tablas de la versión vigente que reutiliza el refresco incremental
+TABLAS_INCREMENTALES = ('huellas_maestra', 'huellas_calidad', 'produccion_cruce', 'cubo_defectos', 'features_ia', 'clima')
+
+def particiones_publicadas(col_map):
+    """
+    Tablas que se publican particionadas por mes: Data Maestra por su fecha, con labor y
+    variedad en el mapa de zonas (los filtros del sidebar), y el feature store IA por fecha,
+    con su labor. Calidad va en un solo archivo: el cruce de temporada y el selector de
+    semana de la Tab 3 necesitan todas las semanas, así que siempre se lee entera.
+    """
+    return {'maestra': (col_map.get('Fecha'), [c for c in (col_map.get('Labor'), col_map.get('Variedad')) if c]),
+            'features_ia': ('Fecha', ['Feature_Labor'])}
+
+def _log(mensaje):
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {mensaje}", flush=True)
+
+def version_anterior(directorio):
+    """
+    Tablas de la versión vigente que necesita el refresco incremental (None si no hay
+    versión publicada o no se puede leer: el refresco hace un recálculo completo).
+    """
+    version = almacen_arrow.version_actual(directorio)
+    if not version:
+        return None
+    try:
+        anterior = {'col_map': almacen_arrow.leer_manifiesto(version, directorio).get('col_map')}
+        for nombre in TABLAS_INCREMENTALES:
+            anterior[nombre] = almacen_arrow.abrir_tabla(version, nombre, directorio)
+    except Exception as e:
+        _log(f"⚠️ No se pudo leer {version} para el refresco incremental: {e}")
+        return None
+    return anterior
+
+def construir_tablas(usar_google_sheets=True, anterior=None):
+    """
+    Carga y limpia los datasets, agrega las columnas derivadas y calcula los pre-agregados publicables
+    (solo las fechas que cambiaron si se pasa la versión anterior, ver version_anterior).
+
+    Returns:
+        tuple: (tablas, metadatos) para almacen_arrow.publicar
+    """
+    # Sin esto, load_sheet_as_dataframe devolvería su caché (ttl 600) en vez de releer
+    gs_utils.load_sheet_as_dataframe.clear()
+    df_maestra, df_calidad = gs_utils.load_data_with_fallback(use_google_sheets=usar_google_sheets)
+    if df_maestra.empty:
+        raise RuntimeError("Data Maestra vacía: no se publica una versión nueva")
+
+    df, col_map = limpiar_data_maestra(df_maestra)
+    agregar_columnas_derivadas(df, col_map)
+    if not df_calidad.empty:
+        df_calidad.columns = [str(c).strip() for c in df_calidad.columns]
+    df_calidad, debug_calidad = limpiar_calidad(df_calidad)
+
+    # Clima de toda la temporada para el feature store IA (vacío si la API falla)
+    df_clima = obtener_clima_ica(df['Fecha_Dia'].min(), df['Fecha_Dia'].max()) if 'Fecha_Dia' in df.columns else None
+    derivadas, incremental = construir_derivadas(df, col_map, df_calidad, anterior, df_clima)
+    tablas = dict({'maestra': df, 'calidad': df_calidad}, **derivadas)
+    return tablas, {'col_map': col_map, 'debug_calidad': debug_calidad, 'incremental': incremental}
+
+def refrescar(directorio, conservar=almacen_arrow.VERSIONES_CONSERVADAS, usar_google_sheets=True):
+    """Un ciclo completo: carga, limpieza, pre-agregados y publicación atómica."""
+    inicio = time.perf_counter()
+    tablas, metadatos = construir_tablas(usar_google_sheets, version_anterior(directorio))
+    version = almacen_arrow.publicar(tablas, metadatos, directorio, conservar,
+                                     particiones_publicadas(metadatos['col_map']))
+    filas = ", ".join(f"{n}={len(t):,}" for n, t in tablas.items() if not n.startswith('huellas_'))
+    cambios = ", ".join(f"{k}={v}" for k, v in metadatos['incremental'].items())
+    _log(f"Versión {version} publicada ({filas}; {cambios}) en {time.perf_counter() - inicio:.1f}s")
+    return version
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publica versiones Arrow de los datasets limpios para las apps.")
+    parser.add_argument('--dir', default=almacen_arrow.directorio_configurado() or 'almacen_arrow',
+                        help="Directorio del almacén (el mismo ALMACEN_ARROW_DIR de las apps)")
+    parser.add_argument('--intervalo', type=float, default=600, help="Segundos entre refrescos")
+    parser.add_argument('--una-vez', action='store_true', help="Publicar una sola versión y salir")
+    parser.add_argument('--conservar', type=int, default=almacen_arrow.VERSIONES_CONSERVADAS,
+                        help="Versiones que se mantienen en disco")
+    parser.add_argument('--solo-local', action='store_true', help="No intentar Google Sheets (solo Excel local)")
+    args = parser.parse_args(argv)
+
+    if not almacen_arrow.ARROW_AVAILABLE:
+        print("pyarrow no está instalado.")
+        return 1
+
+    while True:
+        try:
+            refrescar(args.dir, args.conservar, not args.solo_local)
+        except Exception as e:
+            # La versión vigente sigue publicada; las apps no notan el fallo
+            _log(f"❌ Refresco fallido, se mantiene {almacen_arrow.version_actual(args.dir)}: {e}")
+            if args.una_vez:
+                return 1
+        if args.una_vez:
+            return 0
+        time.sleep(args.intervalo)
+
+if __name__ == "__main__":
+    sys.exit(main())